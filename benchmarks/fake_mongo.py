@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import Counter
+
+
+class FakeCollection:
+    """Stands in for a collection: counts every call as a round trip and keeps only documents inserted for setup."""
+
+    def __init__(self, db, name: str):
+        self.db = db
+        self.name = name
+        self.docs = []
+        '''Documents inserted with ``insert_one()``, found by ``find_one()``.'''
+
+    def insert_one(self, doc: dict):
+        """Setup only, not counted."""
+        self.docs.append(doc)
+
+    def find_one(self, filter: dict, projection=None):
+        self.db.round_trip(self.name, 'find_one', 1)
+        for doc in self.docs:
+            if all(doc.get(key) == value for key, value in filter.items()):
+                return doc
+        return None
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.db.round_trip(self.name, 'update_one', 1)
+
+    def bulk_write(self, requests: list, ordered: bool = True):
+        self.db.round_trip(self.name, 'bulk_write', len(requests))
+
+
+class FakeDatabase:
+    """In-process stand-in for ``MongoClient().ecn``, for benchmarking the handlers without MongoDB.
+
+    Every operation is one round trip which sleeps ``latency`` seconds plus ``per_doc`` seconds
+    per document written (releasing the GIL, like waiting on a socket). Round trips, documents
+    and time spent are counted per collection and operation."""
+
+    def __init__(self, latency: float = 0.001, per_doc: float = 0.00001):
+        self.latency = latency
+        self.per_doc = per_doc
+        self.lock = threading.Lock()
+        self.collections = {}
+        self.round_trips = Counter()
+        '''"collection.operation" -> count'''
+        self.documents = Counter()
+        self.wait_time = 0.0
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = FakeCollection(self, name)
+        return collection
+
+    def command(self, name: str):
+        self.round_trip('admin', name, 0)
+        return {'ok': 1.0}
+
+    def round_trip(self, collection: str, operation: str, documents: int):
+        delay = self.latency + self.per_doc * documents
+        with self.lock:
+            key = '%s.%s' % (collection, operation)
+            self.round_trips[key] += 1
+            self.documents[key] += documents
+            self.wait_time += delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'round_trips': dict(self.round_trips),
+                'documents': dict(self.documents),
+                'wait_time': self.wait_time,
+            }
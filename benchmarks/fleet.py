@@ -0,0 +1,102 @@
+import math
+from datetime import datetime, timezone
+
+import numpy as np
+
+from ecn import PPTIK_GRAVITY, StationKind
+from ecn import ecn_mobile_pb2
+from ecn.stationary_v1 import StationaryV1Handler
+
+MOBILE_SAMPLE_RATES = (20, 40, 50, 100)
+MOBILE_UPLOAD_INTERVALS = (1, 2, 5, 10)
+'''Seconds phones buffer before uploading, outside of an earthquake.'''
+
+
+class Fleet:
+    """Reproducible synthetic load: v1 stations and phones sending one simulated second at a time.
+
+    v1 stations send a second of 40 Hz X/Y/Z JSON per message, with ``nan_fraction`` of samples
+    ``nan``. Phones have varied sample rates and upload every 1 to 10 seconds; the first upload
+    starts ``start_offset`` seconds before an hour so streams cross it. ``quake_at`` seconds in,
+    an earthquake reaches the stations in order of distance (P waves at 6 km/s): the shaking
+    makes the detector trigger, and phones which feel it flush their buffers at once and then
+    upload every second until it is over, so messages fan in as a burst.
+    """
+
+    def __init__(self, v1_stations: int = 100, mobile_stations: int = 100, seed: int = 42,
+                 start_time: datetime = datetime(2019, 8, 2, 12, 59, 30, tzinfo=timezone.utc),
+                 quake_at: float = 45, quake_duration: float = 30, nan_fraction: float = 0.01):
+        self.rng = np.random.default_rng(seed)
+        self.start_second = int(start_time.timestamp())
+        self.quake_at = quake_at
+        self.quake_duration = quake_duration
+        self.nan_fraction = nan_fraction
+        self.v1_ids = ['BENCH-%04d' % index for index in range(v1_stations)]
+        self.mobile_ids = [200000 + index for index in range(mobile_stations)]
+        count = v1_stations + mobile_stations
+        distances = self.rng.uniform(5, 200, count)
+        self.onsets = quake_at + distances / 6.0
+        '''Seconds from the start at which each station (v1 first, then phones) feels the earthquake.'''
+        self.amplitudes = 3.0 * np.exp(-distances / 80)
+        self.frequencies = self.rng.uniform(1.5, 6, count)
+        self.sample_rates = self.rng.choice(MOBILE_SAMPLE_RATES, mobile_stations).tolist()
+        self.intervals = self.rng.choice(MOBILE_UPLOAD_INTERVALS, mobile_stations).tolist()
+
+    def station_docs(self) -> list:
+        """v1 station documents, for ``StationaryV1Handler.load_station()`` to find."""
+        return [{'_id': 100000 + index, 'k': StationKind.V1, 'i': client_id}
+                for index, client_id in enumerate(self.v1_ids)]
+
+    def shaking(self, station: int, times: np.ndarray) -> np.ndarray:
+        """Ground acceleration of a station at ``times`` (seconds from the start), m/s^2."""
+        elapsed = times - self.onsets[station]
+        envelope = np.where(elapsed > 0, np.exp(-np.maximum(elapsed, 0) / (self.quake_duration / 4)) *
+                            np.minimum(np.maximum(elapsed, 0) * 2, 1), 0)
+        return self.amplitudes[station] * envelope * np.sin(2 * math.pi * self.frequencies[station] * times)
+
+    def messages(self, seconds: int):
+        """Yields (received_at, queue key, body) second by second, each second's messages shuffled."""
+        buffered_from = [-(offset % interval) for offset, interval in
+                         zip(self.rng.integers(0, 10, len(self.mobile_ids)).tolist(), self.intervals)]
+        for second in range(seconds):
+            batch = [('stationary_v1', self.v1_body(index, second)) for index in range(len(self.v1_ids))]
+            for index in range(len(self.mobile_ids)):
+                station = len(self.v1_ids) + index
+                quaking = self.onsets[station] <= second + 1 < self.onsets[station] + self.quake_duration
+                first = max(buffered_from[index], 0)
+                if second + 1 - first >= self.intervals[index] or quaking:
+                    batch.append(('mobile_stream', self.mobile_body(index, first, second + 1)))
+                    buffered_from[index] = second + 1
+            order = self.rng.permutation(len(batch)).tolist()
+            for position in order:
+                yield (self.start_second + second + 1, *batch[position])
+
+    def v1_body(self, index: int, second: int) -> bytes:
+        rate = StationaryV1Handler.SAMPLE_RATE
+        times = second + np.arange(rate) / rate
+        xyz = self.rng.normal(0, 0.01, (rate, 3))
+        # Default calibration: device Z is up (minus gravity), X north, Y east
+        motion = self.shaking(index, times)
+        xyz[:, 2] += PPTIK_GRAVITY - motion
+        xyz[:, 0] += 0.6 * motion
+        xyz[:, 1] += 0.4 * motion
+        values = ['%.5f' % value for value in xyz.ravel().tolist()]
+        for position in np.flatnonzero(self.rng.random(len(values)) < self.nan_fraction).tolist():
+            values[position] = 'nan'
+        samples = ','.join('{"x":%s,"y":%s,"z":%s}' % tuple(values[offset:offset + 3])
+                           for offset in range(0, len(values), 3))
+        return ('{"clientID":"%s","accelerations":[%s]}' % (self.v1_ids[index], samples)).encode()
+
+    def mobile_body(self, index: int, first: int, end: int) -> bytes:
+        """A MobileStream of seconds ``first`` up to ``end``, starting a few milliseconds into the second."""
+        rate = self.sample_rates[index]
+        times = first + np.arange((end - first) * rate) / rate
+        motion = self.shaking(len(self.v1_ids) + index, times)
+        msg = ecn_mobile_pb2.MobileStream()
+        msg.station_id = self.mobile_ids[index]
+        msg.start_time = (self.start_second + first) * 1000 + int(self.rng.integers(0, 20))
+        msg.sample_rate = rate
+        msg.accel_z.extend((motion + self.rng.normal(0, 0.02, len(times))).tolist())
+        msg.accel_n.extend((0.6 * motion + self.rng.normal(0, 0.02, len(times))).tolist())
+        msg.accel_e.extend((0.4 * motion + self.rng.normal(0, 0.02, len(times))).tolist())
+        return msg.SerializeToString()
@@ -0,0 +1,347 @@
+# Measures ingest throughput of the AmqpProcessor and handlers on a synthetic fleet, against an in-process Mongo stand-in.
+# Usage: python -m benchmarks.ingest --help, e.g. python -m benchmarks.ingest --workers 4 --save after.json --compare before.json
+import argparse
+import heapq
+import json
+import platform
+import queue
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.fake_mongo import FakeDatabase
+from benchmarks.fleet import Fleet
+from ecn.amqp import AmqpProcessor
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.continuous import ContinuousHandler
+from ecn.detection import StaLtaDetector, TriggerPublisher
+from ecn.liveness import LivenessTracker
+from ecn.metrics import IngestMetrics
+from ecn.mobile import MobileHandler
+from ecn.stationary_v1 import StationaryV1Handler
+from ecn.summary import AccelSummarizer
+
+Method = namedtuple('Method', ['delivery_tag'])
+
+REGRESSION_THRESHOLDS = {
+    'msgs_per_s': -0.10,
+    'handler_p50_ms': 0.20,
+    'handler_p99_ms': 0.20,
+    'ack_p99_ms': 0.20,
+    'mongo_ops_per_msg': 0.05,
+    'alloc_p50_bytes': 0.20,
+}
+'''Result -> relative change beyond which ``--compare`` reports a regression (negative: lower is worse).'''
+RUN_OPTIONS = ('memory', 'save', 'compare')
+'''Options which do not change the workload, ignored when comparing configurations.'''
+DETECT_QUEUE = 'ecn_detection'
+'''Queue the detector publishes triggers to, as stationd's DETECT_QUEUE.'''
+
+
+class FakeIoloop:
+    """Runs callbacks and timers on the benchmark's thread, as pika's ioloop would on its own."""
+
+    def __init__(self):
+        self.callbacks = queue.Queue()
+        self.timers = []
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def call_later(self, delay: float, callback):
+        heapq.heappush(self.timers, (time.perf_counter() + delay, id(callback), callback))
+
+    def run_pending(self):
+        while True:
+            try:
+                callback = self.callbacks.get_nowait()
+            except queue.Empty:
+                break
+            callback()
+        now = time.perf_counter()
+        while self.timers and self.timers[0][0] <= now:
+            heapq.heappop(self.timers)[2]()
+
+
+class FakeConnection:
+    def __init__(self):
+        self.ioloop = FakeIoloop()
+
+
+class FakeChannel:
+    """Records acks and publishes of the processor."""
+
+    def __init__(self):
+        self.is_open = True
+        self.channel_number = 1
+        self.acked = {}
+        '''Delivery tag -> time.perf_counter() when acked.'''
+        self.unacked = set()
+        self.nacked = 0
+        self.published = []
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def basic_qos(self, prefetch_count: int):
+        pass
+
+    def basic_consume(self, queue: str, on_message_callback, exclusive: bool = False) -> str:
+        return 'ctag-%s' % queue
+
+    def queue_declare(self, queue: str, durable: bool = False):
+        pass
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        now = time.perf_counter()
+        tags = [tag for tag in self.unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        for tag in tags:
+            self.unacked.discard(tag)
+            self.acked[tag] = now
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True):
+        self.unacked.discard(delivery_tag)
+        self.nacked += 1
+
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes):
+        self.published.append((routing_key, body))
+
+
+class TimedHandler:
+    """Wraps a handler to time each ``receive()``, and with ``memory`` its peak allocation (tracemalloc).
+
+    v1 messages are received at their simulated time, looked up in ``received_at`` by body."""
+
+    def __init__(self, handler, memory: bool = False):
+        self.handler = handler
+        self.memory = memory
+        self.received_at = {}
+        self.latencies = []
+        self.allocations = []
+
+    def partition_key(self, body: bytes) -> bytes:
+        return self.handler.partition_key(body)
+
+    def receive(self, body: bytes):
+        received_at = self.received_at.pop(body, None)
+        if self.memory:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        if received_at is None:
+            self.handler.receive(body)
+        else:
+            self.handler.receive(body, received_at)
+        self.latencies.append(time.perf_counter() - started)
+        if self.memory:
+            self.allocations.append(tracemalloc.get_traced_memory()[1] - before)
+
+
+def build(db: FakeDatabase, args, memory: bool) -> AmqpProcessor:
+    """Wires processor, writer and handlers like ``stationd.run_worker()``, on a fake connection and channel."""
+    writer = AccelBulkWriter(db, max_ops=args.max_ops, max_delay=args.max_delay)
+    cache = MetadataCache()
+    processor = AmqpProcessor(prefetch_count=args.prefetch, workers=args.workers)
+    processor.bulk_writer = writer
+    processor.conn = FakeConnection()
+    metrics = IngestMetrics() if args.metrics else None
+    processor.metrics = metrics
+    detector = None
+    if args.detect:
+        detector = StaLtaDetector(on_trigger=TriggerPublisher(db, cache, processor.publish, DETECT_QUEUE))
+        processor.publish_queues.append(DETECT_QUEUE)
+    summarizer = AccelSummarizer(db, writer, cache) if args.summary else None
+    liveness = LivenessTracker(writer) if args.liveness else None
+    processor.stationary_v1_handler = TimedHandler(
+        StationaryV1Handler(db, writer, cache, args.accel_format, detector, summarizer, liveness, metrics), memory)
+    processor.mobile_handler = TimedHandler(
+        MobileHandler(db, writer, cache, args.accel_format, detector, summarizer, liveness, metrics), memory)
+    processor.continuous_handler = TimedHandler(
+        ContinuousHandler(db, writer, cache, args.accel_format, summarizer, liveness), memory)
+    processor.on_channel_open(FakeChannel())
+    return processor
+
+
+def run(args, messages: list, memory: bool = False) -> dict:
+    """Delivers ``messages`` through the processor's consume callbacks, counting the published triggers."""
+    db = FakeDatabase(args.latency / 1000, args.per_doc / 1000)
+    for doc in Fleet(args.v1, args.mobile, args.seed).station_docs():
+        db.station.insert_one(doc)
+    processor = build(db, args, memory)
+    channel: FakeChannel = processor.channel
+    ioloop: FakeIoloop = processor.conn.ioloop
+    consumers = {
+        'stationary_v1': processor.consume_stationary_v1,
+        'mobile_stream': processor.consume_mobile_stream,
+    }
+    for received_at, key, body in messages:
+        if key == 'stationary_v1':
+            processor.stationary_v1_handler.received_at[body] = received_at
+    pending = list(messages)
+    pending.reverse()
+    delivered = {}
+    tag = 0
+    detections = 0
+    if memory:
+        tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0] if memory else 0
+    started = time.perf_counter()
+    while pending:
+        while args.prefetch and len(channel.unacked) >= args.prefetch:
+            ioloop.run_pending()
+            time.sleep(0.0001)
+        received_at, key, body = pending.pop()
+        tag += 1
+        channel.unacked.add(tag)
+        delivered[tag] = time.perf_counter()
+        consumers[key](channel, Method(tag), None, body)
+        ioloop.run_pending()
+        # Triggers go to downstream consumers, not back to us
+        detections += len(channel.published)
+        channel.published = []
+    processor.bulk_writer.flush()
+    while channel.unacked:
+        ioloop.run_pending()
+        processor.bulk_writer.flush_if_due()
+        time.sleep(0.0001)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - baseline if memory else 0
+    if memory:
+        tracemalloc.stop()
+
+    latencies = {key: handler.latencies for key, handler in (
+        ('stationary_v1', processor.stationary_v1_handler), ('mobile_stream', processor.mobile_handler))}
+    all_latencies = np.array(sum(latencies.values(), [])) * 1000
+    ack_latencies = np.array([channel.acked[tag] - delivered[tag] for tag in delivered if tag in channel.acked]) * 1000
+    mongo = db.stats()
+    results = {
+        'messages': tag,
+        'elapsed_s': elapsed,
+        'msgs_per_s': tag / elapsed,
+        'handler_p50_ms': float(np.percentile(all_latencies, 50)),
+        'handler_p99_ms': float(np.percentile(all_latencies, 99)),
+        'ack_p50_ms': float(np.percentile(ack_latencies, 50)),
+        'ack_p99_ms': float(np.percentile(ack_latencies, 99)),
+        'mongo_ops_per_msg': sum(mongo['round_trips'].values()) / tag,
+        'mongo_wait_s': mongo['wait_time'],
+        'mongo_round_trips': mongo['round_trips'],
+        'nacked': channel.nacked,
+        'detections': detections,
+        'per_queue': {key: {'messages': len(values),
+                            'p50_ms': float(np.percentile(values, 50)) * 1000 if values else 0.0,
+                            'p99_ms': float(np.percentile(values, 99)) * 1000 if values else 0.0}
+                      for key, values in latencies.items()},
+    }
+    if memory:
+        allocations = sum((handler.allocations for handler in (
+            processor.stationary_v1_handler, processor.mobile_handler)), [])
+        results.update({
+            'alloc_p50_bytes': float(np.percentile(allocations, 50)),
+            'alloc_p99_bytes': float(np.percentile(allocations, 99)),
+            'peak_bytes': peak,
+        })
+    return results
+
+
+def compare(results: dict, baseline: dict) -> bool:
+    """Prints changes against a saved run, returns True if any result regressed beyond its threshold."""
+    regressed = False
+    print('Compared with %s (%s):' % (baseline.get('commit') or 'baseline', baseline.get('time')))
+    for key, threshold in REGRESSION_THRESHOLDS.items():
+        if key not in results or not baseline['results'].get(key):
+            continue
+        before, after = baseline['results'][key], results[key]
+        change = (after - before) / before
+        worse = change < threshold if threshold < 0 else change > threshold
+        regressed = regressed or worse
+        print('  %-18s %12.3f -> %12.3f  %+6.1f%%%s' % (key, before, after, change * 100,
+                                                     '  REGRESSION' if worse else ''))
+    return regressed
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.ingest',
+                                     description='Ingest benchmark on a synthetic fleet, see README "Benchmarks".')
+    parser.add_argument('--v1', type=int, default=100, help='v1 stations')
+    parser.add_argument('--mobile', type=int, default=100, help='mobile stations')
+    parser.add_argument('--seconds', type=int, default=120, help='simulated seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=0, help='handler threads, as WORKERS')
+    parser.add_argument('--prefetch', type=int, default=500, help='unacked deliveries, as AMQP_PREFETCH')
+    parser.add_argument('--max-ops', type=int, default=500, help='as BULK_MAX_OPS')
+    parser.add_argument('--max-delay', type=float, default=0.25, help='as BULK_MAX_DELAY')
+    parser.add_argument('--accel-format', type=int, default=1, help='as ACCEL_FORMAT')
+    parser.add_argument('--no-detect', dest='detect', action='store_false', help='without trigger detection')
+    parser.add_argument('--no-summary', dest='summary', action='store_false', help='without accel summaries')
+    parser.add_argument('--no-liveness', dest='liveness', action='store_false', help='write station state per message')
+    parser.add_argument('--metrics', action='store_true', help='with instrumentation, as METRICS_PORT')
+    parser.add_argument('--latency', type=float, default=1.0, help='simulated Mongo round trip, ms')
+    parser.add_argument('--per-doc', type=float, default=0.01, help='simulated Mongo time per document written, ms')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the second, tracemalloc-instrumented run measuring allocations')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved earlier, exit 1 on regression')
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(args.v1, args.mobile, args.seed)
+    messages = list(fleet.messages(args.seconds))
+    print('%d messages from %d v1 and %d mobile stations over %d s' %
+          (len(messages), args.v1, args.mobile, args.seconds))
+    results = run(args, messages)
+    if args.memory and not hasattr(tracemalloc, 'reset_peak'):
+        print('Not measuring allocations: tracemalloc.reset_peak() needs Python 3.9')
+        args.memory = False
+    if args.memory:
+        # Tracing slows everything down, so allocations come from a run of their own
+        memory_results = run(args, messages, memory=True)
+        results.update((key, memory_results[key]) for key in ('alloc_p50_bytes', 'alloc_p99_bytes', 'peak_bytes'))
+
+    print('%(messages)d messages in %(elapsed_s).2f s: %(msgs_per_s).0f msgs/s' % results)
+    print('handler p50 %(handler_p50_ms).3f ms, p99 %(handler_p99_ms).3f ms; '
+          'ack p50 %(ack_p50_ms).1f ms, p99 %(ack_p99_ms).1f ms' % results)
+    for key, queue_results in results['per_queue'].items():
+        print('  %-14s %7d messages, p50 %.3f ms, p99 %.3f ms' % (key, queue_results['messages'],
+                                                                  queue_results['p50_ms'], queue_results['p99_ms']))
+    print('%(detections)d triggers published' % results)
+    print('Mongo: %.3f round trips/message, %.2f s waited, %s' %
+          (results['mongo_ops_per_msg'], results['mongo_wait_s'], results['mongo_round_trips']))
+    if args.memory:
+        print('Allocated per message: p50 %(alloc_p50_bytes).0f bytes, p99 %(alloc_p99_bytes).0f bytes; '
+              'peak %(peak_bytes)d bytes' % results)
+
+    run_info = {
+        'commit': git_commit(),
+        'time': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run_info, f, indent=2)
+        print('Saved results to %s' % args.save)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        options = {key: value for key, value in vars(args).items() if key not in RUN_OPTIONS}
+        if {key: value for key, value in baseline['config'].items() if key not in RUN_OPTIONS} != options:
+            print('Warning: %s was run with other options: %s' % (args.compare, baseline['config']))
+        if compare(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Compares MobileHandler's vectorized hour bucketing with the original per-second loop.
+# Usage: python -m benchmarks.mobile_bucketing [seconds] [sample_rate]
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.fake_mongo import FakeDatabase
+from ecn import ecn_mobile_pb2
+from ecn.mobile import MobileHandler
+
+
+def loop_sets(msg: ecn_mobile_pb2.MobileStream) -> dict:
+    """The original MobileHandler.receive loop, returning accel_id -> $set paths."""
+    sets = {}
+    cur_time = datetime.utcfromtimestamp(msg.start_time/1000)
+    cur_hour = cur_time.strftime('%Y%m%d%H')
+    accel_buf = {}
+    sample_idx = 0
+    while sample_idx < len(msg.accel_z):
+        second_of_hour = 60 * cur_time.minute + cur_time.second
+        accel_buf['z.%d' % second_of_hour] = msg.accel_z[sample_idx : sample_idx + msg.sample_rate]
+        accel_buf['n.%d' % second_of_hour] = msg.accel_n[sample_idx : sample_idx + msg.sample_rate]
+        accel_buf['e.%d' % second_of_hour] = msg.accel_e[sample_idx : sample_idx + msg.sample_rate]
+        sample_idx += msg.sample_rate
+        cur_time = cur_time + timedelta(seconds=1)
+        next_hour = cur_time.strftime('%Y%m%d%H')
+        if next_hour != cur_hour:
+            sets['%s:%s' % (cur_hour, msg.station_id)] = accel_buf
+            accel_buf = {}
+            cur_hour = next_hour
+    if accel_buf:
+        sets['%s:%s' % (cur_hour, msg.station_id)] = accel_buf
+    return sets
+
+
+class CapturingWriter:
+    """Stands in for AccelBulkWriter, keeping the accel ``$set`` fields of the last message."""
+
+    def __init__(self):
+        self.accel_sets = {}
+
+    def set_accel(self, accel_id: str, fields: dict):
+        self.accel_sets.setdefault(accel_id, {}).update(fields)
+
+    def set_station(self, station_id, fields: dict):
+        pass
+
+
+def handler_sets(handler: MobileHandler, body: bytes) -> dict:
+    """Same result as ``loop_sets()``, from ``MobileHandler.receive()`` on a ``CapturingWriter``."""
+    handler.writer.accel_sets = {}
+    handler.receive(body)
+    return handler.writer.accel_sets
+
+
+def make_stream(seconds: int, sample_rate: int) -> ecn_mobile_pb2.MobileStream:
+    """A buffered upload which starts mid-second, crosses an hour and ends with a partial second."""
+    sample_count = seconds * sample_rate + sample_rate // 2
+    rng = np.random.default_rng(42)
+    msg = ecn_mobile_pb2.MobileStream()
+    msg.station_id = 1234
+    # 2019-08-02 12:58:20.250 UTC
+    msg.start_time = 1564750700250
+    msg.sample_rate = sample_rate
+    msg.accel_z.extend(rng.normal(0, 0.05, sample_count).tolist())
+    msg.accel_n.extend(rng.normal(0, 0.05, sample_count).tolist())
+    msg.accel_e.extend(rng.normal(0, 0.05, sample_count).tolist())
+    return msg
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    sample_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    body = make_stream(seconds, sample_rate).SerializeToString()
+    handler = MobileHandler(FakeDatabase(latency=0, per_doc=0), CapturingWriter())
+    assert loop_sets(ecn_mobile_pb2.MobileStream.FromString(body)) == handler_sets(handler, body), \
+        'MobileHandler bucketing differs from the loop'
+
+    # receive() parses the stream, so the loop is timed with parsing too
+    number = 5
+    parse_time = min(timeit.repeat(lambda: ecn_mobile_pb2.MobileStream.FromString(body),
+                                   number=number, repeat=3)) / number
+    loop_time = min(timeit.repeat(lambda: loop_sets(ecn_mobile_pb2.MobileStream.FromString(body)),
+                                  number=number, repeat=3)) / number
+    handler_time = min(timeit.repeat(lambda: handler_sets(handler, body), number=number, repeat=3)) / number
+    print('%d s @ %d Hz, parse %.2f ms included: loop %.2f ms, MobileHandler %.2f ms (%.1fx)' %
+          (seconds, sample_rate, parse_time * 1000, loop_time * 1000, handler_time * 1000, loop_time / handler_time))
+
+if __name__ == '__main__':
+    main()
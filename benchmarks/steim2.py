@@ -0,0 +1,194 @@
+# Compares the vectorized streaming MiniSEED writer with a plain per-sample Steim2 reference encoder.
+# Usage: python -m benchmarks.steim2 [seconds] [sample_rate]
+import calendar
+import os
+import sys
+import tempfile
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from ecn.export import MiniSeedWriter
+
+# The reference below follows the SEED 2.4 manual (chapter 8 and appendix B) and shares no code with ecn.export:
+# headers are packed field by field at the manual's byte offsets, times come from the sample index.
+HEADER_LENGTH = 64
+'''Fixed header (48 bytes) and blockette 1000 (8 bytes), padded to a Steim frame.'''
+STEIM2 = 11
+'''Blockette 1000 encoding format.'''
+PACKINGS = ((7, 4, 3, 2), (6, 5, 3, 1), (5, 6, 3, 0), (4, 8, 1, None), (3, 10, 2, 3), (2, 15, 2, 2), (1, 30, 2, 1))
+'''Steim2 (differences per word, bits, nibble, dnib), densest first.'''
+
+
+def fits(value: int, bits: int) -> bool:
+    return -(1 << (bits - 1)) <= value < 1 << (bits - 1)
+
+
+def sample_time(start: int, index: int, sample_rate: int) -> int:
+    """Time of sample ``index`` of a segment starting at second ``start``, in 0.0001 s rounded half up."""
+    return int(Fraction(start * 10000) + Fraction(index * 10000, sample_rate) + Fraction(1, 2))
+
+
+def record_header(sequence: int, codes: tuple, start: int, count: int, sample_rate: int, record_length: int) -> bytes:
+    """Fixed header and blockette 1000 of a Steim2 data record. ``codes`` are (network, station, location, channel),
+    ``start`` is in 0.0001 s."""
+    network, station, location, channel = codes
+    header = bytearray(HEADER_LENGTH)
+    header[0:6] = b'%06d' % sequence
+    header[6:8] = b'D '                           # quality indicator, reserved
+    header[8:13] = station.encode().ljust(5)
+    header[13:15] = location.encode().ljust(2)
+    header[15:18] = channel.encode().ljust(3)
+    header[18:20] = network.encode().ljust(2)
+    seconds, fraction = divmod(start, 10000)
+    utc = time.gmtime(seconds)
+    header[20:22] = utc.tm_year.to_bytes(2, 'big')  # BTIME
+    header[22:24] = utc.tm_yday.to_bytes(2, 'big')
+    header[24:27] = bytes((utc.tm_hour, utc.tm_min, utc.tm_sec))
+    header[28:30] = fraction.to_bytes(2, 'big')
+    header[30:32] = count.to_bytes(2, 'big')
+    header[32:34] = sample_rate.to_bytes(2, 'big')  # sample rate factor
+    header[34:36] = (1).to_bytes(2, 'big')          # sample rate multiplier
+    # 36-38: activity, I/O and quality flags, 40-43: time correction, all 0
+    header[39] = 1                                  # blockettes following
+    header[44:46] = HEADER_LENGTH.to_bytes(2, 'big')  # beginning of data
+    header[46:48] = (48).to_bytes(2, 'big')         # first blockette
+    header[48:50] = (1000).to_bytes(2, 'big')       # blockette 1000, the last one
+    header[52:55] = bytes((STEIM2, 1, record_length.bit_length() - 1))  # encoding, big endian, length exponent
+    return bytes(header)
+
+
+def reference_records(values: list, codes: tuple, start: int, first_sample: int, sample_rate: int,
+                      sequence: int = 0, record_length: int = 4096) -> bytes:
+    """Encodes one contiguous segment of int samples, record by record and sample by sample.
+
+    The segment starts at sample ``first_sample`` after second ``start``. Like libmseed, the first
+    difference of the segment is 0, later records difference against the last sample of the
+    previous one, and each word takes the densest packing its next differences fit."""
+    frames = (record_length - HEADER_LENGTH) // 64
+    output = b''
+    begin = 0
+    previous = None
+    while begin < len(values):
+        record = [[0] * 16 for frame in range(frames)]
+        frame, word = 0, 3
+        position = begin
+        while position < len(values) and frame < frames:
+            diffs = []
+            for index in range(position, min(position + 7, len(values))):
+                last = values[index - 1] if index > begin else (values[begin] if previous is None else previous)
+                diffs.append(values[index] - last)
+            for per_word, bits, nibble, dnib in PACKINGS:
+                if len(diffs) >= per_word and all(fits(diff, bits) for diff in diffs[:per_word]):
+                    break
+            else:
+                raise ValueError('Difference does not fit Steim2')
+            packed = 0 if dnib is None else dnib << 30
+            for index, diff in enumerate(diffs[:per_word]):
+                packed |= (diff & ((1 << bits) - 1)) << (bits * (per_word - 1 - index))
+            record[frame][word] = packed
+            record[frame][0] |= nibble << (30 - 2 * word)
+            position += per_word
+            word += 1
+            if word == 16:
+                frame, word = frame + 1, 1
+        record[0][1] = values[begin] & 0xffffffff
+        record[0][2] = values[position - 1] & 0xffffffff
+        sequence += 1
+        header = record_header(sequence, codes, sample_time(start, first_sample + begin, sample_rate),
+                               position - begin, sample_rate, record_length)
+        data = b''.join(word.to_bytes(4, 'big') for frame in record for word in frame)
+        output += header + data
+        previous = values[position - 1]
+        begin = position
+    return output
+
+
+def decode_records(data: bytes, record_length: int = 4096) -> list:
+    """Decodes Steim2 records into (start in 0.0001 s, samples) each, checking blockette 1000 and the
+    integration constants."""
+    records = []
+    for offset in range(0, len(data), record_length):
+        record = data[offset:offset + record_length]
+        assert record[6:7] == b'D' and int.from_bytes(record[48:50], 'big') == 1000, 'not a data record'
+        assert record[52:55] == bytes((STEIM2, 1, record_length.bit_length() - 1)), 'not big endian Steim2'
+        year, day = int.from_bytes(record[20:22], 'big'), int.from_bytes(record[22:24], 'big')
+        seconds = calendar.timegm((year, 1, day, record[24], record[25], record[26]))
+        start = seconds * 10000 + int.from_bytes(record[28:30], 'big')
+        count = int.from_bytes(record[30:32], 'big')
+        data_offset = int.from_bytes(record[44:46], 'big')
+        words = [int.from_bytes(record[index:index + 4], 'big') for index in range(data_offset, record_length, 4)]
+        frames = [words[index:index + 16] for index in range(0, len(words), 16)]
+        diffs = []
+        for frame_index, frame in enumerate(frames):
+            for index in range(3 if frame_index == 0 else 1, 16):
+                nibble, word = frame[0] >> (30 - 2 * index) & 3, frame[index]
+                for per_word, bits, packing_nibble, dnib in PACKINGS:
+                    if packing_nibble == nibble and (dnib is None or word >> 30 == dnib):
+                        for shift in range(bits * (per_word - 1), -1, -bits):
+                            diff = word >> shift & ((1 << bits) - 1)
+                            diffs.append(diff - (1 << bits) if diff >= 1 << (bits - 1) else diff)
+                        break
+        first = frames[0][1] - (1 << 32) if frames[0][1] >= 1 << 31 else frames[0][1]
+        samples = list(np.cumsum([first] + diffs[1:count]))
+        last = frames[0][2] - (1 << 32) if frames[0][2] >= 1 << 31 else frames[0][2]
+        assert samples[-1] == last, 'reverse integration constant mismatch'
+        records.append((start, samples))
+    return records
+
+
+def make_hours(hours: int, sample_rate: int) -> np.ndarray:
+    """Hours of float32 accelerations in m/s², with gaps within and across hour boundaries."""
+    rng = np.random.default_rng(42)
+    samples = hours * 3600 * sample_rate
+    data = (9.8 + np.cumsum(rng.normal(0, 0.002, samples)) + rng.normal(0, 0.01, samples)).astype(np.float32)
+    data[rng.integers(0, samples, 20)] = rng.normal(0, 1, 20) # spikes
+    data[1000:1000 + 5 * sample_rate] = np.nan
+    data[3600 * sample_rate - 7:3600 * sample_rate + 3 * sample_rate] = np.nan
+    return data
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 7200
+    sample_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    data = make_hours(-(-seconds // 3600), sample_rate)[:seconds * sample_rate]
+    start = 1564750800 # 2019-08-02 13:00 UTC
+    codes = ('XX', 'TEST', '', 'BNZ')
+    chunk = 3600 * sample_rate
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.mseed')
+        started = time.perf_counter()
+        writer = MiniSeedWriter(path, *codes, sample_rate)
+        for offset in range(0, len(data), chunk):
+            writer.write(sample_time(start, offset, sample_rate), data[offset:offset + chunk])
+        writer.close()
+        vectorized_time = time.perf_counter() - started
+        with open(path, 'rb') as f:
+            written = f.read()
+
+    started = time.perf_counter()
+    expected = b''
+    counts = np.rint(data.astype(np.float64) / 1e-6)
+    finite = np.isfinite(data)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], finite.view(np.int8), [0]))))
+    for begin, end in zip(edges[::2], edges[1::2]):
+        expected += reference_records([int(value) for value in counts[begin:end]], codes, start, int(begin),
+                                      sample_rate, len(expected) // 4096)
+    reference_time = time.perf_counter() - started
+    assert written == expected, 'vectorized MiniSEED differs from the reference encoder'
+
+    decoded = decode_records(written)
+    assert np.array_equal(np.concatenate([samples for record_start, samples in decoded]),
+                          counts[finite].astype(np.int64)), 'decoded samples differ'
+    first_samples = np.flatnonzero(finite)[np.cumsum([0] + [len(samples) for record_start, samples in decoded[:-1]])]
+    assert [record_start for record_start, samples in decoded] == \
+        [sample_time(start, index, sample_rate) for index in first_samples.tolist()], 'record start times differ'
+    print('%d s @ %d Hz: %d records, reference %.2f s, vectorized %.3f s (%.0fx), %.2f bytes/sample' %
+          (seconds, sample_rate, len(written) // 4096, reference_time, vectorized_time,
+           reference_time / vectorized_time, len(written) / finite.sum()))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,4 +13,11 @@ class StationState:
     ECO = 'E'
     HIGH_RATE = 'H'
     NORMAL_RATE = 'N'
-    LOST = 'L'
\ No newline at end of file
+    LOST = 'L'
+
+class AccelFormat:
+    """Encoding of each second of samples in accel hour documents (field ``v``, missing means LIST)."""
+    LIST = 1
+    '''Array of BSON doubles, None for missing samples.'''
+    FLOAT32 = 2
+    '''Packed little-endian float32 Binary, NaN for missing samples.'''
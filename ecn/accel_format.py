@@ -0,0 +1,74 @@
+import numpy as np
+from bson.binary import Binary
+
+from ecn import AccelFormat
+
+FLOAT32 = np.dtype('<f4')
+
+
+def encode_seconds(rows: np.ndarray, accel_format: int) -> list:
+    """Encodes rows of shape (seconds, samples) into per-second values of ``accel_format``.
+
+    For LIST, NaN samples become None."""
+    if accel_format == AccelFormat.FLOAT32:
+        row_size = rows.shape[1] * FLOAT32.itemsize
+        if not row_size:
+            return [Binary(b'') for row in rows]
+        data = rows.astype(FLOAT32, copy=False).tobytes()
+        return [Binary(data[offset:offset + row_size]) for offset in range(0, len(data), row_size)]
+    values = rows.tolist()
+    if np.isnan(rows).any():
+        values = [[None if sample != sample else sample for sample in row] for row in values]
+    return values
+
+
+def encode_second(samples: list, accel_format: int):
+    """Encodes one second of samples (None for missing) into a value of ``accel_format``."""
+    if accel_format == AccelFormat.FLOAT32:
+        return Binary(np.array(samples, dtype=FLOAT32).tobytes())
+    return samples
+
+
+def decode_seconds(seconds: list, sample_rate: int) -> np.ndarray:
+    """Decodes per-second values of any format into a float32 array of shape (len(seconds), sample_rate).
+
+    Missing seconds and samples are NaN."""
+    row_size = sample_rate * FLOAT32.itemsize
+    if all(isinstance(second, bytes) and len(second) == row_size for second in seconds):
+        # Common case: every second is a complete FLOAT32 blob, one copy and no per-sample objects
+        return np.frombuffer(b''.join(seconds), dtype=FLOAT32).reshape(len(seconds), sample_rate)
+
+    rows = np.full((len(seconds), sample_rate), np.nan, dtype=FLOAT32)
+    for index, second in enumerate(seconds):
+        if second is None:
+            continue
+        if isinstance(second, bytes):
+            samples = np.frombuffer(second, dtype=FLOAT32)
+        else:
+            samples = np.array(second, dtype=FLOAT32)
+        samples = samples[:sample_rate]
+        rows[index, :len(samples)] = samples
+    return rows
+
+
+def list_second(second) -> list:
+    """Converts one second of any format to LIST as stored, without float32 rounding or padding.
+
+    FLOAT32 NaN samples become None."""
+    if not isinstance(second, bytes):
+        return second
+    return [None if sample != sample else sample for sample in np.frombuffer(second, dtype=FLOAT32).tolist()]
+
+
+def read_hour(accel_doc: dict, channels=('z', 'n', 'e')) -> np.ndarray:
+    """Returns the samples of an accel hour document as a float32 array of shape (len(channels), 3600 * rate).
+
+    Works with both LIST and FLOAT32 documents. For complete FLOAT32 hours the result is a
+    read-only ``np.frombuffer`` view of the joined blobs."""
+    sample_rate = accel_doc['r']
+    seconds = []
+    for channel in channels:
+        channel_seconds = accel_doc.get(channel) or []
+        seconds.extend(channel_seconds[:3600])
+        seconds.extend([None] * (3600 - len(channel_seconds)))
+    return decode_seconds(seconds, sample_rate).reshape(len(channels), 3600 * sample_rate)
@@ -3,7 +3,60 @@ import logging
 import os
 import pika
 from pika.channel import Channel
+import threading
 import time
+from collections import deque
+
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.metrics import IngestMetrics
+from ecn.sharding import shard_queue
+from ecn.spill import SpillGate, SpillLog
+from ecn.worker_pool import OrderedWorkerPool
+
+
+class DeliveryTracker:
+    """Tracks the outstanding delivery tags of one channel, so deliveries completed by worker threads
+    can be acked from the ioloop thread with as few ``basic_ack(multiple=True)`` as possible."""
+
+    def __init__(self):
+        self.outstanding = deque()
+        '''Delivery tags in delivery order, only touched from the ioloop thread.'''
+        self.done = {}
+        '''Completed delivery tag -> True if acked, False if nacked. Only touched from the ioloop thread.'''
+        self.lock = threading.Lock()
+        self.finished = []
+        '''(delivery_tag, requeue) from worker threads, requeue is None for ack.'''
+        self.drain_scheduled = False
+
+    def delivered(self, delivery_tag: int):
+        self.outstanding.append(delivery_tag)
+
+    def finish(self, delivery_tag: int, requeue: bool = None) -> bool:
+        """Records a completed delivery from any thread. Returns True if the caller should schedule ``drain()``."""
+        with self.lock:
+            self.finished.append((delivery_tag, requeue))
+            if self.drain_scheduled:
+                return False
+            self.drain_scheduled = True
+            return True
+
+    def drain(self):
+        """Returns (delivery tag to ack with multiple=True or None, [(delivery tag, requeue) to nack])."""
+        with self.lock:
+            finished, self.finished = self.finished, []
+            self.drain_scheduled = False
+        nacks = []
+        for delivery_tag, requeue in finished:
+            self.done[delivery_tag] = requeue is None
+            if requeue is not None:
+                nacks.append((delivery_tag, requeue))
+        ack_tag = None
+        while self.outstanding and self.outstanding[0] in self.done:
+            delivery_tag = self.outstanding.popleft()
+            # Never ack (multiple) up to an already nacked tag, the broker would reject it as unknown
+            if self.done.pop(delivery_tag):
+                ack_tag = delivery_tag
+        return ack_tag, nacks
 
 
 class AmqpProcessor:
@@ -13,10 +66,51 @@ class AmqpProcessor:
     '''QUEUE_PREFIX can be used for development, e.g. 'ecn_dev_'.'''
     QUEUE_MOBILE_STREAM = os.getenv('QUEUE_PREFIX', 'ecn_') + 'mobile_stream'
     '''QUEUE_PREFIX can be used for development, e.g. 'ecn_dev_'.'''
+    QUEUE_CONTINUOUS = os.getenv('QUEUE_PREFIX', 'ecn_') + 'continuous'
+    '''QUEUE_PREFIX can be used for development, e.g. 'ecn_dev_'.'''
+    QUEUE_TRIGGER = os.getenv('QUEUE_PREFIX', 'ecn_') + 'trigger'
+    '''QUEUE_PREFIX can be used for development, e.g. 'ecn_dev_'.'''
 
-    def __init__(self):
+    def __init__(self, prefetch_count: int = 0, workers: int = 0):
+        """``prefetch_count`` limits unacked deliveries (0 is unlimited). With ``workers`` > 0, handlers run
+        in that many threads (messages of the same station stay in order) instead of on the ioloop;
+        as deliveries are acked only when done, ``prefetch_count`` is then what stops the broker
+        from sending more while the workers are saturated."""
         self.stationary_v1_handler = None
         self.mobile_handler = None
+        self.continuous_handler = None
+        self.trigger_handler = None
+        self.bulk_writer: AccelBulkWriter = None
+        '''If set, deliveries are acked only after the writer has flushed their writes.'''
+        self.prefetch_count = prefetch_count
+        self.worker_pool: OrderedWorkerPool = OrderedWorkerPool(workers) if workers > 0 else None
+        if self.worker_pool and not prefetch_count:
+            self.logger.warning('Running %d workers without prefetch_count, queued deliveries are unbounded', workers)
+        self.delivery_tracker: DeliveryTracker = None
+        self.bulk_writer_flusher_started = False
+        self.queue_stationary_v1 = self.QUEUE_STATIONARY_V1
+        self.queue_mobile_stream = self.QUEUE_MOBILE_STREAM
+        self.queue_continuous = self.QUEUE_CONTINUOUS
+        self.queue_trigger = self.QUEUE_TRIGGER
+        self.declare_queues = False
+        self.publish_queues = []
+        '''Queues ``publish()`` sends to, declared (durable) whenever the channel opens.'''
+        self.channel: Channel = None
+        self.spill_log: SpillLog = None
+        self.spill_gate: SpillGate = None
+        '''If both set, messages go to the spill log (and are acked) while the gate says MongoDB is unhealthy.'''
+        self.metrics: IngestMetrics = None
+        '''If set, deliveries are counted and their lag and worker wait sampled.'''
+        self.ioloop_thread = None
+        '''Ident of the thread running the ioloop, the only one which may use the channel.'''
+
+    def use_shard(self, shard: int):
+        """Consumes the (self-declared) shard queues filled by ``ecn.sharding.ShardRouter`` instead of the main queues"""
+        self.queue_stationary_v1 = shard_queue(self.QUEUE_STATIONARY_V1, shard)
+        self.queue_mobile_stream = shard_queue(self.QUEUE_MOBILE_STREAM, shard)
+        self.queue_continuous = shard_queue(self.QUEUE_CONTINUOUS, shard)
+        self.queue_trigger = shard_queue(self.QUEUE_TRIGGER, shard)
+        self.declare_queues = True
 
     def connect(self, host: str, vhost: str, username: str, password: str):
         self.logger.info('***** Connecting to RabbitMQ %s@%s:%s ...', username, host, vhost)
@@ -26,7 +120,7 @@ class AmqpProcessor:
                                            credentials=pika.PlainCredentials(username, password))
                                         #    heartbeat=600, blocked_connection_timeout=300)
         self.conn = pika.SelectConnection(parameters=params, on_open_callback=self.on_connected,
-            on_close_callback=self.on_channel_closed)
+            on_open_error_callback=self.on_connection_closed, on_close_callback=self.on_connection_closed)
 
     def connect_and_run_forever(self, host: str, vhost: str, username: str, password: str):
         while True:
@@ -69,43 +163,262 @@ class AmqpProcessor:
     def on_channel_open(self, new_channel: Channel):
         """Called when our channel has opened"""
         self.channel = new_channel
+        self.ioloop_thread = threading.get_ident()
         self.logger.info('Channel opened: %s', self.channel)
-        self.channel.add_on_close_callback(
-            lambda channel, reason:
-                self.logger.info('Channel closed: %s %s', channel.channel_number, reason))
+        self.channel.add_on_close_callback(self.on_channel_closed)
+        if self.prefetch_count:
+            self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        # Delivery tags start over on each channel
+        self.delivery_tracker = DeliveryTracker()
+        for queue in self.publish_queues:
+            self.channel.queue_declare(queue=queue, durable=True)
         # Subscribe stationary v1 queue
         if self.stationary_v1_handler:
-            self.logger.info('Consuming queue %s ...', self.QUEUE_STATIONARY_V1)
-            consumer = self.channel.basic_consume(queue=self.QUEUE_STATIONARY_V1, on_message_callback=self.consume_stationary_v1,
-                                                    exclusive=True)
-            self.logger.info('Consuming queue %s as %s', self.QUEUE_STATIONARY_V1, consumer)
+            self.consume(self.queue_stationary_v1, self.consume_stationary_v1)
         else:
-            self.logger.warning('Not consuming queue %s: no handler', self.QUEUE_STATIONARY_V1)
+            self.logger.warning('Not consuming queue %s: no handler', self.queue_stationary_v1)
 
         # Subscribe mobile stream queue
         if self.mobile_handler:
-            self.logger.info('Consuming queue %s ...', self.QUEUE_MOBILE_STREAM)
-            consumer = self.channel.basic_consume(queue=self.QUEUE_MOBILE_STREAM, on_message_callback=self.consume_mobile_stream,
-                                                    exclusive=True)
-            self.logger.info('Consuming queue %s as %s', self.QUEUE_MOBILE_STREAM, consumer)
+            self.consume(self.queue_mobile_stream, self.consume_mobile_stream)
+        else:
+            self.logger.warning('Not consuming queue %s: no handler', self.queue_mobile_stream)
+
+        # Subscribe continuous stream queue
+        if self.continuous_handler:
+            self.consume(self.queue_continuous, self.consume_continuous)
+        else:
+            self.logger.warning('Not consuming queue %s: no handler', self.queue_continuous)
+
+        # Subscribe trigger event queue
+        if self.trigger_handler:
+            # Not exclusive, triggers have other consumers (e.g. an external locator)
+            self.consume(self.queue_trigger, self.consume_trigger, exclusive=False)
         else:
-            self.logger.warning('Not consuming queue %s: no handler', self.QUEUE_MOBILE_STREAM)
+            self.logger.warning('Not consuming queue %s: no handler', self.queue_trigger)
+
+        if self.bulk_writer:
+            if self.worker_pool:
+                # Flushing from the ioloop would block it, and with it the acks and heartbeats
+                if not self.bulk_writer_flusher_started:
+                    self.bulk_writer.start_flusher()
+                    self.bulk_writer_flusher_started = True
+            else:
+                self.conn.ioloop.call_later(self.bulk_writer.max_delay, self.on_flush_timer)
+
+    def publish(self, routing_key: str, body: bytes):
+        """Publishes to the default exchange from any thread, dropping the message while disconnected"""
+        def send():
+            if self.channel and self.channel.is_open:
+                self.channel.basic_publish(exchange='', routing_key=routing_key, body=body)
+            else:
+                self.logger.warning('Dropping message to %s: channel closed', routing_key)
+
+        try:
+            self.conn.ioloop.add_callback_threadsafe(send)
+        except Exception as e:
+            self.logger.warning('Dropping message to %s: %s', routing_key, e)
+
+    def consume(self, queue: str, on_message_callback, exclusive: bool = True):
+        """``exclusive`` keeps other consumers off the queue, e.g. a second daemon by mistake"""
+        if self.declare_queues:
+            # Queue is ours (e.g. a shard queue), so make sure it exists before consuming
+            self.channel.queue_declare(queue=queue, durable=True)
+        self.logger.info('Consuming queue %s ...', queue)
+        consumer = self.channel.basic_consume(queue=queue, on_message_callback=on_message_callback,
+                                              exclusive=exclusive)
+        self.logger.info('Consuming queue %s as %s', queue, consumer)
+
+    def on_flush_timer(self):
+        """Flushes the bulk writer periodically, as long as the channel is open"""
+        if not self.channel.is_open:
+            return
+        self.bulk_writer.flush_if_due()
+        self.conn.ioloop.call_later(self.bulk_writer.max_delay, self.on_flush_timer)
 
     def on_channel_closed(self, channel: Channel, reason):
-        self.logger.warning('***** AMQP channel closed: %s', reason)
-        # Gracefully close the connection
-        # self.conn.close()
-        # Loop until we're fully closed, will stop on its own
-        self.conn.ioloop.start()
+        """Called when the channel closes, e.g. when the broker refuses a consume: reconnects, as nothing
+        would be consumed anymore"""
+        self.logger.warning('***** AMQP channel %s closed: %s', channel.channel_number, reason)
+        if self.conn.is_open:
+            self.conn.close()
+
+    def on_connection_closed(self, connection: pika.BaseConnection, reason):
+        """Called when the connection closes or cannot be opened: stops the ioloop, so
+        ``connect_and_run_forever()`` reconnects"""
+        self.logger.warning('***** AMQP connection closed: %s', reason)
+        self.conn.ioloop.stop()
 
     def consume_stationary_v1(self, channel: Channel, method, header, body):
         """Called when we receive a message from RabbitMQ"""
+        if self.metrics:
+            self.metrics.delivered('stationary_v1', header, body)
+        if self.spill(channel, method.delivery_tag, 'stationary_v1', body):
+            return
+        if self.worker_pool:
+            self.dispatch(channel, method.delivery_tag, self.stationary_v1_handler, body)
+            return
         self.stationary_v1_handler.receive(body)
-        # self.logger.debug('Ack %s', method.delivery_tag)
-        channel.basic_ack(method.delivery_tag)
+        self.ack_when_written(channel, method.delivery_tag)
 
     def consume_mobile_stream(self, channel: Channel, method, header, body):
         """Called when we receive a message from RabbitMQ"""
+        if self.metrics:
+            self.metrics.delivered('mobile_stream', header, body)
+        if self.spill(channel, method.delivery_tag, 'mobile_stream', body):
+            return
+        if self.worker_pool:
+            self.dispatch(channel, method.delivery_tag, self.mobile_handler, body)
+            return
         self.mobile_handler.receive(body)
-        # self.logger.debug('Ack %s', method.delivery_tag)
-        channel.basic_ack(method.delivery_tag)
+        self.ack_when_written(channel, method.delivery_tag)
+
+    def consume_continuous(self, channel: Channel, method, header, body):
+        """Called when we receive a message from RabbitMQ"""
+        if self.metrics:
+            self.metrics.delivered('continuous', header, body)
+        if self.spill(channel, method.delivery_tag, 'continuous', body):
+            return
+        if self.worker_pool:
+            self.dispatch(channel, method.delivery_tag, self.continuous_handler, body)
+            return
+        self.continuous_handler.receive(body)
+        self.ack_when_written(channel, method.delivery_tag)
+
+    def consume_trigger(self, channel: Channel, method, header, body):
+        """Called when we receive a message from RabbitMQ"""
+        if self.metrics:
+            self.metrics.delivered('trigger', header, body)
+        if self.spill(channel, method.delivery_tag, 'trigger', body):
+            return
+        if self.worker_pool:
+            self.dispatch(channel, method.delivery_tag, self.trigger_handler, body)
+            return
+        self.trigger_handler.receive(body)
+        self.ack_when_written(channel, method.delivery_tag)
+
+    def spill(self, channel: Channel, delivery_tag: int, key: str, body: bytes) -> bool:
+        """While MongoDB is unhealthy, appends the message to the spill log and acks it right away.
+
+        Returns False if the message should be handled as usual, also when the spill log is full:
+        then it is better to slow down (unacked deliveries hold the broker back) than to lose it."""
+        if not self.spill_gate or not self.spill_gate.check():
+            return False
+        if not self.spill_log.append(key, time.time(), bytes(body)):
+            return False
+        if self.worker_pool:
+            # Earlier deliveries may still be in flight, so ack through the tracker like they are
+            tracker = self.delivery_tracker
+            tracker.delivered(delivery_tag)
+            if tracker.finish(delivery_tag):
+                self.on_deliveries_finished(channel, tracker)
+        else:
+            channel.basic_ack(delivery_tag)
+        return True
+
+    def replay(self, key: str, body: bytes, received_at: float, done) -> bool:
+        """Runs a message from the spill log through its handler like a live one, then calls ``done()``.
+
+        Called from the ``SpillReplayer`` thread, returns False if not connected."""
+        if not self.channel or not self.channel.is_open:
+            return False
+        handler = {
+            'stationary_v1': self.stationary_v1_handler,
+            'mobile_stream': self.mobile_handler,
+            'continuous': self.continuous_handler,
+            'trigger': self.trigger_handler,
+        }.get(key)
+        if not handler:
+            # E.g. spilled with CONTINUOUS=1, replayed without: nothing can take it anymore
+            self.logger.warning('Dropping replayed %s message: no handler', key)
+            done()
+            return True
+
+        def run():
+            try:
+                if handler is self.stationary_v1_handler:
+                    handler.receive(body, received_at)
+                else:
+                    handler.receive(body)
+            except Exception as e:
+                self.logger.error('Dropping replayed %s message: handler failed', key, exc_info=e)
+            finally:
+                done()
+
+        if self.worker_pool:
+            self.worker_pool.submit(handler.partition_key(body), run)
+        else:
+            self.conn.ioloop.add_callback_threadsafe(run)
+        return True
+
+    def dispatch(self, channel: Channel, delivery_tag: int, handler, body: bytes):
+        """Runs ``handler.receive(body)`` on the worker pool, acking from the ioloop once written"""
+        ioloop = self.conn.ioloop
+        tracker = self.delivery_tracker
+        tracker.delivered(delivery_tag)
+
+        def finish(requeue: bool = None):
+            if tracker.finish(delivery_tag, requeue):
+                try:
+                    ioloop.add_callback_threadsafe(lambda: self.on_deliveries_finished(channel, tracker))
+                except Exception as e:
+                    # Connection is gone, the broker will redeliver anyway
+                    self.logger.warning('Cannot ack delivery %s: %s', delivery_tag, e)
+
+        queued_at = time.perf_counter() if self.metrics and self.metrics.worker_wait.sample() else None
+
+        def run():
+            if queued_at is not None:
+                self.metrics.worker_wait.observe(time.perf_counter() - queued_at)
+            try:
+                handler.receive(body)
+            except Exception as e:
+                self.logger.error('Rejecting delivery %s: handler failed', delivery_tag, exc_info=e)
+                finish(requeue=False)
+                return
+            if self.bulk_writer:
+                self.bulk_writer.add_callback(finish, lambda: finish(requeue=True))
+            else:
+                finish()
+
+        self.worker_pool.submit(handler.partition_key(body), run)
+
+    def on_deliveries_finished(self, channel: Channel, tracker: DeliveryTracker):
+        """Called on the ioloop thread to (n)ack deliveries finished by the worker pool"""
+        ack_tag, nacks = tracker.drain()
+        if not channel.is_open:
+            return
+        for delivery_tag, requeue in nacks:
+            channel.basic_nack(delivery_tag, requeue=requeue)
+        if ack_tag is not None:
+            channel.basic_ack(ack_tag, multiple=True)
+
+    def on_ioloop(self, callback):
+        """Runs ``callback`` right away on the ioloop thread, otherwise schedules it there (pika is not thread-safe)"""
+        if threading.get_ident() == self.ioloop_thread:
+            callback()
+            return
+        try:
+            self.conn.ioloop.add_callback_threadsafe(callback)
+        except Exception as e:
+            # Connection is gone, the broker will redeliver anyway
+            self.logger.warning('Cannot run %s on the ioloop: %s', callback, e)
+
+    def ack_when_written(self, channel: Channel, delivery_tag: int):
+        """Acks now, or after the bulk writer flushed (requeueing the delivery if the flush failed).
+
+        Flushes may run on other threads (e.g. a size flush by the liveness tracker), so the
+        (n)ack is made on the ioloop."""
+        if not self.bulk_writer:
+            channel.basic_ack(delivery_tag)
+            return
+
+        def ack():
+            if channel.is_open:
+                channel.basic_ack(delivery_tag)
+
+        def nack():
+            if channel.is_open:
+                channel.basic_nack(delivery_tag, requeue=True)
+
+        self.bulk_writer.add_callback(lambda: self.on_ioloop(ack), lambda: self.on_ioloop(nack))
@@ -0,0 +1,312 @@
+# Re-ingests archived streams into db.accel, see README "Backfill" or: python -m ecn.backfill --help
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone
+
+import pymongo
+from bson import json_util
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from ecn import AccelFormat, StationKind
+from ecn.accel_format import decode_seconds, encode_seconds, list_second
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.continuous import ContinuousHandler
+from ecn.mobile import MobileHandler
+from ecn.spill import SpillLog
+from ecn.stationary_v1 import StationaryV1Handler
+from ecn.summary import rebuild_accel_summaries
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineCollection:
+    """Stands in for a collection in worker processes: keeps preallocating upserts, finds nothing."""
+
+    def __init__(self):
+        self.upserts = {}
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.upserts[filter['_id']] = update['$setOnInsert']
+
+    def find_one(self, *args, **kwargs):
+        return None
+
+
+class OfflineDatabase:
+    """Stands in for the database in worker processes, so the handlers only transform."""
+
+    def __init__(self):
+        self.accel = OfflineCollection()
+        self.accel_summary = OfflineCollection()
+        self.station = OfflineCollection()
+
+
+class Transformer:
+    """Runs the handlers on archived messages without MongoDB, collecting the accel writes they make.
+
+    v1 stations are looked up in ``v1_stations`` (client ID -> station as from
+    ``StationaryV1Handler.load_station()``), loaded once by the parent process."""
+
+    def __init__(self, v1_stations: dict, accel_format: int):
+        self.db = OfflineDatabase()
+        self.accel_format = accel_format
+        self.writer = AccelBulkWriter(self.db, max_ops=sys.maxsize)
+        self.cache = MetadataCache(station_ttl=float('inf'), negative_ttl=float('inf'))
+        for client_id, station in v1_stations.items():
+            self.cache.stations[(StationKind.V1, client_id)] = (float('inf'), station)
+        self.handlers = {
+            'stationary_v1': StationaryV1Handler(self.db, self.writer, self.cache, accel_format),
+            'mobile_stream': MobileHandler(self.db, self.writer, self.cache, accel_format),
+            'continuous': ContinuousHandler(self.db, self.writer, self.cache, accel_format),
+        }
+
+    def transform(self, items: list):
+        """Returns (new accel documents by ``_id``, ``$set`` fields by ``_id``) of (kind, payload, received_at) items.
+
+        Station state is left alone, archived data says nothing about the station now."""
+        for kind, payload, received_at in items:
+            try:
+                if kind == 'hour':
+                    self.transform_hour(*payload)
+                elif kind == 'stationary_v1':
+                    self.handlers[kind].receive(payload, received_at)
+                elif kind in self.handlers:
+                    self.handlers[kind].receive(payload)
+            except Exception as e:
+                logger.error('Skipping broken %s message', kind, exc_info=e)
+        accel_sets, station_sets, summary_updates = self.writer.take_pending()
+        new_accels, self.db.accel.upserts = self.db.accel.upserts, {}
+        return new_accels, accel_sets
+
+    def transform_hour(self, fallback_id: str, data: bytes):
+        """Converts an exported accel hour document (mongoexport JSON) to ``accel_format``, keeping null seconds unset.
+
+        LIST seconds stay exactly as exported, in their own length."""
+        doc = json_util.loads(data)
+        accel_id = doc.get('_id') or fallback_id
+        sample_rate = doc.get('r') or StationaryV1Handler.SAMPLE_RATE
+        self.cache.ensure_accel(self.db.accel, accel_id, sample_rate, self.accel_format)
+        fields = {}
+        for channel in ('z', 'n', 'e'):
+            seconds = (doc.get(channel) or [])[:3600]
+            present = [second for second, value in enumerate(seconds) if value is not None]
+            if not present:
+                continue
+            if self.accel_format == AccelFormat.FLOAT32:
+                values = encode_seconds(decode_seconds([seconds[second] for second in present], sample_rate),
+                                        self.accel_format)
+            else:
+                values = [list_second(seconds[second]) for second in present]
+            fields.update(zip(['%s.%d' % (channel, second) for second in present], values))
+        self.writer.set_accel(accel_id, fields)
+
+
+transformer: Transformer = None
+'''Of this worker process.'''
+
+
+def init_worker(v1_stations: dict, accel_format: int):
+    global transformer
+    transformer = Transformer(v1_stations, accel_format)
+
+
+def transform_chunk(items: list):
+    return transformer.transform(items)
+
+
+def adhoc_items(db: pymongo.database.Database, after=None):
+    """Yields (position, item) of the v1 messages saved to ``db.adhoc`` by ``save_adhoc.py``, timed by ``tf``."""
+    query = {'_id': {'$gt': after}} if after is not None else {}
+    for doc in db.adhoc.find(query, projection={'clientID': 1, 'accelerations': 1, 'tf': 1}).sort('_id', 1):
+        body = json.dumps({'clientID': doc['clientID'], 'accelerations': doc['accelerations']}).encode()
+        yield doc['_id'], ('stationary_v1', body, doc['tf'].replace(tzinfo=timezone.utc).timestamp())
+
+
+def hour_items(paths: list, after=None):
+    """Yields (position, item) of exported accel hour documents, e.g. ``ecn.accel_2019080212_10.json``."""
+    for index, path in enumerate(paths):
+        if after is not None and index <= after:
+            continue
+        match = re.search(r'(\d{10})_([^._]+)\.json$', os.path.basename(path))
+        fallback_id = '%s:%s' % match.groups() if match else None
+        with open(path, 'rb') as f:
+            yield index, ('hour', (fallback_id, f.read()), None)
+
+
+def read_varint(data: bytes, offset: int):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def mobile_items(paths: list, after=None):
+    """Yields (position, item) of captured MobileStream messages, each file holding length-delimited messages
+    (as written by the Java ``writeDelimitedTo()``)."""
+    start_index, start_offset = after or (0, 0)
+    for index, path in enumerate(paths):
+        if index < start_index:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = start_offset if index == start_index else 0
+        while offset < len(data):
+            length, offset = read_varint(data, offset)
+            yield [index, offset + length], ('mobile_stream', data[offset:offset + length], None)
+            offset += length
+
+
+def spill_items(directory: str, after=None):
+    """Yields (position, item) of the messages in spill log segments (see ``ecn.spill``) left in ``directory``."""
+    log = SpillLog(directory)
+    start_name, start_offset = after or ('', 0)
+    for path in log.segments():
+        name = os.path.basename(path)
+        if name < start_name:
+            continue
+        for end, key, received_at, body in log.read(path, start_offset if name == start_name else 0):
+            yield [name, end], (key, body, received_at)
+
+
+def load_v1_stations(db: pymongo.database.Database) -> dict:
+    handler = StationaryV1Handler(db)
+    return {doc['i']: handler.load_station(doc['i'])
+            for doc in db.station.find({'k': StationKind.V1}, projection={'i': 1})}
+
+
+def write_batch(db: pymongo.database.Database, new_accels: dict, accel_sets: dict):
+    """Preallocates new hours, then sets their seconds, each as one unordered bulk write ordered by hour."""
+    if new_accels:
+        db.accel.bulk_write([UpdateOne({'_id': accel_id}, {'$setOnInsert': doc}, upsert=True)
+                             for accel_id, doc in sorted(new_accels.items())], ordered=False)
+    if accel_sets:
+        db.accel.bulk_write([UpdateOne({'_id': accel_id}, {'$set': fields})
+                             for accel_id, fields in sorted(accel_sets.items())], ordered=False)
+
+
+def save_checkpoint(path: str, source: str, position, messages: int):
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'source': source, 'position': position, 'messages': messages}, f)
+    os.replace(path + '.tmp', path)
+
+
+def backfill(db: pymongo.database.Database, source: str, items, workers: int = None, chunk_size: int = 200,
+             batch_size: int = 100000, accel_format: int = AccelFormat.LIST, checkpoint: str = None) -> set:
+    """Transforms ``items`` (from ``*_items()``) in a process pool and writes them in bulk.
+
+    Chunks of ``chunk_size`` messages are transformed in parallel; their writes are merged and
+    written once ``batch_size`` seconds are pending. After each write, the position of the last
+    message written is saved to ``checkpoint``. Returns the accel ``_id``s written."""
+    written = set()
+    new_accels, accel_sets = {}, {}
+    pending_seconds = messages = 0
+    started = time.monotonic()
+    v1_stations = load_v1_stations(db)
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(v1_stations, accel_format)) as executor:
+        in_flight = deque()
+        chunks = iter_chunks(items, chunk_size)
+        while True:
+            # Keep every worker busy, but memory bounded
+            while len(in_flight) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append((chunk[0], len(chunk[1]), executor.submit(transform_chunk, chunk[1])))
+            if not in_flight:
+                break
+            position, count, future = in_flight.popleft()
+            chunk_new_accels, chunk_sets = future.result()
+            messages += count
+            for accel_id, doc in chunk_new_accels.items():
+                if accel_id not in written:
+                    new_accels[accel_id] = doc
+            for accel_id, fields in chunk_sets.items():
+                accel_sets.setdefault(accel_id, {}).update(fields)
+                pending_seconds += len(fields)
+            if pending_seconds >= batch_size or not in_flight:
+                write_batch(db, new_accels, accel_sets)
+                written.update(accel_sets)
+                written.update(new_accels)
+                new_accels, accel_sets = {}, {}
+                pending_seconds = 0
+                if checkpoint:
+                    save_checkpoint(checkpoint, source, position, messages)
+                elapsed = time.monotonic() - started
+                logger.info('Backfilled %d messages into %d hours in %.0f s (%.0f messages/s)',
+                            messages, len(written), elapsed, messages / max(elapsed, 1e-3))
+    return written
+
+
+def iter_chunks(items, chunk_size: int):
+    """Groups (position, item) into (last position, [item, ...])."""
+    chunk = []
+    position = None
+    for position, item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield position, chunk
+            chunk = []
+    if chunk:
+        yield position, chunk
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m ecn.backfill', description='Re-ingests archived streams into db.accel.')
+    parser.add_argument('source', choices=('adhoc', 'hours', 'mobile', 'spill'),
+                        help='db.adhoc, exported accel hour JSON files, files of length-delimited MobileStream '
+                             'messages, or a spill log directory')
+    parser.add_argument('paths', nargs='*', help='files (hours, mobile) or directory (spill)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to CPU count')
+    parser.add_argument('--chunk', type=int, default=200, help='messages per worker task')
+    parser.add_argument('--batch', type=int, default=100000, help='seconds per bulk write')
+    parser.add_argument('--accel-format', type=int, default=int(os.getenv('ACCEL_FORMAT', str(AccelFormat.LIST))),
+                        help='encoding of new accel hour documents, see ecn.AccelFormat')
+    parser.add_argument('--checkpoint', help='file to resume from and save progress to')
+    parser.add_argument('--summaries', action='store_true', help='rebuild accel summaries of the hours written')
+    args = parser.parse_args(argv)
+
+    load_dotenv(verbose=True)
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(os.environ['MONGODB_URI']).ecn
+
+    source = '%s:%s' % (args.source, ','.join(args.paths))
+    after = None
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        with open(args.checkpoint) as f:
+            saved = json.load(f)
+        if saved['source'] == source:
+            after = saved['position']
+            logger.info('Resuming after %s (%d messages done)', after, saved['messages'])
+        else:
+            logger.warning('Ignoring checkpoint %s of another source: %s', args.checkpoint, saved['source'])
+
+    if args.source == 'adhoc':
+        items = adhoc_items(db, after)
+    elif args.source == 'hours':
+        items = hour_items(args.paths, after)
+    elif args.source == 'mobile':
+        items = mobile_items(args.paths, after)
+    else:
+        items = spill_items(args.paths[0], after)
+
+    written = backfill(db, source, items, args.workers, args.chunk, args.batch, args.accel_format, args.checkpoint)
+    if args.summaries and written:
+        rebuild_accel_summaries(db, written)
+
+
+if __name__ == '__main__':
+    main()
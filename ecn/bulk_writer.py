@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+
+import pymongo
+from pymongo import UpdateOne
+
+
+class AccelBulkWriter:
+    """Write-behind buffer for accel hour documents, their summaries and station state.
+
+    Handlers add ``$set`` paths (e.g. ``z.123``) keyed by ``accel_id`` (or station ``_id``),
+    and ``$set``/``$max``/``$inc`` paths of ``accel_summary`` documents.
+    Paths for the same document are merged and everything is sent as one unordered
+    ``bulk_write`` per collection once ``max_ops`` documents are pending or ``max_delay``
+    seconds have passed since the first pending write (see ``flush_if_due()``).
+
+    Callbacks registered with ``add_callback()`` run after the flush containing the
+    writes added before them, e.g. to ack AMQP deliveries only after Mongo has the data.
+    """
+    logger = logging.getLogger(__name__)
+    REPORT_INTERVAL = 60
+    '''Seconds between INFO-level flush statistics.'''
+
+    def __init__(self, db: pymongo.database.Database, max_ops: int = 500, max_delay: float = 0.25):
+        self.db: pymongo.database.Database = db
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        '''Guards the pending buffers.'''
+        self.flush_lock = threading.Lock()
+        '''Serializes flushes so a later flush never overtakes an earlier one.'''
+        self.accel_sets = {}
+        self.station_sets = {}
+        self.summary_updates = {}
+        '''summary _id -> {'$set': {}, '$max': {}, '$inc': {}}'''
+        self.callbacks = []
+        self.first_pending_at = None
+        self.flush_count = 0
+        self.flushed_ops = 0
+        self.error_count = 0
+        self.last_flush_size = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.flushing_since = None
+        '''time.monotonic() when the running bulk write started, None if not writing.'''
+        self.last_flush_started = None
+        self.last_flush_failed = False
+        self.reported_at = time.monotonic()
+
+    def set_accel(self, accel_id: str, fields: dict):
+        """Queue ``$set`` of ``fields`` on accel document ``accel_id``."""
+        self.__add(self.accel_sets, accel_id, fields)
+
+    def set_station(self, station_id, fields: dict):
+        """Queue ``$set`` of ``fields`` on station document ``station_id``."""
+        self.__add(self.station_sets, station_id, fields)
+
+    def update_summary(self, summary_id: str, set_fields: dict = None, max_fields: dict = None,
+                       inc_fields: dict = None):
+        """Queue ``$set``, ``$max`` and ``$inc`` of fields on accel summary document ``summary_id``."""
+        with self.lock:
+            update = self.summary_updates.get(summary_id)
+            if update is None:
+                update = self.summary_updates[summary_id] = {'$set': {}, '$max': {}, '$inc': {}}
+            if set_fields:
+                update['$set'].update(set_fields)
+            if max_fields:
+                maxes = update['$max']
+                for path, value in max_fields.items():
+                    if path not in maxes or value > maxes[path]:
+                        maxes[path] = value
+            if inc_fields:
+                incs = update['$inc']
+                for path, value in inc_fields.items():
+                    incs[path] = incs.get(path, 0) + value
+            full = self.__mark_pending()
+        if full:
+            self.flush()
+
+    def __add(self, sets: dict, doc_id, fields: dict):
+        with self.lock:
+            existing = sets.get(doc_id)
+            if existing is None:
+                sets[doc_id] = dict(fields)
+            else:
+                existing.update(fields)
+            full = self.__mark_pending()
+        if full:
+            self.flush()
+
+    def __mark_pending(self) -> bool:
+        """Returns True if a flush is due by size, the caller holds the lock."""
+        if self.first_pending_at is None:
+            self.first_pending_at = time.monotonic()
+        return self.pending_ops() >= self.max_ops
+
+    def add_callback(self, on_success, on_failure=None):
+        """Run ``on_success()`` (or ``on_failure()``) once everything queued so far is flushed.
+
+        If nothing is pending or being flushed, the callback runs immediately, otherwise on
+        whichever thread flushes."""
+        with self.lock:
+            if self.pending_ops() or self.flush_lock.locked():
+                self.callbacks.append((on_success, on_failure))
+                if self.first_pending_at is None:
+                    self.first_pending_at = time.monotonic()
+                return
+        on_success()
+
+    def pending_ops(self) -> int:
+        return len(self.accel_sets) + len(self.station_sets) + len(self.summary_updates)
+
+    def take_pending(self):
+        """Removes and returns the pending (accel sets, station sets, summary updates) without writing them."""
+        with self.lock:
+            pending = self.accel_sets, self.station_sets, self.summary_updates
+            self.accel_sets, self.station_sets, self.summary_updates = {}, {}, {}
+            self.first_pending_at = None
+        return pending
+
+    def flush_if_due(self):
+        """Flush if the oldest pending write has waited ``max_delay`` seconds."""
+        first_pending_at = self.first_pending_at
+        if first_pending_at is not None and time.monotonic() - first_pending_at >= self.max_delay:
+            self.flush()
+
+    def start_flusher(self):
+        """Calls ``flush_if_due()`` from a background thread, for when handlers run off the ioloop."""
+        def run():
+            while True:
+                time.sleep(self.max_delay / 4)
+                try:
+                    self.flush_if_due()
+                except Exception as e:
+                    self.logger.error('Background flush failed', exc_info=e)
+        threading.Thread(target=run, name='ecn-bulk-flusher', daemon=True).start()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                accel_sets, self.accel_sets = self.accel_sets, {}
+                station_sets, self.station_sets = self.station_sets, {}
+                summary_updates, self.summary_updates = self.summary_updates, {}
+                callbacks, self.callbacks = self.callbacks, []
+                self.first_pending_at = None
+            if not accel_sets and not station_sets and not summary_updates:
+                for on_success, on_failure in callbacks:
+                    on_success()
+                return
+
+            started = time.monotonic()
+            self.flushing_since = self.last_flush_started = started
+            try:
+                if accel_sets:
+                    self.db.accel.bulk_write([UpdateOne({'_id': accel_id}, {'$set': fields})
+                                              for accel_id, fields in accel_sets.items()], ordered=False)
+                if station_sets:
+                    self.db.station.bulk_write([UpdateOne({'_id': station_id}, {'$set': fields})
+                                                for station_id, fields in station_sets.items()], ordered=False)
+                if summary_updates:
+                    self.db.accel_summary.bulk_write(
+                        [UpdateOne({'_id': summary_id}, {op: fields for op, fields in update.items() if fields})
+                         for summary_id, update in summary_updates.items()], ordered=False)
+            except Exception as e:
+                self.flushing_since = None
+                self.last_flush_failed = True
+                self.error_count += 1
+                self.logger.error('Bulk write of %d accel + %d station + %d summary docs failed',
+                                  len(accel_sets), len(station_sets), len(summary_updates), exc_info=e)
+                for on_success, on_failure in callbacks:
+                    if on_failure:
+                        on_failure()
+                return
+            latency = time.monotonic() - started
+            self.flushing_since = None
+            self.last_flush_failed = False
+
+            size = len(accel_sets) + len(station_sets) + len(summary_updates)
+            self.flush_count += 1
+            self.flushed_ops += size
+            self.last_flush_size = size
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            for on_success, on_failure in callbacks:
+                on_success()
+            if started - self.reported_at >= self.REPORT_INTERVAL:
+                self.reported_at = started
+                self.logger.info('Flushed %d docs in %d bulk writes, last %d docs in %.1f ms (max %.1f ms), %d errors',
+                                 self.flushed_ops, self.flush_count, size, latency * 1000,
+                                 self.max_flush_latency * 1000, self.error_count)
+
+    def stats(self) -> dict:
+        return {
+            'flush_count': self.flush_count,
+            'flushed_ops': self.flushed_ops,
+            'error_count': self.error_count,
+            'pending_ops': self.pending_ops(),
+            'last_flush_size': self.last_flush_size,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+        }
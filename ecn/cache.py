@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+from ecn import AccelFormat
+
+
+class MetadataCache:
+    """In-process cache of station lookups and of accel hour documents known to exist.
+
+    Station lookups are cached for ``station_ttl`` seconds, unknown stations (lookup
+    returned ``None``) for ``negative_ttl`` seconds. Up to ``max_hours`` accel (and accel
+    summary) ``_id``s are remembered in LRU order, so preallocating an hour document costs
+    one upsert per station per hour and no reads.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, station_ttl: float = 300, negative_ttl: float = 60, max_hours: int = 20000):
+        self.station_ttl = station_ttl
+        self.negative_ttl = negative_ttl
+        self.max_hours = max_hours
+        self.lock = threading.Lock()
+        self.stations = {}
+        '''key -> (expires_at, station document or None)'''
+        self.accel_ids = OrderedDict()
+        self.station_hits = 0
+        self.station_misses = 0
+        self.negative_hits = 0
+        self.accel_hits = 0
+        self.accel_misses = 0
+
+    def find_station(self, key, loader):
+        """Returns the cached station for ``key``, calling ``loader()`` when missing or expired."""
+        now = time.monotonic()
+        entry = self.stations.get(key)
+        if entry is not None and entry[0] > now:
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.station_hits += 1
+            return entry[1]
+
+        self.station_misses += 1
+        station = loader()
+        ttl = self.station_ttl if station is not None else self.negative_ttl
+        self.stations[key] = (now + ttl, station)
+        return station
+
+    def ensure_accel(self, accel_coll: pymongo.collection.Collection, accel_id: str, sample_rate: int,
+                     accel_format: int = AccelFormat.LIST, channels=('z', 'n', 'e')):
+        """Makes sure the accel hour document exists with the top-level arrays of ``channels`` preallocated."""
+        def new_doc():
+            # "Preallocate" arrays except innermost, only if the document is new
+            accels = [None for sec in range(60 * 60)]
+            self.logger.debug('Preallocating accel %s sample_rate=%d format=%d', accel_id, sample_rate, accel_format)
+            accel_doc = {'v': accel_format, 'r': sample_rate}
+            accel_doc.update((channel, accels) for channel in channels)
+            return accel_doc
+        self.__ensure(accel_coll, accel_id, accel_id, new_doc)
+
+    def ensure_summary(self, summary_coll: pymongo.collection.Collection, summary_id: str, new_doc):
+        """Makes sure the accel summary document exists, inserting ``new_doc()`` if not."""
+        self.__ensure(summary_coll, ('summary', summary_id), summary_id, new_doc)
+
+    def __ensure(self, coll: pymongo.collection.Collection, key, doc_id, new_doc):
+        with self.lock:
+            if key in self.accel_ids:
+                self.accel_ids.move_to_end(key)
+                self.accel_hits += 1
+                return
+            self.accel_misses += 1
+
+        try:
+            coll.update_one({'_id': doc_id}, {'$setOnInsert': new_doc()}, upsert=True)
+        except DuplicateKeyError:
+            pass # Concurrent upsert of the same hour won, which is just as good
+
+        with self.lock:
+            self.accel_ids[key] = True
+            if len(self.accel_ids) > self.max_hours:
+                self.accel_ids.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'station_hits': self.station_hits,
+            'station_misses': self.station_misses,
+            'negative_hits': self.negative_hits,
+            'accel_hits': self.accel_hits,
+            'accel_misses': self.accel_misses,
+        }
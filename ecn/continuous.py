@@ -0,0 +1,131 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+import pymongo
+from bson import ObjectId
+
+from ecn import StationState, AccelFormat
+from ecn import qz_continuous3_pb2
+from ecn.accel_format import encode_seconds
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.liveness import LivenessTracker
+from ecn.mobile import bucket_by_hour
+from ecn.summary import AccelSummarizer
+
+STANDARD_GRAVITY = 9.80665
+'''Android SensorManager.GRAVITY_EARTH, in m/s^2.'''
+
+
+class ContinuousHandler:
+    """Stores ContinuousStream (qz_continuous3.proto) motion traces in accel hour documents.
+
+    Raw acceleration, linear acceleration and rotation rate are rotated from device XYZ
+    to world ZNE with the per-sample rotation matrices, all in one batched product.
+    Linear acceleration goes to ``z``/``n``/``e`` like MobileHandler's (derived from raw
+    acceleration minus gravity when the device has no linear accelerometer), raw acceleration
+    to ``az``/``an``/``ae`` and rotation rate to ``gz``/``gn``/``ge``.
+    """
+    logger = logging.getLogger(__name__)
+    CHANNELS = ('z', 'n', 'e', 'az', 'an', 'ae', 'gz', 'gn', 'ge')
+
+    def __init__(self, db: pymongo.database.Database, writer: AccelBulkWriter = None,
+                 cache: MetadataCache = None, accel_format: int = AccelFormat.LIST,
+                 summarizer: AccelSummarizer = None, liveness: LivenessTracker = None):
+        self.db: pymongo.database.Database = db
+        self.accel_format = accel_format
+        # Without a shared writer, flush every update right away
+        self.writer: AccelBulkWriter = writer or AccelBulkWriter(db, max_ops=1)
+        self.cache: MetadataCache = cache or MetadataCache()
+        self.summarizer: AccelSummarizer = summarizer
+        self.liveness: LivenessTracker = liveness
+
+    @staticmethod
+    def partition_key(body: bytes) -> bytes:
+        """Returns the station_id without parsing the whole stream, used to keep each station's messages in order."""
+        # protoc serializes fields in order, so station_id (field 1, length-delimited) comes first when set
+        if body[:1] == b'\n' and len(body) > 1 and body[1] < 0x80:
+            return bytes(body[2:2 + body[1]])
+        return b''
+
+    def receive(self, body: bytearray):
+        msg: qz_continuous3_pb2.ContinuousStream = qz_continuous3_pb2.ContinuousStream()
+        msg.ParseFromString(body)
+        sample_rate = msg.motion_sampling_rate
+        if sample_rate <= 0:
+            self.logger.error('Ignoring stream from continuous station %s: motion_sampling_rate=%d',
+                              msg.station_id, sample_rate)
+            return
+        sample_count = min(len(msg.raw_accel_x), len(msg.raw_accel_y), len(msg.raw_accel_z))
+        if min(len(msg.rotation_matrix_0), len(msg.rotation_matrix_1), len(msg.rotation_matrix_2),
+               len(msg.rotation_matrix_4), len(msg.rotation_matrix_5), len(msg.rotation_matrix_6),
+               len(msg.rotation_matrix_8), len(msg.rotation_matrix_9), len(msg.rotation_matrix_10)) < sample_count:
+            self.logger.warning('Ignoring stream from continuous station %s: no rotation matrix to rotate to ZNE',
+                                msg.station_id)
+            return
+
+        rotations = np.array([msg.rotation_matrix_0[:sample_count], msg.rotation_matrix_1[:sample_count],
+                              msg.rotation_matrix_2[:sample_count], msg.rotation_matrix_4[:sample_count],
+                              msg.rotation_matrix_5[:sample_count], msg.rotation_matrix_6[:sample_count],
+                              msg.rotation_matrix_8[:sample_count], msg.rotation_matrix_9[:sample_count],
+                              msg.rotation_matrix_10[:sample_count]], dtype=np.float32)
+        # (samples, 3, 3), rotating device XYZ to world ENU (X east, Y north, Z up)
+        rotations = rotations.T.reshape(sample_count, 3, 3)
+
+        raw_accel = (msg.raw_accel_x, msg.raw_accel_y, msg.raw_accel_z)
+        linear_accel = None
+        gravity = None
+        if min(len(msg.linear_accel_x), len(msg.linear_accel_y), len(msg.linear_accel_z)) >= sample_count:
+            linear_accel = (msg.linear_accel_x, msg.linear_accel_y, msg.linear_accel_z)
+        elif min(len(msg.gravity_x), len(msg.gravity_y), len(msg.gravity_z)) >= sample_count:
+            gravity = (msg.gravity_x, msg.gravity_y, msg.gravity_z)
+        rotation_rate = (msg.rotation_rate_x, msg.rotation_rate_y, msg.rotation_rate_z)
+        if min(len(msg.rotation_rate_x), len(msg.rotation_rate_y), len(msg.rotation_rate_z)) < sample_count:
+            rotation_rate = ([np.nan] * sample_count,) * 3
+
+        # (3 vectors, 3 axes, samples) in device XYZ: linear accel, raw accel, rotation rate
+        device = np.empty((3, 3, sample_count), dtype=np.float32)
+        device[1] = [axis[:sample_count] for axis in raw_accel]
+        if linear_accel:
+            device[0] = [axis[:sample_count] for axis in linear_accel]
+        elif gravity:
+            device[0] = device[1] - np.array([axis[:sample_count] for axis in gravity], dtype=np.float32)
+        device[2] = [axis[:sample_count] for axis in rotation_rate]
+        # One batched product for every vector of every sample, then ENU -> ZNE
+        world = np.einsum('sij,vjs->vis', rotations, device)[:, ::-1]
+        if not linear_accel and not gravity:
+            world[0] = world[1]
+            world[0, 0] -= STANDARD_GRAVITY
+
+        # (9 channels, seconds, sample_rate), a partial last second is padded with NaN
+        second_count = -(-sample_count // sample_rate)
+        channels = np.full((9, second_count * sample_rate), np.nan, dtype=np.float32)
+        channels[:, :sample_count] = world.reshape(9, sample_count)
+        channels = channels.reshape(9, second_count, sample_rate)
+        for hour_start, first_second, seconds_of_hour in bucket_by_hour(msg.start_time, sample_rate, sample_count):
+            self.__upsert_data(msg.station_id, hour_start, seconds_of_hour,
+                               channels[:, first_second:first_second + len(seconds_of_hour)], sample_rate)
+
+    def __upsert_data(self, station_id: str, hour_start: int, seconds_of_hour: range, channels: np.ndarray,
+                      sample_rate: int):
+        accel_coll: pymongo.collection.Collection = self.db.accel
+        accel_id = '%s:%s' % (datetime.utcfromtimestamp(hour_start).strftime('%Y%m%d%H'), station_id)
+        self.cache.ensure_accel(accel_coll, accel_id, sample_rate, self.accel_format, self.CHANNELS)
+
+        update_set = {}
+        for channel, rows in zip(self.CHANNELS, channels):
+            update_set.update(zip(['%s.%d' % (channel, second_of_hour) for second_of_hour in seconds_of_hour],
+                                  encode_seconds(rows, self.accel_format)))
+        self.writer.set_accel(accel_id, update_set)
+        if self.summarizer:
+            # Summarize linear acceleration, like the z/n/e of other stations
+            self.summarizer.summarize(accel_id, seconds_of_hour[0], channels[:3])
+
+        # mark as 'H'igh rate
+        if ObjectId.is_valid(station_id):
+            end_time = datetime.utcfromtimestamp(hour_start + seconds_of_hour[-1] + 1)
+            if self.liveness:
+                self.liveness.seen(ObjectId(station_id), StationState.HIGH_RATE, end_time)
+            else:
+                self.writer.set_station(ObjectId(station_id), {'s': StationState.HIGH_RATE, 't': end_time})
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from ecn import qz_triggered1_pb2
+
+
+class StationWindow:
+    """Detection state of one station: the last LTA window of Z/N/E samples in a ring buffer,
+    and the running sums of samples and squared samples over the STA and LTA windows."""
+    __slots__ = ('sample_rate', 'ring', 'pos', 'count', 'sums', 'triggered', 'end_time', 'last_seen')
+
+    def __init__(self, sample_rate: int, lta_samples: int):
+        self.sample_rate = sample_rate
+        self.ring = np.zeros((3, lta_samples), dtype=np.float32)
+        self.pos = 0
+        '''Ring index of the oldest sample, where the next sample goes.'''
+        self.count = 0
+        '''Samples seen since (re)start.'''
+        self.sums = np.zeros((4, 3))
+        '''Sum of x and of x^2 over the LTA window, then over the STA window, per channel.'''
+        self.triggered = False
+        self.end_time = None
+        '''Time right after the last sample, in seconds since UTC epoch.'''
+        self.last_seen = 0.0
+
+
+class StaLtaDetector:
+    """Streaming STA/LTA trigger detection over the Z/N/E accelerations of every station.
+
+    The ratio is the signal variance (summed over Z/N/E, so gravity and offsets cancel out) over
+    the last ``sta`` seconds, divided by the variance over the last ``lta`` seconds. The sums behind
+    both are moving sums, updated from the samples entering and the samples leaving each window,
+    which are read from the ring buffer, so a message costs O(its samples). The sums are recomputed
+    from the ring whenever it wraps around to cancel rounding drift, which is O(1) per sample amortized.
+
+    A station triggers when the ratio rises above ``on_ratio`` (once it has a full LTA window) and
+    detriggers when it falls below ``off_ratio``. Each trigger calls ``on_trigger(station_id,
+    trigger_time, peak)`` with the time of the triggering sample in seconds since UTC epoch and the
+    largest acceleration off the LTA mean afterwards in the message, in m/s^2.
+
+    Stations not updated for ``idle_timeout`` seconds are evicted, as are stations which change
+    sample rate or resume after a gap longer than the LTA window: they warm up again from scratch.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, sta: float = 1.0, lta: float = 10.0, on_ratio: float = 4.0, off_ratio: float = 1.5,
+                 idle_timeout: float = 300, on_trigger=None):
+        self.sta = sta
+        self.lta = lta
+        self.on_ratio = on_ratio
+        self.off_ratio = off_ratio
+        self.idle_timeout = idle_timeout
+        self.on_trigger = on_trigger
+        self.lock = threading.Lock()
+        self.stations = {}
+        '''station ID -> StationWindow'''
+        self.next_eviction = time.monotonic() + idle_timeout
+        self.triggers = 0
+        self.evictions = 0
+
+    def update(self, station_id, zne: np.ndarray, sample_rate: int, start_time: float) -> bool:
+        """Feeds a (3, samples) Z/N/E array starting at ``start_time`` (seconds since UTC epoch).
+
+        Messages of one station must come in order, which the worker pool guarantees.
+        NaN samples are skipped. Returns True while the station is triggered."""
+        now = time.monotonic()
+        if now >= self.next_eviction:
+            self.evict_idle(now)
+        station = self.stations.get(station_id)
+        lta_samples = max(int(round(self.lta * sample_rate)), 2)
+        if (station is None or station.sample_rate != sample_rate
+                or abs(start_time - station.end_time) > self.lta):
+            station = StationWindow(sample_rate, lta_samples)
+            with self.lock:
+                self.stations[station_id] = station
+        station.last_seen = now
+        station.end_time = start_time + zne.shape[1] / sample_rate
+
+        x = np.asarray(zne, dtype=np.float32)
+        finite = np.isfinite(x).all(axis=0)
+        if not finite.all():
+            x = x[:, finite]
+        k = x.shape[1]
+        if not k:
+            return station.triggered
+        sta_samples = min(max(int(round(self.sta * sample_rate)), 1), lta_samples - 1)
+        ring, pos, count = station.ring, station.pos, station.count
+
+        # Samples leaving the LTA and STA windows as each new sample enters: from the ring, then from x.
+        # Ring slots not written yet are 0, so they leave the sums unchanged while warming up.
+        lta_leaving = np.concatenate([ring[:, (pos + np.arange(min(k, lta_samples))) % lta_samples],
+                                      x[:, :max(k - lta_samples, 0)]], axis=1)
+        sta_leaving = np.concatenate([ring[:, (pos - sta_samples + np.arange(min(k, sta_samples))) % lta_samples],
+                                      x[:, :max(k - sta_samples, 0)]], axis=1)
+        x64 = x.astype(np.float64)
+        squares = np.square(x64)
+        lta_leaving = lta_leaving.astype(np.float64)
+        sta_leaving = sta_leaving.astype(np.float64)
+        # (4, 3, k) running sums after each new sample
+        sums = station.sums[:, :, None] + np.cumsum(np.stack([x64 - lta_leaving, squares - np.square(lta_leaving),
+                                                              x64 - sta_leaving, squares - np.square(sta_leaving)]),
+                                                    axis=2)
+        seen = count + 1 + np.arange(k)
+        lta_n = np.minimum(seen, lta_samples)
+        sta_n = np.minimum(seen, sta_samples)
+        lta_mean = sums[0] / lta_n
+        lta_var = (sums[1] / lta_n - np.square(lta_mean)).sum(axis=0)
+        sta_var = (sums[3] / sta_n - np.square(sums[2] / sta_n)).sum(axis=0)
+        ratio = np.where(seen >= lta_samples, sta_var / np.maximum(lta_var, 1e-12), 0.0)
+
+        # Store the new samples, resynchronizing the sums whenever the ring wraps around
+        if k >= lta_samples:
+            ring[:] = x[:, k - lta_samples:]
+            station.pos = 0
+        else:
+            ring[:, (pos + np.arange(k)) % lta_samples] = x
+            station.pos = (pos + k) % lta_samples
+        station.count = count + k
+        if pos + k >= lta_samples:
+            exact = ring.astype(np.float64)
+            sta_exact = exact[:, (station.pos - sta_samples + np.arange(sta_samples)) % lta_samples]
+            station.sums = np.stack([exact.sum(axis=1), np.square(exact).sum(axis=1),
+                                     sta_exact.sum(axis=1), np.square(sta_exact).sum(axis=1)])
+        else:
+            station.sums = sums[:, :, -1]
+
+        # Walk the trigger on/off transitions, which are rare, not the samples
+        i = 0
+        while i < k:
+            if station.triggered:
+                below = ratio[i:] < self.off_ratio
+                if not below.any():
+                    break
+                i += int(np.argmax(below))
+                station.triggered = False
+            else:
+                above = ratio[i:] > self.on_ratio
+                if not above.any():
+                    break
+                i += int(np.argmax(above))
+                station.triggered = True
+                self.triggers += 1
+                trigger_time = start_time + (np.flatnonzero(finite)[i] if len(finite) != k else i) / sample_rate
+                peak = float(np.sqrt(np.square(x64[:, i:] - lta_mean[:, i:]).sum(axis=0)).max())
+                self.logger.info('Station %s triggered at %.3f: STA/LTA %.1f, peak %.3f m/s^2',
+                                 station_id, trigger_time, ratio[i], peak)
+                if self.on_trigger:
+                    try:
+                        self.on_trigger(station_id, trigger_time, peak)
+                    except Exception as e:
+                        self.logger.error('Cannot publish trigger of station %s', station_id, exc_info=e)
+        return station.triggered
+
+    def evict_idle(self, now: float = None):
+        """Forgets stations not updated for ``idle_timeout`` seconds."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.next_eviction = now + self.idle_timeout / 10
+            idle = [station_id for station_id, station in self.stations.items()
+                    if now - station.last_seen > self.idle_timeout]
+            for station_id in idle:
+                del self.stations[station_id]
+        self.evictions += len(idle)
+        if idle:
+            self.logger.debug('Evicted %d idle stations, %d left', len(idle), len(self.stations))
+
+    def stats(self) -> dict:
+        return {
+            'stations': len(self.stations),
+            'triggered': sum(1 for station in list(self.stations.values()) if station.triggered),
+            'triggers': self.triggers,
+            'evictions': self.evictions,
+        }
+
+
+def encode_trigger(station_id, trigger_time: float, peak: float, location: tuple = None) -> bytes:
+    """Serializes a detection as a TriggerEvent (qz_triggered1.proto) labeled MOTION, not classified yet.
+    ``location`` is the station's (latitude, longitude), if known."""
+    msg = qz_triggered1_pb2.TriggerEvent(station_id=str(station_id), trigger_time=int(round(trigger_time * 1000)),
+                                         peak_lin_accel=peak, motionLabel=qz_triggered1_pb2.TriggerEvent.MOTION)
+    if location:
+        msg.latitude, msg.longitude = location
+    return msg.SerializeToString()
+
+
+class TriggerPublisher:
+    """``StaLtaDetector.on_trigger`` publishing each trigger to ``queue`` as a TriggerEvent, through
+    ``publish(routing_key, body)`` (e.g. ``AmqpProcessor.publish``).
+
+    The location comes from the ``loc`` GeoJSON Point of the station document, and is left unset if there is none."""
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, db, cache, publish, queue: str):
+        self.db = db
+        self.cache = cache
+        self.publish = publish
+        self.queue = queue
+
+    def location(self, station_id) -> tuple:
+        """Returns the (latitude, longitude) of a station, or None"""
+        station = self.cache.find_station(('loc', station_id), lambda: self.db.station.find_one(
+            {'_id': station_id}, {'loc': 1}))
+        coordinates = ((station or {}).get('loc') or {}).get('coordinates')
+        if not coordinates:
+            self.logger.debug('Station %s has no location', station_id)
+            return None
+        return coordinates[1], coordinates[0]
+
+    def __call__(self, station_id, trigger_time: float, peak: float):
+        self.publish(self.queue, encode_trigger(station_id, trigger_time, peak, self.location(station_id)))
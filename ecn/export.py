@@ -0,0 +1,522 @@
+# Writes station accelerations as MiniSEED and SAC, see README "Export" or: python -m ecn.export --help
+import argparse
+import logging
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pymongo
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from ecn.accel_format import decode_seconds
+from ecn.query import to_timestamp
+
+logger = logging.getLogger(__name__)
+
+TICKS = 10000
+'''Time unit of MiniSEED start times (0.0001 s); all times here are integer ticks since UTC epoch.'''
+
+ENCODING_FLOAT32 = 4
+ENCODING_STEIM2 = 11
+
+STEIM2_PACKINGS = ((7, 4, 3, 2), (6, 5, 3, 1), (5, 6, 3, 0), (4, 8, 1, None), (3, 10, 2, 3), (2, 15, 2, 2), (1, 30, 2, 1))
+'''(differences per word, bits per difference, nibble, dnib) of Steim2 data words, densest first.'''
+
+RECORD_HEADER = struct.Struct('>6scc5s2s3s2sHHBBBxHHhhBBBBiHH')
+'''Fixed section of the data header: sequence number, quality, reserved, station, location, channel, network,
+start time (year, day of year, hour, minute, second, 0.0001 s), sample count, sample rate factor and multiplier,
+activity, I/O and quality flags, blockette count, time correction, data offset, first blockette offset.'''
+BLOCKETTE_1000 = struct.Struct('>HHBBBx')
+'''Blockette type, next blockette offset, encoding, word order (1: big endian), record length exponent.'''
+DATA_OFFSET = 64
+'''Data follows the header and blockette 1000, aligned to a Steim frame.'''
+
+CHANNEL_ORIENTATION = {'z': ('Z', 0.0, 0.0), 'n': ('N', 0.0, 90.0), 'e': ('E', 90.0, 90.0)}
+'''Accel channel -> (SEED orientation code, SAC azimuth, SAC inclination).'''
+
+
+def band_code(sample_rate: int) -> str:
+    """SEED band code of a broad band sensor at ``sample_rate``."""
+    if sample_rate >= 1000:
+        return 'F'
+    if sample_rate >= 250:
+        return 'C'
+    if sample_rate >= 80:
+        return 'H'
+    if sample_rate >= 10:
+        return 'B'
+    return 'M' if sample_rate > 1 else 'L'
+
+
+def channel_code(channel: str, sample_rate: int) -> str:
+    """SEED channel code of accel channel ``z``/``n``/``e``, e.g. ``HNZ`` at 100 Hz (N: accelerometer)."""
+    return band_code(sample_rate) + 'N' + CHANNEL_ORIENTATION[channel][0]
+
+
+def sample_ticks(count: int, sample_rate: int) -> int:
+    """Duration of ``count`` samples in ticks, rounded."""
+    return (count * TICKS * 2 + sample_rate) // (sample_rate * 2)
+
+
+def steim2_words(diffs: np.ndarray):
+    """Packs differences greedily into Steim2 data words, each taking the densest packing its next differences fit.
+
+    Returns (words uint32, nibbles, differences per word). Fits are found for every position at
+    once; only walking from word to word is a loop, over words rather than samples."""
+    count = len(diffs)
+    magnitudes = np.where(diffs < 0, ~diffs, diffs)
+    # Bits needed by each difference, as two's complement
+    widths = np.frexp(magnitudes.astype(np.float64))[1] + 1
+    if count and widths.max() > 30:
+        raise ValueError('Difference of %d does not fit Steim2' % diffs[np.argmax(widths)])
+
+    choice = np.full(count, len(STEIM2_PACKINGS) - 1, dtype=np.int8)
+    for option in range(len(STEIM2_PACKINGS) - 2, -1, -1):
+        per_word, bits = STEIM2_PACKINGS[option][:2]
+        starts = count - per_word + 1
+        if starts <= 0:
+            continue
+        window = widths[:starts].copy()
+        for offset in range(1, per_word):
+            np.maximum(window, widths[offset:starts + offset], out=window)
+        choice[:starts][window <= bits] = option
+
+    per_word_at = np.array([packing[0] for packing in STEIM2_PACKINGS])[choice].tolist()
+    word_starts = []
+    position = 0
+    while position < count:
+        word_starts.append(position)
+        position += per_word_at[position]
+    word_starts = np.array(word_starts, dtype=np.int64)
+
+    word_choice = choice[word_starts]
+    words = np.zeros(len(word_starts), dtype=np.int64)
+    nibbles = np.zeros(len(word_starts), dtype=np.int64)
+    per_word = np.zeros(len(word_starts), dtype=np.int64)
+    for option, (option_per_word, bits, nibble, dnib) in enumerate(STEIM2_PACKINGS):
+        selected = np.flatnonzero(word_choice == option)
+        if not len(selected):
+            continue
+        offsets = np.arange(option_per_word)
+        values = diffs[word_starts[selected, None] + offsets].astype(np.int64) & ((1 << bits) - 1)
+        packed = (values << (bits * (option_per_word - 1 - offsets))).sum(axis=1)
+        if dnib is not None:
+            packed |= dnib << 30
+        words[selected] = packed
+        nibbles[selected] = nibble
+        per_word[selected] = option_per_word
+    return words.astype(np.uint32), nibbles, per_word
+
+
+def btime(ticks: int) -> tuple:
+    """(year, day of year, hour, minute, second, 0.0001 s) of a tick time."""
+    time = datetime.utcfromtimestamp(ticks // TICKS)
+    return time.year, time.timetuple().tm_yday, time.hour, time.minute, time.second, ticks % TICKS
+
+
+class SegmentWriter:
+    """Splits samples into contiguous segments for the format writers below.
+
+    ``write()`` takes consecutive chunks, e.g. an hour at a time; NaN samples are gaps. A run of
+    samples continues the current segment when it starts where that ends (within half a sample),
+    so segments span chunks. Subclasses implement ``begin_segment()``, ``append()`` and ``finish()``.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.segment_start = None
+        '''Tick time of the current segment's first sample, None between segments.'''
+        self.segment_origin = 0
+        self.segment_first = 0
+        '''The segment starts ``segment_first`` samples after tick time ``segment_origin``, the start of its first chunk.'''
+        self.segment_samples = 0
+
+    def write(self, start_ticks: int, samples: np.ndarray):
+        """Writes float samples starting at tick time ``start_ticks``."""
+        finite = np.isfinite(samples)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], finite.view(np.int8), [0]))))
+        for begin, end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+            run_start = start_ticks + sample_ticks(begin, self.sample_rate)
+            if self.segment_start is not None:
+                expected = self.sample_time(self.segment_samples)
+                if abs(run_start - expected) * 2 * self.sample_rate > TICKS:
+                    self.end_segment()
+            if self.segment_start is None:
+                self.segment_start = run_start
+                self.segment_origin, self.segment_first = start_ticks, begin
+                self.segment_samples = 0
+                self.begin_segment()
+            self.append(samples[begin:end])
+            self.segment_samples += end - begin
+        if len(samples) and not finite[-1]:
+            self.end_segment()
+
+    def sample_time(self, index: int) -> int:
+        """Tick time of sample ``index`` of the current segment, rounded once rather than per record."""
+        return self.segment_origin + sample_ticks(self.segment_first + index, self.sample_rate)
+
+    def end_segment(self):
+        if self.segment_start is not None:
+            self.finish()
+            self.segment_start = None
+
+    def close(self):
+        self.end_segment()
+
+    def begin_segment(self):
+        pass
+
+    def append(self, samples: np.ndarray):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+
+class MiniSeedWriter(SegmentWriter):
+    """Streams samples into a MiniSEED (SEED 2.4) file of ``record_length``-byte records.
+
+    Records are Steim2 compressed (the default) or FLOAT32. Steim2 encodes integer counts, samples
+    are divided by ``gain`` (by default 1e-6: counts of µm/s² for samples in m/s²) and rounded.
+    Only complete records are written while a segment goes on; the samples of the last one are
+    kept until more arrive or the segment ends, and so files do not depend on how samples were
+    chunked. The first difference of a segment is 0 and records of a segment chain their
+    differences, as libmseed does.
+    """
+
+    def __init__(self, path: str, network: str, station: str, location: str, channel: str, sample_rate: int,
+                 encoding: int = ENCODING_STEIM2, gain: float = 1e-6, record_length: int = 4096):
+        super().__init__(sample_rate)
+        if encoding not in (ENCODING_STEIM2, ENCODING_FLOAT32):
+            raise ValueError('Unsupported MiniSEED encoding %d' % encoding)
+        self.path = path
+        self.codes = (station.encode().ljust(5), location.encode().ljust(2), channel.encode().ljust(3),
+                      network.encode().ljust(2))
+        self.encoding = encoding
+        self.gain = gain
+        self.record_length = record_length
+        self.frames = (record_length - DATA_OFFSET) // 64
+        self.file = open(path, 'wb')
+        self.sequence = 0
+        self.record_count = 0
+        self.pending = None
+        '''Samples not yet in a record, int32 counts (Steim2) or float32.'''
+        self.pending_offset = 0
+        '''Index of the first pending sample in the segment.'''
+        self.previous = None
+        '''Last sample already in a record, for the first difference of the next one.'''
+
+        # Data word slots of a record in order: after the control word of each frame, and in the
+        # first frame after the forward and reverse integration constants
+        slots = [(frame, word) for frame in range(self.frames) for word in range(3 if frame == 0 else 1, 16)]
+        self.slot_frames = np.array([slot[0] for slot in slots])
+        self.slot_words = np.array([slot[1] for slot in slots])
+
+    def append(self, samples: np.ndarray):
+        if self.encoding == ENCODING_STEIM2:
+            counts = np.rint(samples.astype(np.float64) / self.gain)
+            if np.abs(counts).max() >= 1 << 31:
+                raise ValueError('Samples of %s out of int32 range at gain %g' % (self.path, self.gain))
+            samples = counts.astype(np.int32)
+        else:
+            samples = samples.astype('>f4')
+        self.pending = samples if self.pending is None else np.concatenate((self.pending, samples))
+        self.__flush(final=False)
+
+    def begin_segment(self):
+        self.pending = None
+        self.pending_offset = 0
+        self.previous = None
+
+    def finish(self):
+        self.__flush(final=True)
+
+    def __flush(self, final: bool):
+        """Writes the complete records of the pending samples, or all of them if ``final``."""
+        if self.pending is None or not len(self.pending):
+            return
+        if self.encoding == ENCODING_STEIM2:
+            written = self.__flush_steim2(final)
+        else:
+            written = self.__flush_float32(final)
+        if written:
+            self.previous = self.pending[written - 1]
+            self.pending = self.pending[written:]
+            self.pending_offset += written
+
+    def __flush_steim2(self, final: bool) -> int:
+        values = self.pending.astype(np.int64)
+        diffs = np.diff(values, prepend=values[0] if self.previous is None else int(self.previous))
+        words, nibbles, per_word = steim2_words(diffs)
+        ends = np.cumsum(per_word)
+        capacity = len(self.slot_words)
+        begin = 0
+        for first_word in range(0, len(words), capacity):
+            last_word = min(first_word + capacity, len(words))
+            end = int(ends[last_word - 1])
+            # Words near the end would change once more samples arrive
+            if not final and (last_word - first_word < capacity or end > len(values) - 7):
+                break
+            record_words = words[first_word:last_word]
+            frames = np.zeros((self.frames, 16), dtype=np.int64)
+            frames[self.slot_frames[:len(record_words)], self.slot_words[:len(record_words)]] = record_words
+            controls = np.bincount(self.slot_frames[:len(record_words)], minlength=self.frames,
+                                   weights=nibbles[first_word:last_word] << (30 - 2 * self.slot_words[:len(record_words)]))
+            frames[:, 0] = controls.astype(np.int64)
+            frames[0, 1] = values[begin] & 0xffffffff
+            frames[0, 2] = values[end - 1] & 0xffffffff
+            self.__write_record(begin, end - begin, frames.astype('>u4').tobytes())
+            begin = end
+        return begin
+
+    def __flush_float32(self, final: bool) -> int:
+        per_record = (self.record_length - DATA_OFFSET) // 4
+        begin = 0
+        while begin < len(self.pending) and (final or len(self.pending) - begin >= per_record):
+            end = min(begin + per_record, len(self.pending))
+            self.__write_record(begin, end - begin, self.pending[begin:end].tobytes())
+            begin = end
+        return begin
+
+    def __write_record(self, begin: int, sample_count: int, data: bytes):
+        self.sequence = self.sequence % 999999 + 1
+        start = self.sample_time(self.pending_offset + begin)
+        header = RECORD_HEADER.pack(b'%06d' % self.sequence, b'D', b' ', *self.codes, *btime(start),
+                                    sample_count, self.sample_rate, 1, 0, 0, 0, 1, 0, DATA_OFFSET, 48)
+        header += BLOCKETTE_1000.pack(1000, 0, self.encoding, 1, self.record_length.bit_length() - 1)
+        record = header.ljust(DATA_OFFSET, b'\0') + data
+        self.file.write(record.ljust(self.record_length, b'\0'))
+        self.record_count += 1
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+SAC_UNDEFINED = -12345
+SAC_HEADER = struct.Struct('<70f35i5i8s16s168s')
+'''Binary SAC header (version 6): floats, integers, logicals, station, event and the 21 other string fields.'''
+
+
+class SacWriter(SegmentWriter):
+    """Streams samples into binary (little endian) SAC files, one per contiguous segment.
+
+    Samples are written as they arrive after a placeholder header; the header (sample count, end
+    time, extrema, mean) is completed when the segment ends. Files are named
+    ``<network>.<station>.<location>.<channel>.<YYYY.DDD.HHMMSS>.sac`` after their start time.
+    """
+
+    def __init__(self, directory: str, network: str, station: str, location: str, channel: str, sample_rate: int,
+                 azimuth: float = SAC_UNDEFINED, inclination: float = SAC_UNDEFINED):
+        super().__init__(sample_rate)
+        self.directory = directory
+        self.codes = (network, station, location, channel)
+        self.azimuth = azimuth
+        self.inclination = inclination
+        self.file = None
+        self.paths = []
+        self.minimum = self.maximum = self.total = 0.0
+
+    def begin_segment(self):
+        seconds = self.segment_start // TICKS
+        name = '%s.%s.%s.%s.%s.sac' % (*self.codes, datetime.utcfromtimestamp(seconds).strftime('%Y.%j.%H%M%S'))
+        path = os.path.join(self.directory, name)
+        self.file = open(path, 'wb')
+        self.file.write(self.__header())
+        self.paths.append(path)
+        self.minimum, self.maximum, self.total = np.inf, -np.inf, 0.0
+
+    def append(self, samples: np.ndarray):
+        samples = samples.astype('<f4')
+        self.minimum = min(self.minimum, float(samples.min()))
+        self.maximum = max(self.maximum, float(samples.max()))
+        self.total += float(samples.sum(dtype=np.float64))
+        self.file.write(samples.tobytes())
+
+    def finish(self):
+        self.file.seek(0)
+        self.file.write(self.__header())
+        self.file.close()
+        self.file = None
+
+    def __header(self) -> bytes:
+        delta = 1.0 / self.sample_rate
+        count = self.segment_samples
+        floats = [float(SAC_UNDEFINED)] * 70
+        floats[0] = delta
+        if count:
+            floats[1], floats[2], floats[56] = self.minimum, self.maximum, self.total / count
+        floats[3] = 1.0
+        # Reference time is the start to the millisecond, b the rest
+        floats[5] = (self.segment_start % 10) / TICKS
+        floats[6] = floats[5] + (count - 1) * delta
+        floats[57], floats[58] = self.azimuth, self.inclination
+
+        start = datetime.utcfromtimestamp(self.segment_start // TICKS)
+        integers = [SAC_UNDEFINED] * 35
+        integers[0:6] = start.year, start.timetuple().tm_yday, start.hour, start.minute, start.second, \
+            self.segment_start % TICKS // 10
+        integers[6] = 6 # nvhdr
+        integers[9] = count # npts
+        integers[15] = 1 # iftype: ITIME
+        integers[16] = 8 # idep: IACC
+        integers[17] = 9 # iztype: IB
+        logicals = [1, 1, 1, 1, 0] # leven, lpspol, lovrok, lcalda
+
+        network, station, location, channel = (code.encode() for code in self.codes)
+        undefined = b'-12345'.ljust(8)
+        # khole, then ko, ka, kt0-kt9, kf and kuser0-2 undefined, kcmpnm, knetwk, kdatrd, kinst
+        strings = [location or undefined] + [undefined] * 16 + [channel, network, undefined, undefined]
+        return SAC_HEADER.pack(*floats, *integers, *logicals, station.ljust(8), undefined.ljust(16),
+                               b''.join(string.ljust(8) for string in strings))
+
+
+def export_station(db: pymongo.database.Database, station_id, start, end, directory: str, formats=('mseed',),
+                   network: str = 'XX', station: str = None, location: str = '', channels=('z', 'n', 'e'),
+                   encoding: int = ENCODING_STEIM2, gain: float = 1e-6) -> list:
+    """Exports a station's accelerations from ``start`` (inclusive) to ``end`` (exclusive), returns the files written.
+
+    ``start`` and ``end`` are as for ``WaveformReader.read_waveform()``. Accel hour documents are
+    read one at a time and streamed into a MiniSEED file per channel (``mseed``) and/or SAC files
+    per channel and contiguous segment (``sac``). The SEED station code defaults to the last 5
+    characters of the station ID. A change of sample rate starts new files."""
+    station = station or str(station_id)[-5:].upper()
+    start_second = int(np.floor(to_timestamp(start)))
+    end_second = int(np.ceil(to_timestamp(end)))
+    writers = []
+    paths = []
+    sample_rate = None
+    for hour_start in range(start_second - start_second % 3600, end_second, 3600):
+        first, last = max(start_second, hour_start) - hour_start, min(end_second, hour_start + 3600) - hour_start
+        accel_id = '%s:%s' % (datetime.utcfromtimestamp(hour_start).strftime('%Y%m%d%H'), station_id)
+        projection = {'r': 1}
+        projection.update((channel, {'$slice': [first, last - first]}) for channel in channels)
+        doc = db.accel.find_one({'_id': accel_id}, projection=projection)
+        if not doc:
+            continue
+        if doc['r'] != sample_rate:
+            for writer in writers:
+                writer.close()
+            paths.extend(path for writer in writers for path in writer_paths(writer))
+            sample_rate = doc['r']
+            writers = open_writers(directory, formats, network, station, location, channels, sample_rate,
+                                   (hour_start + first) * TICKS, encoding, gain)
+        start_ticks = (hour_start + first) * TICKS
+        for index, channel in enumerate(channels):
+            samples = decode_seconds(doc.get(channel) or [None] * (last - first), sample_rate).ravel()
+            for writer in writers[index::len(channels)]:
+                writer.write(start_ticks, samples)
+        logger.debug('Exported %s', accel_id)
+    for writer in writers:
+        writer.close()
+    paths.extend(path for writer in writers for path in writer_paths(writer))
+    return paths
+
+
+def open_writers(directory: str, formats, network: str, station: str, location: str, channels, sample_rate: int,
+                 start_ticks: int, encoding: int, gain: float) -> list:
+    """Returns the writers of each format for each channel, format-major."""
+    writers = []
+    for export_format in formats:
+        for channel in channels:
+            codes = (network, station, location, channel_code(channel, sample_rate))
+            if export_format == 'mseed':
+                name = '%s.%s.%s.%s.%s.mseed' % (
+                    *codes, datetime.utcfromtimestamp(start_ticks // TICKS).strftime('%Y.%j.%H%M%S'))
+                writers.append(MiniSeedWriter(os.path.join(directory, name), *codes, sample_rate, encoding, gain))
+            elif export_format == 'sac':
+                writers.append(SacWriter(directory, *codes, sample_rate, *CHANNEL_ORIENTATION[channel][1:]))
+            else:
+                raise ValueError('Unknown export format %s' % export_format)
+    return writers
+
+
+def writer_paths(writer: SegmentWriter) -> list:
+    """Files written by a closed writer, MiniSEED files only if they got any record."""
+    if isinstance(writer, SacWriter):
+        return writer.paths
+    if writer.record_count:
+        return [writer.path]
+    os.remove(writer.path)
+    return []
+
+
+worker_db: pymongo.database.Database = None
+'''Of this worker process.'''
+
+
+def init_worker(mongodb_uri: str):
+    global worker_db
+    worker_db = MongoClient(mongodb_uri).ecn
+
+
+def export_one(station_id, station: str, *args, **kwargs) -> list:
+    return export_station(worker_db, station_id, *args, station=station, **kwargs)
+
+
+def export_stations(mongodb_uri: str, stations: dict, start, end, directory: str, workers: int = None,
+                    **kwargs) -> list:
+    """Exports ``stations`` (station ID -> SEED station code or None) in a process pool, a station per task.
+
+    Other arguments are as for ``export_station()``; each worker process has its own MongoDB
+    connection and streams one station at a time. Returns the files written."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    with ProcessPoolExecutor(workers or os.cpu_count(), initializer=init_worker, initargs=(mongodb_uri,)) as executor:
+        futures = {station_id: executor.submit(export_one, station_id, station, start, end, directory, **kwargs)
+                   for station_id, station in stations.items()}
+        for station_id, future in futures.items():
+            try:
+                station_paths = future.result()
+            except Exception as e:
+                logger.error('Export of station %s failed', station_id, exc_info=e)
+                continue
+            logger.info('Exported station %s into %d files', station_id, len(station_paths))
+            paths.extend(station_paths)
+    return paths
+
+
+def parse_time(value: str) -> datetime:
+    """Parses a UTC time argument like ``2019-08-02T12:00``."""
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('Expected a time like 2019-08-02T12:00, got %s' % value)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m ecn.export',
+                                     description='Writes station accelerations as MiniSEED and/or SAC files.')
+    parser.add_argument('stations', nargs='+', metavar='STATION_ID[=CODE]',
+                        help='station IDs, optionally with the SEED station code to use')
+    parser.add_argument('--start', required=True, type=parse_time, help='UTC, e.g. 2019-08-02T12:00')
+    parser.add_argument('--end', required=True, type=parse_time, help='UTC, exclusive')
+    parser.add_argument('--out', default='.', help='output directory')
+    parser.add_argument('--format', nargs='+', choices=('mseed', 'sac'), default=['mseed'])
+    parser.add_argument('--network', default='XX', help='SEED network code')
+    parser.add_argument('--location', default='', help='SEED location code')
+    parser.add_argument('--encoding', choices=('steim2', 'float32'), default='steim2', help='MiniSEED encoding')
+    parser.add_argument('--gain', type=float, default=1e-6, help='m/s² per Steim2 count')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to CPU count')
+    args = parser.parse_args(argv)
+
+    load_dotenv(verbose=True)
+    logging.basicConfig(level=logging.INFO)
+    stations = {}
+    for arg in args.stations:
+        station_id, _, code = arg.partition('=')
+        stations[station_id] = code or None
+    paths = export_stations(os.environ['MONGODB_URI'], stations, args.start, args.end, args.out, args.workers,
+                            formats=args.format, network=args.network, location=args.location,
+                            encoding=ENCODING_STEIM2 if args.encoding == 'steim2' else ENCODING_FLOAT32,
+                            gain=args.gain)
+    logger.info('Wrote %d files to %s', len(paths), args.out)
+
+
+if __name__ == '__main__':
+    main()
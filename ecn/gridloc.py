@@ -0,0 +1,100 @@
+# Earthquake localization using progressive search grid, the batch version of gridloc/gridloc-numpy.ipynb
+from collections import namedtuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+'''Mean Earth radius, in meters.'''
+P_WAVE_VELOCITY = 7437.0
+'''Primary wave velocity, in m/s (0.067 degree/s * 111000 m).'''
+
+Estimate = namedtuple('Estimate', ['lat', 'lon', 'origin_time', 'score'])
+'''Epicenter (degrees), origin time (seconds since UTC epoch) and its weighted RMSE (lower is better).'''
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in meters between points given in degrees, broadcasting like any ufunc."""
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def score(distances: np.ndarray, arrivals: np.ndarray, origin_times: np.ndarray,
+          velocity: float = P_WAVE_VELOCITY) -> np.ndarray:
+    """Weighted RMSE of arrival times for every (grid point, origin time) candidate.
+
+    ``distances`` has shape (points, stations), ``arrivals`` (stations,) and ``origin_times``
+    (times,), in seconds. Stations are weighted by 1000 / distance (km^-1) so near stations
+    count more. Returns an array of shape (points, times)."""
+    weights = 1000 / np.maximum(distances, 1.0)
+    # (points, times, stations)
+    errors = origin_times[None, :, None] + (distances / velocity)[:, None, :] - arrivals[None, None, :]
+    return np.sqrt(np.mean(weights[:, None, :] * np.square(errors), axis=2))
+
+
+class GridLocator:
+    """Finds the epicenter and origin time of one event from P-wave arrivals, coarse-to-fine.
+
+    The coarse grid (``radius`` degrees around the first station, every ``step`` degrees) is
+    fixed, so its station distance columns are computed once per station as arrivals come in.
+    Each of ``levels`` refinements searches around the previous best candidate with a
+    ``refine`` times finer step, in space and time."""
+
+    def __init__(self, center_lat: float, center_lon: float, radius: float = 3.0, step: float = 0.3,
+                 max_lead: float = 30.0, time_step: float = 1.0, levels: int = 3, refine: int = 10,
+                 velocity: float = P_WAVE_VELOCITY):
+        center_lat = round(center_lat / step) * step
+        center_lon = round(center_lon / step) * step
+        offsets = np.arange(-radius, radius + step / 2, step)
+        lats, lons = np.meshgrid(center_lat + offsets, center_lon + offsets, indexing='ij')
+        self.grid_lats = lats.ravel()
+        self.grid_lons = lons.ravel()
+        self.step = step
+        self.max_lead = max_lead
+        self.time_step = time_step
+        self.levels = levels
+        self.refine = refine
+        self.velocity = velocity
+        self.station_lats = []
+        self.station_lons = []
+        self.arrivals = []
+        self.distances = np.empty((len(self.grid_lats), 0))
+        '''(coarse grid points, stations) in meters.'''
+
+    def add_arrival(self, lat: float, lon: float, arrival_time: float):
+        """Adds the P-wave arrival at a station, ``arrival_time`` in seconds since UTC epoch."""
+        self.station_lats.append(lat)
+        self.station_lons.append(lon)
+        self.arrivals.append(arrival_time)
+        column = haversine(self.grid_lats, self.grid_lons, lat, lon)
+        self.distances = np.concatenate([self.distances, column[:, None]], axis=1)
+
+    def locate(self) -> Estimate:
+        """Returns the best estimate from the arrivals so far."""
+        # Relative to the first arrival, so float precision is spent on what matters
+        reference = min(self.arrivals)
+        arrivals = np.array(self.arrivals) - reference
+        station_lats = np.array(self.station_lats)
+        station_lons = np.array(self.station_lons)
+
+        origin_times = -np.arange(0, self.max_lead + self.time_step / 2, self.time_step)
+        scores = score(self.distances, arrivals, origin_times, self.velocity)
+        point, time = np.unravel_index(np.argmin(scores), scores.shape)
+        lat, lon, origin_time = self.grid_lats[point], self.grid_lons[point], origin_times[time]
+        best = scores[point, time]
+
+        step, time_step = self.step, self.time_step
+        fractions = np.linspace(-1, 1, 2 * self.refine + 1)
+        for level in range(self.levels):
+            lats, lons = np.meshgrid(lat + fractions * step, lon + fractions * step, indexing='ij')
+            lats, lons = lats.ravel(), lons.ravel()
+            origin_times = origin_time + fractions * time_step
+            distances = haversine(lats[:, None], lons[:, None], station_lats[None, :], station_lons[None, :])
+            scores = score(distances, arrivals, origin_times, self.velocity)
+            point, time = np.unravel_index(np.argmin(scores), scores.shape)
+            lat, lon, origin_time = lats[point], lons[point], origin_times[time]
+            best = scores[point, time]
+            step /= self.refine
+            time_step /= self.refine
+
+        return Estimate(float(lat), float(lon), reference + float(origin_time), float(best))
@@ -0,0 +1,139 @@
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+from ecn import StationState
+from ecn.bulk_writer import AccelBulkWriter
+
+
+class StationLiveness:
+    """What the tracker knows of one station."""
+    __slots__ = ('state', 'seen_at', 'last_seen', 'lost')
+
+    def __init__(self, state: str, seen_at: datetime, last_seen: float):
+        self.state = state
+        '''Last state written to the station document.'''
+        self.seen_at = seen_at
+        '''Time of the last message, as written to ``t``.'''
+        self.last_seen = last_seen
+        '''time.monotonic() of the last message.'''
+        self.lost = False
+
+
+class LivenessTracker:
+    """In-memory station state machine, so station documents are written when something changes, not per message.
+
+    Handlers report every message with ``seen()``. The state (``s``) and time (``t``) are written
+    right away only when the state changes; otherwise ``t`` of the stations seen since is written
+    in one batch every ``heartbeat_interval`` seconds. A station silent for ``lost_after`` seconds
+    is marked ``L``ost by a timer wheel of ``tick``-second slots: each station sits in the slot of
+    its deadline, and a slot coming due only looks at its own stations, rescheduling those seen
+    since. Each station is so looked at about once per ``lost_after``, never all at once.
+
+    Call ``start()`` to run the wheel and heartbeats from a background thread, or ``tick()`` periodically.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, writer: AccelBulkWriter, lost_after: float = 60, heartbeat_interval: float = 60,
+                 tick: float = 1.0):
+        self.writer: AccelBulkWriter = writer
+        self.lost_after = lost_after
+        self.heartbeat_interval = heartbeat_interval
+        self.tick_interval = tick
+        self.lock = threading.Lock()
+        self.stations = {}
+        '''station ID -> StationLiveness'''
+        self.dirty = set()
+        '''Stations seen since their ``t`` was last written.'''
+        self.slots = [set() for i in range(int(math.ceil(lost_after / tick)) + 1)]
+        '''Timer wheel, station IDs in the slot of their (possibly outdated) deadline tick.'''
+        self.position = int(time.monotonic() // tick)
+        '''Last tick processed.'''
+        self.next_heartbeat = time.monotonic() + heartbeat_interval
+        self.state_writes = 0
+        self.heartbeat_writes = 0
+        self.lost_count = 0
+
+    def seen(self, station_id, state: str, seen_at: datetime):
+        """Records a message from a station in ``state`` at ``seen_at``, writing only if the state changed."""
+        now = time.monotonic()
+        with self.lock:
+            station = self.stations.get(station_id)
+            if station is None:
+                station = self.stations[station_id] = StationLiveness(None, seen_at, now)
+                self.__schedule(station_id, now)
+            elif station.lost:
+                station.lost = False
+                self.__schedule(station_id, now)
+            station.last_seen = now
+            station.seen_at = seen_at
+            if station.state == state:
+                self.dirty.add(station_id)
+                return
+            station.state = state
+            self.dirty.discard(station_id)
+            self.state_writes += 1
+        self.writer.set_station(station_id, {'s': state, 't': seen_at})
+
+    def __schedule(self, station_id, last_seen: float):
+        """Puts a station in the slot of its deadline, the caller holds the lock."""
+        deadline_tick = int(math.ceil((last_seen + self.lost_after) / self.tick_interval))
+        self.slots[deadline_tick % len(self.slots)].add(station_id)
+
+    def tick(self, now: float = None):
+        """Marks stations lost whose slots came due since the last tick, and writes heartbeats when due."""
+        now = time.monotonic() if now is None else now
+        lost = []
+        heartbeats = []
+        with self.lock:
+            target = int(now // self.tick_interval)
+            # After a stall, one turn of the wheel covers every slot
+            self.position = max(self.position, target - len(self.slots))
+            while self.position < target:
+                self.position += 1
+                index = self.position % len(self.slots)
+                due, self.slots[index] = self.slots[index], set()
+                for station_id in due:
+                    station = self.stations.get(station_id)
+                    if station is None or station.lost:
+                        continue
+                    if now - station.last_seen >= self.lost_after:
+                        station.lost = True
+                        station.state = StationState.LOST
+                        self.dirty.discard(station_id)
+                        lost.append(station_id)
+                    else:
+                        self.__schedule(station_id, station.last_seen)
+            if now >= self.next_heartbeat:
+                self.next_heartbeat = now + self.heartbeat_interval
+                heartbeats = [(station_id, self.stations[station_id].seen_at) for station_id in self.dirty]
+                self.dirty = set()
+            self.lost_count += len(lost)
+            self.heartbeat_writes += len(heartbeats)
+
+        for station_id in lost:
+            self.logger.info('Station %s lost: silent for %d seconds', station_id, self.lost_after)
+            self.writer.set_station(station_id, {'s': StationState.LOST})
+        for station_id, seen_at in heartbeats:
+            self.writer.set_station(station_id, {'t': seen_at})
+
+    def start(self):
+        """Calls ``tick()`` from a background thread."""
+        def run():
+            while True:
+                time.sleep(self.tick_interval)
+                try:
+                    self.tick()
+                except Exception as e:
+                    self.logger.error('Liveness tick failed', exc_info=e)
+        threading.Thread(target=run, name='ecn-liveness', daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            'stations': len(self.stations),
+            'lost': self.lost_count,
+            'state_writes': self.state_writes,
+            'heartbeat_writes': self.heartbeat_writes,
+        }
@@ -0,0 +1,319 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+'''Histogram buckets (upper bounds, seconds) for handler and MongoDB timings.'''
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+'''Histogram buckets (upper bounds, seconds) for queue lag.'''
+
+
+class ThreadCells:
+    """Per-thread values, each written only by its own thread and summed when scraped: no lock on the hot path."""
+
+    def __init__(self, new):
+        self.new = new
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cells = []
+        '''Cells of all threads, also of finished threads, so counters never go back.'''
+
+    def cell(self):
+        try:
+            return self.local.cell
+        except AttributeError:
+            cell = self.local.cell = self.new()
+            with self.lock:
+                self.cells.append(cell)
+            return cell
+
+    def snapshot(self) -> list:
+        """Copies of all cells, ``dict.copy()`` being atomic while owners keep writing."""
+        with self.lock:
+            cells = list(self.cells)
+        return [cell.copy() for cell in cells]
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Counter:
+    """Monotonic counter, per tuple of label values (in the order of ``labelnames``)."""
+    TYPE = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.cells = ThreadCells(dict)
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        cell = self.cells.cell()
+        cell[labels] = cell.get(labels, 0) + amount
+
+    def values(self) -> dict:
+        totals = {}
+        for cell in self.cells.snapshot():
+            for labels, value in cell.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list:
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, labels), format_value(value))
+                for labels, value in sorted(self.values().items(), key=lambda item: tuple(map(str, item[0])))]
+
+
+class Histogram:
+    """Distribution of observed values (e.g. seconds) in cumulative ``buckets``, per tuple of label values.
+
+    Timing code asks ``sample()`` first, which is True once every ``sample_every`` calls in each
+    thread, and only then reads the clock: counts are of sampled observations."""
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 sample_every: int = 1):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.sample_every = sample_every
+        self.cells = ThreadCells(dict)
+        '''labels -> [count per bucket..., count above the last bucket, sum]'''
+        self.local = threading.local()
+
+    def sample(self) -> bool:
+        countdown = getattr(self.local, 'countdown', 0)
+        if countdown:
+            self.local.countdown = countdown - 1
+            return False
+        self.local.countdown = self.sample_every - 1
+        return True
+
+    def observe(self, value: float, labels: tuple = ()):
+        cell = self.cells.cell()
+        counts = cell.get(labels)
+        if counts is None:
+            counts = cell[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self) -> list:
+        totals = {}
+        for cell in self.cells.snapshot():
+            for labels, counts in cell.items():
+                counts = list(counts)
+                total = totals.get(labels)
+                totals[labels] = counts if total is None else [a + b for a, b in zip(total, counts)]
+        lines = []
+        for labels, counts in sorted(totals.items(), key=lambda item: tuple(map(str, item[0]))):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(
+                    self.labelnames, labels, 'le="%s"' % ('+Inf' if bound == float('inf') else repr(bound))),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(self.labelnames, labels), format_value(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, format_labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+class Gauge:
+    """Current value read by ``function()`` when scraped: a number, or a dict of label values tuple -> number."""
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help: str, function, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.labelnames = labelnames
+
+    def render(self) -> list:
+        value = self.function()
+        values = value if isinstance(value, dict) else {(): value}
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, labels), format_value(value))
+                for labels, value in sorted(values.items())]
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class PhaseTimer:
+    """Times the phases of one handler call, each ``lap()`` observing the time since the previous one."""
+    __slots__ = ('histogram', 'handler', 'last')
+
+    def __init__(self, histogram: Histogram, handler: str):
+        self.histogram = histogram
+        self.handler = handler
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, (self.handler, phase))
+        self.last = now
+
+
+class NullTimer:
+    """Stands in for a PhaseTimer when a call is not sampled."""
+    __slots__ = ()
+
+    def lap(self, phase: str):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def published_at(properties) -> float:
+    """Publish time (seconds since UTC epoch) of an AMQP message, None if the publisher did not set it.
+
+    Prefers the millisecond ``timestamp_in_ms`` header of RabbitMQ's message timestamp plugin."""
+    if properties is None:
+        return None
+    headers = properties.headers
+    if headers and 'timestamp_in_ms' in headers:
+        return headers['timestamp_in_ms'] / 1000
+    return properties.timestamp
+
+
+class IngestMetrics:
+    """The metrics of ``stationd.py``, to be scraped in Prometheus text format from ``serve()``.
+
+    Together they tell where time goes: in the broker (deliveries, queue lag from publish to
+    delivery), in this process (worker pool wait, handler decode/transform/write phases) or in
+    MongoDB (operations and their latency, from ``MongoListener``). Timers are sampled once every
+    ``sample_every`` calls per thread; counters count everything.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, sample_every: int = 16):
+        self.metrics = []
+        self.deliveries = self.add(Counter('ecn_deliveries_total', 'Messages delivered', ('queue',)))
+        self.delivery_bytes = self.add(Counter('ecn_delivery_bytes_total', 'Bytes of messages delivered', ('queue',)))
+        self.queue_lag = self.add(Histogram(
+            'ecn_queue_lag_seconds', 'Time from publish to delivery (sampled), of messages with an AMQP timestamp',
+            ('queue',), LAG_BUCKETS, sample_every))
+        self.worker_wait = self.add(Histogram(
+            'ecn_worker_wait_seconds', 'Time deliveries wait for a worker thread (sampled)', (), DEFAULT_BUCKETS,
+            sample_every))
+        self.handler_seconds = self.add(Histogram(
+            'ecn_handler_seconds', 'Handler time per phase (sampled)', ('handler', 'phase'), DEFAULT_BUCKETS,
+            sample_every))
+        self.handler_errors = self.add(Counter('ecn_handler_errors_total', 'Messages dropped by handlers',
+                                               ('handler', 'reason')))
+        self.station_messages = self.add(Counter('ecn_station_messages_total', 'Messages handled per station',
+                                                 ('handler', 'station')))
+        self.mongo_operations = self.add(Counter('ecn_mongo_operations_total', 'MongoDB commands',
+                                                 ('command', 'collection', 'outcome')))
+        self.mongo_documents = self.add(Counter('ecn_mongo_documents_total',
+                                                'Documents in MongoDB insert/update/delete commands',
+                                                ('command', 'collection')))
+        self.mongo_seconds = self.add(Histogram('ecn_mongo_operation_seconds', 'MongoDB command latency',
+                                                ('command',)))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, function, labelnames: tuple = ()):
+        """Adds a gauge read by ``function()`` on each scrape, see ``Gauge``."""
+        return self.add(Gauge(name, help, function, labelnames))
+
+    def timer(self, handler: str):
+        """Returns a PhaseTimer for a handler call if sampled, otherwise NULL_TIMER."""
+        if self.handler_seconds.sample():
+            return PhaseTimer(self.handler_seconds, handler)
+        return NULL_TIMER
+
+    def delivered(self, queue: str, properties, body: bytes):
+        """Counts a delivery, and samples its lag since publish."""
+        labels = (queue,)
+        self.deliveries.inc(labels)
+        self.delivery_bytes.inc(labels, len(body))
+        if self.queue_lag.sample():
+            published = published_at(properties)
+            if published:
+                self.queue_lag.observe(max(time.time() - published, 0.0), labels)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                self.logger.error('Cannot render metric %s', metric.name, exc_info=e)
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.TYPE))
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> HTTPServer:
+        """Serves ``GET /metrics`` from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='ecn-metrics', daemon=True).start()
+        self.logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+        return server
+
+
+class MongoListener(monitoring.CommandListener):
+    """Counts and times every MongoDB command, pass as ``MongoClient(event_listeners=[...])``."""
+    DOCUMENT_FIELDS = {'insert': 'documents', 'update': 'updates', 'delete': 'deletes'}
+
+    def __init__(self, metrics: IngestMetrics):
+        self.metrics = metrics
+        self.started_commands = {}
+        '''(connection, request ID) -> (command name, collection)'''
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else ''
+        self.started_commands[(event.connection_id, event.request_id)] = (event.command_name, collection)
+        documents = self.DOCUMENT_FIELDS.get(event.command_name)
+        if documents and documents in event.command:
+            self.metrics.mongo_documents.inc((event.command_name, collection), len(event.command[documents]))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.__finished(event, 'ok')
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.__finished(event, 'failed')
+
+    def __finished(self, event, outcome: str):
+        command_name, collection = self.started_commands.pop((event.connection_id, event.request_id),
+                                                             (event.command_name, ''))
+        self.metrics.mongo_operations.inc((command_name, collection, outcome))
+        self.metrics.mongo_seconds.observe(event.duration_micros / 1e6, (command_name,))
@@ -1,77 +1,144 @@
 import json
 import logging
 
+import numpy as np
 import pymongo
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from ecn import StationKind, StationState
+from ecn import StationKind, StationState, AccelFormat
 from ecn import ecn_mobile_pb2
+from ecn.accel_format import encode_seconds
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.detection import StaLtaDetector
+from ecn.liveness import LivenessTracker
+from ecn.metrics import NULL_TIMER, IngestMetrics
+from ecn.summary import AccelSummarizer
 
 class MobileHandler:
     logger = logging.getLogger(__name__)
 
-    def __init__(self, db: pymongo.database.Database):
+    def __init__(self, db: pymongo.database.Database, writer: AccelBulkWriter = None,
+                 cache: MetadataCache = None, accel_format: int = AccelFormat.LIST,
+                 detector: StaLtaDetector = None, summarizer: AccelSummarizer = None,
+                 liveness: LivenessTracker = None, metrics: IngestMetrics = None):
         self.db: pymongo.database.Database = db
+        self.accel_format = accel_format
+        # Without a shared writer, flush every update right away
+        self.writer: AccelBulkWriter = writer or AccelBulkWriter(db, max_ops=1)
+        self.cache: MetadataCache = cache or MetadataCache()
+        self.detector: StaLtaDetector = detector
+        self.summarizer: AccelSummarizer = summarizer
+        self.liveness: LivenessTracker = liveness
+        self.metrics: IngestMetrics = metrics
+
+    @staticmethod
+    def partition_key(body: bytes) -> bytes:
+        """Returns the encoded station_id without parsing the whole stream, used to keep each station's messages in order."""
+        # protoc serializes fields in order, so station_id (field 1, varint) comes first when set
+        if body[:1] == b'\x08':
+            end = 1
+            while end < len(body) and body[end] & 0x80:
+                end += 1
+            return bytes(body[1:end + 1])
+        return b''
 
     def receive(self, body: bytearray):
+        timer = self.metrics.timer('mobile_stream') if self.metrics else NULL_TIMER
         msg: ecn_mobile_pb2.MobileStream = ecn_mobile_pb2.MobileStream()
         msg.ParseFromString(body)
-        # self.logger.debug('Station: %s', station_id)
-        accel_coll: pymongo.collection.Collection = self.db.accel
-        cur_time = datetime.utcfromtimestamp(msg.start_time/1000)
-        # self.logger.debug('Received %d bytes stream from mobile station %s, start_time=%s, sample_rate=%d Hz',
-        #                   len(body), msg.station_id, cur_time, msg.sample_rate)
-
-        cur_hour = cur_time.strftime('%Y%m%d%H')
-        accel_z_buf = {}
-        accel_n_buf = {}
-        accel_e_buf = {}
-        sample_idx = 0 # Pointer to current sample index being processed.
-        while sample_idx < len(msg.accel_z):
-            accel_z_buf[60 * cur_time.minute + cur_time.second] = msg.accel_z[sample_idx : sample_idx + msg.sample_rate]
-            accel_n_buf[60 * cur_time.minute + cur_time.second] = msg.accel_n[sample_idx : sample_idx + msg.sample_rate]
-            accel_e_buf[60 * cur_time.minute + cur_time.second] = msg.accel_e[sample_idx : sample_idx + msg.sample_rate]
-            sample_idx += msg.sample_rate
-            cur_time = cur_time + timedelta(seconds=1)
-            next_hour = cur_time.strftime('%Y%m%d%H')
-            if next_hour != cur_hour:
-                # Flush this hour first
-                self.__upsert_data(msg.station_id, cur_hour, cur_time, msg.sample_rate,
-                                   accel_z_buf, accel_n_buf, accel_e_buf)
-                accel_z_buf = {}
-                accel_n_buf = {}
-                accel_e_buf = {}
-                cur_hour = next_hour
-
-        # Usually we have some data here, so flush it
-        if accel_z_buf:
-            self.__upsert_data(msg.station_id, cur_hour, cur_time, msg.sample_rate,
-                               accel_z_buf, accel_n_buf, accel_e_buf)
-            accel_z_buf = {}
-            accel_n_buf = {}
-            accel_e_buf = {}
-
-    def __upsert_data(self, station_id: int, cur_hour: str, cur_time: datetime, sample_rate: int,
-                      accel_z_buf: [], accel_n_buf: [], accel_e_buf: []):
+        if msg.sample_rate <= 0:
+            self.logger.error('Ignoring stream from mobile station %s: sample_rate=%d', msg.station_id, msg.sample_rate)
+            if self.metrics:
+                self.metrics.handler_errors.inc(('mobile_stream', 'sample_rate'))
+            return
+        timer.lap('decode')
+
+        sample_count = min(len(msg.accel_z), len(msg.accel_n), len(msg.accel_e))
+        samples = None
+        if self.accel_format == AccelFormat.FLOAT32 or self.detector or self.summarizer:
+            # One (3, seconds, sample_rate) array, a partial last second is padded with NaN
+            samples = np.full((3, -(-sample_count // msg.sample_rate) * msg.sample_rate), np.nan, dtype=np.float32)
+            samples[0, :sample_count] = msg.accel_z[:sample_count]
+            samples[1, :sample_count] = msg.accel_n[:sample_count]
+            samples[2, :sample_count] = msg.accel_e[:sample_count]
+            samples = samples.reshape(3, -1, msg.sample_rate)
+        if self.accel_format == AccelFormat.FLOAT32:
+            accels = samples
+        else:
+            # Slice each repeated field into a list once, rows are then cheap list slices
+            accels = (msg.accel_z[:sample_count], msg.accel_n[:sample_count], msg.accel_e[:sample_count])
+
+        # mark as 'A'lert while triggered, otherwise 'H'igh rate
+        state = StationState.HIGH_RATE
+        if self.detector and sample_count:
+            zne = samples.reshape(3, -1)[:, :sample_count]
+            # Seconds start on the whole second, see bucket_by_hour()
+            if self.detector.update(msg.station_id, zne, msg.sample_rate, msg.start_time // 1000):
+                state = StationState.ALERT
+        hours = list(bucket_by_hour(msg.start_time, msg.sample_rate, sample_count))
+        if self.summarizer:
+            for hour_start, first_second, seconds_of_hour in hours:
+                accel_id = '%s:%s' % (datetime.utcfromtimestamp(hour_start).strftime('%Y%m%d%H'), msg.station_id)
+                self.summarizer.summarize(accel_id, seconds_of_hour[0],
+                                          samples[:, first_second:first_second + len(seconds_of_hour)])
+        timer.lap('transform')
+
+        for hour_start, first_second, seconds_of_hour in hours:
+            self.__upsert_data(msg.station_id, hour_start, first_second, seconds_of_hour, accels, msg.sample_rate,
+                               state)
+        timer.lap('write')
+        if self.metrics:
+            self.metrics.station_messages.inc(('mobile_stream', msg.station_id))
+
+    def __upsert_data(self, station_id: int, hour_start: int, first_second: int, seconds_of_hour: range,
+                      accels, sample_rate: int, state: str):
         accel_coll: pymongo.collection.Collection = self.db.accel
-        accel_id = '%s:%s' % (cur_hour, station_id)
-        existing_accel_doc = accel_coll.find_one({'_id': accel_id}, projection={'_id': 1})
-        if not existing_accel_doc:
-            # "Preallocate" top-level arrays only
-            self.logger.debug('Inserting mobile accel %s sample_rate=%d', accel_id, sample_rate)
-            accels = [None for sec in range(60 * 60)]
-            accel_coll.insert_one({'_id': accel_id, 'r': sample_rate, 'z': accels, 'n': accels, 'e': accels})
-
-        update_doc = {'$set': {}}
-        for second_of_hour, samples in accel_z_buf.items():
-            update_doc['$set']['z.%d' % second_of_hour] = samples
-        for second_of_hour, samples in accel_n_buf.items():
-            update_doc['$set']['n.%d' % second_of_hour] = samples
-        for second_of_hour, samples in accel_e_buf.items():
-            update_doc['$set']['e.%d' % second_of_hour] = samples
-        # self.logger.debug('Updating accel %s with %s', accel_id, update_doc['$set'].keys())
-        accel_coll.update_one({'_id': accel_id}, update_doc)
-
-        # mark as 'H'igh rate
-        station_coll: pymongo.collection.Collection = self.db.station
-        station_coll.update_one({'_id': station_id}, {'$set': {'s': StationState.HIGH_RATE, 't': cur_time}})
+        accel_id = '%s:%s' % (datetime.utcfromtimestamp(hour_start).strftime('%Y%m%d%H'), station_id)
+        self.cache.ensure_accel(accel_coll, accel_id, sample_rate, self.accel_format)
+
+        update_set = {}
+        if self.accel_format == AccelFormat.FLOAT32:
+            for axis, rows in zip(('z', 'n', 'e'), accels):
+                update_set.update(zip(['%s.%d' % (axis, second_of_hour) for second_of_hour in seconds_of_hour],
+                                      encode_seconds(rows[first_second:first_second + len(seconds_of_hour)],
+                                                     self.accel_format)))
+        else:
+            # The last second of the stream may be partial, it is stored with only its actual samples
+            offsets = range(first_second * sample_rate, (first_second + len(seconds_of_hour)) * sample_rate,
+                            sample_rate)
+            for axis, values in zip(('z', 'n', 'e'), accels):
+                update_set.update(zip(['%s.%d' % (axis, second_of_hour) for second_of_hour in seconds_of_hour],
+                                      [values[offset:offset + sample_rate] for offset in offsets]))
+        self.writer.set_accel(accel_id, update_set)
+
+        end_time = datetime.utcfromtimestamp(hour_start + seconds_of_hour[-1] + 1)
+        if self.liveness:
+            self.liveness.seen(station_id, state, end_time)
+        else:
+            self.writer.set_station(station_id, {'s': state, 't': end_time})
+
+
+def bucket_by_hour(start_time: int, sample_rate: int, sample_count: int):
+    """Splits a stream into seconds grouped by the hour they belong to, arithmetically.
+
+    ``start_time`` is in milliseconds since UTC epoch. Its sub-second part is dropped:
+    sample 0 is the first sample of the second the stream started in, as phones start
+    streams around millisecond 0. If ``sample_count`` is not a multiple of ``sample_rate``,
+    the last second is partial.
+
+    Yields ``(hour_start, first_second, seconds_of_hour)`` per hour, where ``hour_start`` is in
+    seconds since UTC epoch, ``first_second`` is the index of the hour's first second in the
+    stream and ``seconds_of_hour`` is the range of seconds of hour covered.
+    """
+    second_count = -(-sample_count // sample_rate)
+    start_second = start_time // 1000
+    # Stream second index where each hour starts
+    first_rollover = -start_second % 3600 or 3600
+    boundaries = [0] + list(range(first_rollover, second_count, 3600)) + [second_count]
+    for begin, end in zip(boundaries, boundaries[1:]):
+        if begin == end:
+            continue
+        first_second_of_hour = (start_second + begin) % 3600
+        yield (start_second + begin - first_second_of_hour, begin,
+               range(first_second_of_hour, first_second_of_hour + end - begin))
@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pymongo
+
+from ecn.accel_format import decode_seconds
+
+Waveform = namedtuple('Waveform', ['times', 'data', 'sample_rate'])
+'''``times`` is the datetime64[us] (UTC) of each sample, ``data`` the float32 samples of shape (channels, samples).'''
+
+
+def to_timestamp(value) -> float:
+    """Seconds since UTC epoch of a naive UTC or aware ``datetime``, or of a number as is."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class WaveformReader:
+    """Reads any time range of a station's accelerations from its accel hour documents.
+
+    Only the seconds in range are fetched, using ``$slice`` projections, and the hours of a
+    multi-hour range are fetched in parallel. Hours which ended more than ``immutable_after``
+    seconds ago no longer change, so their seconds are fetched in whole minutes and kept as
+    decoded float32 blocks in an LRU cache of up to ``max_minutes`` channel-minutes: reading the
+    same (or an overlapping) window again costs no query.
+    """
+    logger = logging.getLogger(__name__)
+    BLOCK = 60
+    '''Seconds per cached block.'''
+
+    def __init__(self, db: pymongo.database.Database, max_minutes: int = 4096, immutable_after: float = 600,
+                 workers: int = 4):
+        self.db: pymongo.database.Database = db
+        self.max_minutes = max_minutes
+        self.immutable_after = immutable_after
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='ecn-query')
+        self.lock = threading.Lock()
+        self.blocks = OrderedDict()
+        '''(accel ID, channel, minute of hour) -> (sample rate, (60, rate) float32), or (accel ID,) -> None if missing.'''
+        self.hits = 0
+        self.misses = 0
+
+    def read_waveform(self, station_id, start, end, channels=('z', 'n', 'e'), sample_rate: int = None) -> Waveform:
+        """Returns the samples of ``channels`` from ``start`` (inclusive) to ``end`` (exclusive), in whole seconds.
+
+        ``start`` and ``end`` are naive UTC or aware datetimes, or seconds since UTC epoch. Missing
+        seconds and samples are NaN. ``sample_rate`` defaults to the rate of the first hour found;
+        hours stored at another rate are left NaN. Without any hour document there are no samples."""
+        start_second = int(np.floor(to_timestamp(start)))
+        end_second = int(np.ceil(to_timestamp(end)))
+        hours = [(hour_start, max(start_second, hour_start) - hour_start, min(end_second, hour_start + 3600) - hour_start)
+                 for hour_start in range(start_second - start_second % 3600, end_second, 3600)]
+        if len(hours) > 1:
+            results = list(self.executor.map(lambda hour: self.read_hour(station_id, *hour, channels), hours))
+        else:
+            results = [self.read_hour(station_id, *hour, channels) for hour in hours]
+
+        if sample_rate is None:
+            sample_rate = next((result[0] for result in results if result), 0)
+        data = np.full((len(channels), max(end_second - start_second, 0) * sample_rate), np.nan, dtype=np.float32)
+        for (hour_start, first, last), result in zip(hours, results):
+            if not result:
+                continue
+            if result[0] != sample_rate:
+                self.logger.warning('Skipping hour %s of station %s: sample rate %d, expected %d',
+                                    datetime.utcfromtimestamp(hour_start), station_id, result[0], sample_rate)
+                continue
+            offset = (hour_start + first - start_second) * sample_rate
+            data[:, offset:offset + (last - first) * sample_rate] = result[1].reshape(len(channels), -1)
+        times = np.datetime64(start_second, 's') + \
+            (np.arange(data.shape[1]) * 1000000 // max(sample_rate, 1)).astype('timedelta64[us]')
+        return Waveform(times, data, sample_rate)
+
+    def read_hour(self, station_id, hour_start: int, first: int, last: int, channels):
+        """Returns (sample rate, (channels, last - first, rate) float32) for seconds ``first`` to ``last`` of an hour,
+        or None if there is no such hour document."""
+        accel_id = '%s:%s' % (datetime.utcfromtimestamp(hour_start).strftime('%Y%m%d%H'), station_id)
+        if hour_start + 3600 + self.immutable_after > time.time():
+            doc = self.fetch(accel_id, first, last - first, channels)
+            if not doc:
+                return None
+            return doc['r'], np.stack([decode_seconds(doc.get(channel) or [None] * (last - first), doc['r'])
+                                       for channel in channels])
+
+        with self.lock:
+            if (accel_id,) in self.blocks:
+                self.hits += 1
+                return None
+        first_block, last_block = first // self.BLOCK, -(-last // self.BLOCK)
+        blocks = {}
+        missing = []
+        with self.lock:
+            for channel in channels:
+                for block in range(first_block, last_block):
+                    key = (accel_id, channel, block)
+                    if key in self.blocks:
+                        self.blocks.move_to_end(key)
+                        blocks[key] = self.blocks[key]
+                        self.hits += 1
+                    else:
+                        missing.append(key)
+                        self.misses += 1
+        if missing:
+            # One query for the span of missing minutes, of the channels missing any
+            fetch_first = min(key[2] for key in missing) * self.BLOCK
+            fetch_last = (max(key[2] for key in missing) + 1) * self.BLOCK
+            fetch_channels = sorted({key[1] for key in missing}, key=channels.index)
+            doc = self.fetch(accel_id, fetch_first, fetch_last - fetch_first, fetch_channels)
+            if not doc:
+                with self.lock:
+                    self.store((accel_id,), None)
+                return None
+            fetched = {}
+            for channel in fetch_channels:
+                rows = decode_seconds(doc.get(channel) or [None] * (fetch_last - fetch_first), doc['r'])
+                for block in range(fetch_first // self.BLOCK, fetch_last // self.BLOCK):
+                    offset = block * self.BLOCK - fetch_first
+                    fetched[(accel_id, channel, block)] = (doc['r'], rows[offset:offset + self.BLOCK])
+            blocks.update(fetched)
+            with self.lock:
+                for key, value in fetched.items():
+                    self.store(key, value)
+
+        sample_rate = blocks[(accel_id, channels[0], first_block)][0]
+        hour = np.stack([np.concatenate([blocks[(accel_id, channel, block)][1]
+                                         for block in range(first_block, last_block)]) for channel in channels])
+        offset = first - first_block * self.BLOCK
+        return sample_rate, hour[:, offset:offset + last - first]
+
+    def fetch(self, accel_id: str, first: int, count: int, channels) -> dict:
+        """Finds an accel hour document with only ``count`` seconds from ``first`` of ``channels``."""
+        projection = {'r': 1, 'v': 1}
+        projection.update((channel, {'$slice': [first, count]}) for channel in channels)
+        return self.db.accel.find_one({'_id': accel_id}, projection=projection)
+
+    def store(self, key: tuple, value):
+        """Adds to the LRU cache, the caller holds the lock."""
+        self.blocks[key] = value
+        self.blocks.move_to_end(key)
+        while len(self.blocks) > self.max_minutes:
+            self.blocks.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'cached': len(self.blocks),
+        }
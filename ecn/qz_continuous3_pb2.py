@@ -0,0 +1,321 @@
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: qz_continuous3.proto
+
+import sys
+_b=sys.version_info[0]<3 and (lambda x:x) or (lambda x:x.encode('latin1'))
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf import descriptor_pb2
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor.FileDescriptor(
+  name='qz_continuous3.proto',
+  package='id.ac.itb.pptik.quakezone',
+  syntax='proto3',
+  serialized_pb=_b('\n\x14qz_continuous3.proto\x12\x19id.ac.itb.pptik.quakezone\"\x91\x07\n\x10\x43ontinuousStream\x12\x12\n\nstation_id\x18\x01 \x01(\t\x12\x11\n\tsignature\x18\x02 \x01(\x0c\x12\x12\n\nstart_time\x18\x03 \x01(\x04\x12\x10\n\x08\x64uration\x18\x04 \x01(\r\x12\x1e\n\x16location_sampling_rate\x18\x05 \x01(\r\x12\x1c\n\x14motion_sampling_rate\x18\x06 \x01(\r\x12\x10\n\x08latitude\x18\x07 \x03(\x02\x12\x11\n\tlongitude\x18\x08 \x03(\x02\x12\x10\n\x08\x61ltitude\x18\t \x03(\x02\x12\x11\n\tgravity_x\x18\n \x03(\x02\x12\x11\n\tgravity_y\x18\x0b \x03(\x02\x12\x11\n\tgravity_z\x18\x0c \x03(\x02\x12\x15\n\rgeomagnetic_x\x18\r \x03(\x02\x12\x15\n\rgeomagnetic_y\x18\x0e \x03(\x02\x12\x15\n\rgeomagnetic_z\x18\x0f \x03(\x02\x12\x13\n\x0braw_accel_x\x18\x10 \x03(\x02\x12\x13\n\x0braw_accel_y\x18\x11 \x03(\x02\x12\x13\n\x0braw_accel_z\x18\x12 \x03(\x02\x12\x16\n\x0elinear_accel_x\x18\x13 \x03(\x02\x12\x16\n\x0elinear_accel_y\x18\x14 \x03(\x02\x12\x16\n\x0elinear_accel_z\x18\x15 \x03(\x02\x12\x17\n\x0frotation_rate_x\x18\x16 \x03(\x02\x12\x17\n\x0frotation_rate_y\x18\x17 \x03(\x02\x12\x17\n\x0frotation_rate_z\x18\x18 \x03(\x02\x12\x1c\n\x14inclination_matrix_5\x18\x19 \x03(\x02\x12\x1c\n\x14inclination_matrix_6\x18\x1a \x03(\x02\x12\x1c\n\x14inclination_matrix_9\x18\x1b \x03(\x02\x12\x1d\n\x15inclination_matrix_10\x18\x1c \x03(\x02\x12\x19\n\x11rotation_matrix_0\x18\x1d \x03(\x02\x12\x19\n\x11rotation_matrix_1\x18\x1e \x03(\x02\x12\x19\n\x11rotation_matrix_2\x18\x1f \x03(\x02\x12\x19\n\x11rotation_matrix_4\x18  \x03(\x02\x12\x19\n\x11rotation_matrix_5\x18! \x03(\x02\x12\x19\n\x11rotation_matrix_6\x18\" \x03(\x02\x12\x19\n\x11rotation_matrix_8\x18# \x03(\x02\x12\x19\n\x11rotation_matrix_9\x18$ \x03(\x02\x12\x1a\n\x12rotation_matrix_10\x18% \x03(\x02\x62\x06proto3')
+)
+
+
+
+
+_CONTINUOUSSTREAM = _descriptor.Descriptor(
+  name='ContinuousStream',
+  full_name='id.ac.itb.pptik.quakezone.ContinuousStream',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='station_id', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.station_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='signature', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.signature', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='start_time', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.start_time', index=2,
+      number=3, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='duration', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.duration', index=3,
+      number=4, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='location_sampling_rate', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.location_sampling_rate', index=4,
+      number=5, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='motion_sampling_rate', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.motion_sampling_rate', index=5,
+      number=6, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='latitude', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.latitude', index=6,
+      number=7, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='longitude', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.longitude', index=7,
+      number=8, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='altitude', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.altitude', index=8,
+      number=9, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='gravity_x', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.gravity_x', index=9,
+      number=10, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='gravity_y', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.gravity_y', index=10,
+      number=11, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='gravity_z', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.gravity_z', index=11,
+      number=12, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='geomagnetic_x', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.geomagnetic_x', index=12,
+      number=13, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='geomagnetic_y', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.geomagnetic_y', index=13,
+      number=14, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='geomagnetic_z', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.geomagnetic_z', index=14,
+      number=15, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='raw_accel_x', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.raw_accel_x', index=15,
+      number=16, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='raw_accel_y', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.raw_accel_y', index=16,
+      number=17, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='raw_accel_z', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.raw_accel_z', index=17,
+      number=18, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='linear_accel_x', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.linear_accel_x', index=18,
+      number=19, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='linear_accel_y', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.linear_accel_y', index=19,
+      number=20, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='linear_accel_z', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.linear_accel_z', index=20,
+      number=21, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_rate_x', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_rate_x', index=21,
+      number=22, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_rate_y', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_rate_y', index=22,
+      number=23, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_rate_z', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_rate_z', index=23,
+      number=24, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='inclination_matrix_5', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.inclination_matrix_5', index=24,
+      number=25, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='inclination_matrix_6', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.inclination_matrix_6', index=25,
+      number=26, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='inclination_matrix_9', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.inclination_matrix_9', index=26,
+      number=27, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='inclination_matrix_10', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.inclination_matrix_10', index=27,
+      number=28, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_0', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_0', index=28,
+      number=29, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_1', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_1', index=29,
+      number=30, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_2', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_2', index=30,
+      number=31, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_4', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_4', index=31,
+      number=32, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_5', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_5', index=32,
+      number=33, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_6', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_6', index=33,
+      number=34, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_8', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_8', index=34,
+      number=35, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_9', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_9', index=35,
+      number=36, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='rotation_matrix_10', full_name='id.ac.itb.pptik.quakezone.ContinuousStream.rotation_matrix_10', index=36,
+      number=37, type=2, cpp_type=6, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=52,
+  serialized_end=965,
+)
+
+DESCRIPTOR.message_types_by_name['ContinuousStream'] = _CONTINUOUSSTREAM
+_sym_db.RegisterFileDescriptor(DESCRIPTOR)
+
+ContinuousStream = _reflection.GeneratedProtocolMessageType('ContinuousStream', (_message.Message,), dict(
+  DESCRIPTOR = _CONTINUOUSSTREAM,
+  __module__ = 'qz_continuous3_pb2'
+  # @@protoc_insertion_point(class_scope:id.ac.itb.pptik.quakezone.ContinuousStream)
+  ))
+_sym_db.RegisterMessage(ContinuousStream)
+
+
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,238 @@
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: qz_triggered1.proto
+
+import sys
+_b=sys.version_info[0]<3 and (lambda x:x) or (lambda x:x.encode('latin1'))
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf import descriptor_pb2
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor.FileDescriptor(
+  name='qz_triggered1.proto',
+  package='id.ac.itb.pptik.quakezone',
+  syntax='proto3',
+  serialized_pb=_b('\n\x13qz_triggered1.proto\x12\x19id.ac.itb.pptik.quakezone\"\xdd\x04\n\x0cTriggerEvent\x12\x12\n\nstation_id\x18\x01 \x01(\t\x12\x11\n\tsignature\x18\x02 \x01(\x0c\x12\x14\n\x0ctrigger_time\x18\x03 \x01(\x04\x12\x10\n\x08latitude\x18\x04 \x01(\x02\x12\x11\n\tlongitude\x18\x05 \x01(\x02\x12\x10\n\x08\x61ltitude\x18\x06 \x01(\x02\x12\x16\n\x0epeak_lin_accel\x18\x07 \x01(\x02\x12\x15\n\rpeak_rot_rate\x18\x08 \x01(\x02\x12H\n\x0bmotionLabel\x18\t \x01(\x0e\x32\x33.id.ac.itb.pptik.quakezone.TriggerEvent.MotionLabel\x12\x46\n\nquakeLabel\x18\n \x01(\x0e\x32\x32.id.ac.itb.pptik.quakezone.TriggerEvent.QuakeLabel\x12L\n\rnonquakeLabel\x18\x0b \x01(\x0e\x32\x35.id.ac.itb.pptik.quakezone.TriggerEvent.NonquakeLabel\"$\n\x0bMotionLabel\x12\t\n\x05NOISE\x10\x00\x12\n\n\x06MOTION\x10\x01\"%\n\nQuakeLabel\x12\x0c\n\x08NONQUAKE\x10\x00\x12\t\n\x05QUAKE\x10\x01\"}\n\rNonquakeLabel\x12\x0b\n\x07UNKNOWN\x10\x00\x12\r\n\tFOOTSTEPS\x10\x01\x12\x08\n\x04\x44ROP\x10\x02\x12\x0b\n\x07ON_HAND\x10\x03\x12\x0b\n\x07WALKING\x10\x04\x12\x0b\n\x07RUNNING\x10\x05\x12\x0b\n\x07JUMPING\x10\x06\x12\x12\n\x0eMOVING_VEHICLE\x10\x07\x62\x06proto3')
+)
+
+
+
+_TRIGGEREVENT_MOTIONLABEL = _descriptor.EnumDescriptor(
+  name='MotionLabel',
+  full_name='id.ac.itb.pptik.quakezone.TriggerEvent.MotionLabel',
+  filename=None,
+  file=DESCRIPTOR,
+  values=[
+    _descriptor.EnumValueDescriptor(
+      name='NOISE', index=0, number=0,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='MOTION', index=1, number=1,
+      options=None,
+      type=None),
+  ],
+  containing_type=None,
+  options=None,
+  serialized_start=454,
+  serialized_end=490,
+)
+_sym_db.RegisterEnumDescriptor(_TRIGGEREVENT_MOTIONLABEL)
+
+_TRIGGEREVENT_QUAKELABEL = _descriptor.EnumDescriptor(
+  name='QuakeLabel',
+  full_name='id.ac.itb.pptik.quakezone.TriggerEvent.QuakeLabel',
+  filename=None,
+  file=DESCRIPTOR,
+  values=[
+    _descriptor.EnumValueDescriptor(
+      name='NONQUAKE', index=0, number=0,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='QUAKE', index=1, number=1,
+      options=None,
+      type=None),
+  ],
+  containing_type=None,
+  options=None,
+  serialized_start=492,
+  serialized_end=529,
+)
+_sym_db.RegisterEnumDescriptor(_TRIGGEREVENT_QUAKELABEL)
+
+_TRIGGEREVENT_NONQUAKELABEL = _descriptor.EnumDescriptor(
+  name='NonquakeLabel',
+  full_name='id.ac.itb.pptik.quakezone.TriggerEvent.NonquakeLabel',
+  filename=None,
+  file=DESCRIPTOR,
+  values=[
+    _descriptor.EnumValueDescriptor(
+      name='UNKNOWN', index=0, number=0,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='FOOTSTEPS', index=1, number=1,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='DROP', index=2, number=2,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='ON_HAND', index=3, number=3,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='WALKING', index=4, number=4,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='RUNNING', index=5, number=5,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='JUMPING', index=6, number=6,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='MOVING_VEHICLE', index=7, number=7,
+      options=None,
+      type=None),
+  ],
+  containing_type=None,
+  options=None,
+  serialized_start=531,
+  serialized_end=656,
+)
+_sym_db.RegisterEnumDescriptor(_TRIGGEREVENT_NONQUAKELABEL)
+
+
+_TRIGGEREVENT = _descriptor.Descriptor(
+  name='TriggerEvent',
+  full_name='id.ac.itb.pptik.quakezone.TriggerEvent',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='station_id', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.station_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='signature', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.signature', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='trigger_time', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.trigger_time', index=2,
+      number=3, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='latitude', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.latitude', index=3,
+      number=4, type=2, cpp_type=6, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='longitude', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.longitude', index=4,
+      number=5, type=2, cpp_type=6, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='altitude', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.altitude', index=5,
+      number=6, type=2, cpp_type=6, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='peak_lin_accel', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.peak_lin_accel', index=6,
+      number=7, type=2, cpp_type=6, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='peak_rot_rate', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.peak_rot_rate', index=7,
+      number=8, type=2, cpp_type=6, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='motionLabel', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.motionLabel', index=8,
+      number=9, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='quakeLabel', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.quakeLabel', index=9,
+      number=10, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='nonquakeLabel', full_name='id.ac.itb.pptik.quakezone.TriggerEvent.nonquakeLabel', index=10,
+      number=11, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+    _TRIGGEREVENT_MOTIONLABEL,
+    _TRIGGEREVENT_QUAKELABEL,
+    _TRIGGEREVENT_NONQUAKELABEL,
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=51,
+  serialized_end=656,
+)
+
+_TRIGGEREVENT.fields_by_name['motionLabel'].enum_type = _TRIGGEREVENT_MOTIONLABEL
+_TRIGGEREVENT.fields_by_name['quakeLabel'].enum_type = _TRIGGEREVENT_QUAKELABEL
+_TRIGGEREVENT.fields_by_name['nonquakeLabel'].enum_type = _TRIGGEREVENT_NONQUAKELABEL
+_TRIGGEREVENT_MOTIONLABEL.containing_type = _TRIGGEREVENT
+_TRIGGEREVENT_QUAKELABEL.containing_type = _TRIGGEREVENT
+_TRIGGEREVENT_NONQUAKELABEL.containing_type = _TRIGGEREVENT
+DESCRIPTOR.message_types_by_name['TriggerEvent'] = _TRIGGEREVENT
+_sym_db.RegisterFileDescriptor(DESCRIPTOR)
+
+TriggerEvent = _reflection.GeneratedProtocolMessageType('TriggerEvent', (_message.Message,), dict(
+  DESCRIPTOR = _TRIGGEREVENT,
+  __module__ = 'qz_triggered1_pb2'
+  # @@protoc_insertion_point(class_scope:id.ac.itb.pptik.quakezone.TriggerEvent)
+  ))
+_sym_db.RegisterMessage(TriggerEvent)
+
+
+# @@protoc_insertion_point(module_scope)
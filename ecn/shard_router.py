@@ -0,0 +1,100 @@
+import logging
+
+from pika.channel import Channel
+
+from ecn.amqp import AmqpProcessor
+from ecn.continuous import ContinuousHandler
+from ecn.mobile import MobileHandler
+from ecn.sharding import shard_of, shard_queue
+from ecn.stationary_v1 import StationaryV1Handler
+from ecn.trigger import TriggerHandler
+
+
+class ShardRouter(AmqpProcessor):
+    """Moves messages from the main queues to per-shard queues, partitioned by station.
+
+    Every station always lands in the same shard queue, and each shard queue has one
+    exclusive consumer, so each accel hour document is written by exactly one worker.
+    Routing only peeks the station key, it never decodes or touches Mongo. The original
+    delivery is acked once the broker confirms the republished message.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, shards: int, prefetch_count: int = 1000, continuous: bool = False, triggers: bool = False):
+        """Routes the v1 and mobile queues, with ``continuous`` the continuous queue and with ``triggers`` the
+        trigger queue (shared with other consumers), which must exist."""
+        super().__init__(prefetch_count=prefetch_count)
+        self.shards = shards
+        self.continuous = continuous
+        self.triggers = triggers
+        self.publish_seq = 0
+        self.published = {}
+        '''Publish sequence number -> original delivery tag, until confirmed.'''
+
+    def on_channel_open(self, new_channel: Channel):
+        """Called when our channel has opened"""
+        self.channel = new_channel
+        self.logger.info('Channel opened: %s', self.channel)
+        self.channel.add_on_close_callback(self.on_channel_closed)
+        self.publish_seq = 0
+        self.published = {}
+        self.channel.confirm_delivery(self.on_confirm)
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        queues = [(self.QUEUE_STATIONARY_V1, self.consume_stationary_v1, True),
+                  (self.QUEUE_MOBILE_STREAM, self.consume_mobile_stream, True)]
+        if self.continuous:
+            queues.append((self.QUEUE_CONTINUOUS, self.consume_continuous, True))
+        if self.triggers:
+            queues.append((self.QUEUE_TRIGGER, self.consume_trigger, False))
+        for queue, on_message_callback, exclusive in queues:
+            for shard in range(self.shards):
+                self.channel.queue_declare(queue=shard_queue(queue, shard), durable=True)
+            self.consume(queue, on_message_callback, exclusive)
+
+    def consume_stationary_v1(self, channel: Channel, method, header, body):
+        """Called when we receive a message from RabbitMQ"""
+        self.route(channel, method.delivery_tag, header, body, self.QUEUE_STATIONARY_V1,
+                   StationaryV1Handler.partition_key(body))
+
+    def consume_mobile_stream(self, channel: Channel, method, header, body):
+        """Called when we receive a message from RabbitMQ"""
+        self.route(channel, method.delivery_tag, header, body, self.QUEUE_MOBILE_STREAM,
+                   MobileHandler.partition_key(body))
+
+    def consume_continuous(self, channel: Channel, method, header, body):
+        """Called when we receive a message from RabbitMQ"""
+        self.route(channel, method.delivery_tag, header, body, self.QUEUE_CONTINUOUS,
+                   ContinuousHandler.partition_key(body))
+
+    def consume_trigger(self, channel: Channel, method, header, body):
+        """Called when we receive a message from RabbitMQ"""
+        self.route(channel, method.delivery_tag, header, body, self.QUEUE_TRIGGER,
+                   TriggerHandler.partition_key(body))
+
+    def route(self, channel: Channel, delivery_tag: int, header, body: bytes, queue: str, key: bytes):
+        channel.basic_publish(exchange='', routing_key=shard_queue(queue, shard_of(key, self.shards)),
+                              body=body, properties=header)
+        self.publish_seq += 1
+        self.published[self.publish_seq] = delivery_tag
+
+    def on_confirm(self, frame):
+        """Called when the broker confirms (or rejects) republished messages"""
+        method = frame.method
+        if method.multiple:
+            seqs = [seq for seq in self.published if seq <= method.delivery_tag]
+        else:
+            seqs = [method.delivery_tag]
+        delivery_tags = [self.published.pop(seq) for seq in seqs if seq in self.published]
+        if not delivery_tags or not self.channel.is_open:
+            return
+        if method.NAME == 'Basic.Ack':
+            # Publishes happen in delivery order, so unless an earlier one is still unconfirmed,
+            # a single multiple ack covers exactly the confirmed deliveries
+            if not self.published or next(iter(self.published.values())) > max(delivery_tags):
+                self.channel.basic_ack(max(delivery_tags), multiple=True)
+            else:
+                for delivery_tag in delivery_tags:
+                    self.channel.basic_ack(delivery_tag)
+        else:
+            for delivery_tag in delivery_tags:
+                self.channel.basic_nack(delivery_tag, requeue=True)
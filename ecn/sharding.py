@@ -0,0 +1,13 @@
+import zlib
+
+
+def shard_of(key: bytes, shards: int) -> int:
+    """Returns the shard owning partition ``key`` (a clientID or encoded station_id).
+
+    Uses CRC32 rather than ``hash()``, which is randomized per process."""
+    return zlib.crc32(key) % shards
+
+
+def shard_queue(queue: str, shard: int) -> str:
+    """Name of the queue holding ``queue``'s messages for ``shard``."""
+    return '%s.shard%d' % (queue, shard)
@@ -0,0 +1,276 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import pymongo
+
+from ecn.bulk_writer import AccelBulkWriter
+
+RECORD_HEADER = struct.Struct('<IdBI')
+'''CRC32 of the rest of the record, received_at (seconds since UTC epoch), key length, body length.'''
+
+
+class SpillLog:
+    """Append-only local log of raw messages, in memory-mapped segment files of ``segment_size`` bytes.
+
+    Each record is a header (see ``RECORD_HEADER``), a key naming the handler and the message
+    body. Appending is a copy into the mapped segment, no system call. When a segment is full, or
+    ``seal()`` is called, it is flushed, truncated to its records and closed, and only then seen
+    by ``segments()``. Segments left by a crashed process are read up to their last complete
+    record. ``append()`` refuses records once the log holds ``max_bytes``.
+    """
+    logger = logging.getLogger(__name__)
+    SUFFIX = '.spill'
+
+    def __init__(self, directory: str, segment_size: int = 64 << 20, max_bytes: int = 4 << 30):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.active_path = None
+        self.active_file = None
+        self.active_map: mmap.mmap = None
+        self.position = 0
+        self.appended = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = self.segments()
+        self.size = sum(os.path.getsize(path) for path in existing)
+        self.next_sequence = int(os.path.basename(existing[-1])[:-len(self.SUFFIX)]) + 1 if existing else 0
+        if existing:
+            self.logger.warning('Found %d spill segments (%d bytes) in %s', len(existing), self.size, directory)
+
+    def append(self, key: str, received_at: float, body: bytes) -> bool:
+        """Appends a message, returns False if the log is full."""
+        key = key.encode()
+        rest = RECORD_HEADER.size + len(key) + len(body)
+        with self.lock:
+            if self.size + rest > self.max_bytes:
+                return False
+            if self.active_map is not None and self.position + rest > len(self.active_map):
+                self.__seal()
+            if self.active_map is None:
+                self.__open(max(self.segment_size, rest))
+            header_end = self.position + RECORD_HEADER.size
+            record_end = header_end + len(key) + len(body)
+            self.active_map[header_end:header_end + len(key)] = key
+            self.active_map[header_end + len(key):record_end] = body
+            # Header last, so a torn record has no valid CRC
+            crc = zlib.crc32(struct.pack('<dBI', received_at, len(key), len(body)) + key + body)
+            self.active_map[self.position:header_end] = RECORD_HEADER.pack(crc, received_at, len(key), len(body))
+            self.position = record_end
+            self.size += rest
+            self.appended += 1
+            return True
+
+    def __open(self, size: int):
+        self.active_path = os.path.join(self.directory, '%016d%s' % (self.next_sequence, self.SUFFIX))
+        self.next_sequence += 1
+        self.active_file = open(self.active_path, 'w+b')
+        self.active_file.truncate(size)
+        self.active_map = mmap.mmap(self.active_file.fileno(), size)
+        self.position = 0
+
+    def seal(self):
+        """Closes the active segment, making it available to ``segments()``."""
+        with self.lock:
+            if self.active_map is not None:
+                self.__seal()
+
+    def __seal(self):
+        self.active_map.flush()
+        self.active_map.close()
+        self.active_file.truncate(self.position)
+        self.active_file.close()
+        self.logger.info('Sealed spill segment %s (%d bytes)', self.active_path, self.position)
+        self.active_path, self.active_file, self.active_map = None, None, None
+
+    def segments(self) -> list:
+        """Returns the paths of sealed segments, oldest first."""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(self.SUFFIX))
+        paths = [os.path.join(self.directory, name) for name in names]
+        return [path for path in paths if path != self.active_path]
+
+    def read(self, path: str, offset: int = 0):
+        """Yields (end offset, key, received_at, body) of the records of a sealed segment from ``offset``."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        while offset + RECORD_HEADER.size <= len(data):
+            crc, received_at, key_length, body_length = RECORD_HEADER.unpack_from(data, offset)
+            key_start = offset + RECORD_HEADER.size
+            end = key_start + key_length + body_length
+            if not crc and not key_length and not body_length:
+                return # Unused rest of a segment left by a crashed process
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                self.logger.warning('Stopping at torn record %s:%d', path, offset)
+                return
+            yield end, data[key_start:key_start + key_length].decode(), received_at, data[key_start + key_length:end]
+            offset = end
+
+    def remove(self, path: str):
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self.lock:
+            self.size -= size
+
+    def stats(self) -> dict:
+        return {
+            'appended': self.appended,
+            'bytes': self.size,
+        }
+
+
+class SpillGate:
+    """Decides when messages go to the spill log instead of the handlers.
+
+    Spilling starts when a bulk flush has been running for more than ``max_latency`` seconds, took
+    longer than that, or failed. It stops once ``probe()`` finds MongoDB answering a ping within
+    ``max_latency`` seconds; flushes which started before that no longer count."""
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, db: pymongo.database.Database, writer: AccelBulkWriter, max_latency: float = 2.0):
+        self.db: pymongo.database.Database = db
+        self.writer: AccelBulkWriter = writer
+        self.max_latency = max_latency
+        self.spilling = False
+        self.resumed_at = time.monotonic()
+        self.spill_count = 0
+
+    def check(self) -> bool:
+        """Returns True if messages should be spilled. Cheap, called for every message."""
+        if self.spilling:
+            return True
+        writer = self.writer
+        flushing_since = writer.flushing_since
+        if flushing_since is not None and time.monotonic() - flushing_since > self.max_latency:
+            reason = 'flush running for %.1f s' % (time.monotonic() - flushing_since)
+        elif writer.last_flush_started is not None and writer.last_flush_started >= self.resumed_at and \
+                (writer.last_flush_failed or writer.last_flush_latency > self.max_latency):
+            reason = 'last flush failed' if writer.last_flush_failed else \
+                'last flush took %.1f s' % writer.last_flush_latency
+        else:
+            return False
+        self.logger.warning('***** Spilling messages to local log: %s', reason)
+        self.spilling = True
+        self.spill_count += 1
+        return True
+
+    def probe(self) -> bool:
+        """Pings MongoDB while spilling, returns True once it is healthy again."""
+        started = time.monotonic()
+        try:
+            self.db.command('ping')
+        except Exception as e:
+            self.logger.debug('MongoDB still down: %s', e)
+            return False
+        latency = time.monotonic() - started
+        if latency > self.max_latency:
+            self.logger.debug('MongoDB still slow: %.1f s', latency)
+            return False
+        self.logger.warning('***** MongoDB is back (ping %.1f ms), no longer spilling', latency * 1000)
+        self.resumed_at = time.monotonic()
+        self.spilling = False
+        return True
+
+
+class SpillReplayer:
+    """Background thread which drains the spill log back through the handlers once MongoDB recovers.
+
+    ``replay(key, body, received_at, done)`` must run the handler for ``key`` as for a live message
+    and call ``done()`` afterwards; it returns False if it cannot right now. Records are replayed in
+    batches of ``batch_size`` at up to ``max_rate`` messages per second, and the replay position only
+    moves past a batch once the bulk writer has flushed it, so a relapse replays the batch again
+    (harmless, writes are ``$set`` of the same seconds). Fully replayed segments are deleted; after a
+    restart, a partly replayed segment is replayed from its start.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, log: SpillLog, gate: SpillGate, replay, max_rate: float = 500, batch_size: int = 200,
+                 probe_interval: float = 5.0):
+        self.log = log
+        self.gate = gate
+        self.replay = replay
+        self.max_rate = max_rate
+        self.batch_size = batch_size
+        self.probe_interval = probe_interval
+        self.condition = threading.Condition()
+        self.outstanding = 0
+        self.offsets = {}
+        '''Segment path -> offset replayed and flushed so far.'''
+        self.replayed = 0
+
+    def start(self):
+        threading.Thread(target=self.__run, name='ecn-spill-replayer', daemon=True).start()
+
+    def __run(self):
+        while True:
+            try:
+                if self.gate.spilling:
+                    time.sleep(self.probe_interval)
+                    if self.gate.probe():
+                        self.log.seal()
+                    continue
+                segments = self.log.segments()
+                if not segments:
+                    time.sleep(self.probe_interval)
+                    continue
+                self.replay_segment(segments[0])
+            except Exception as e:
+                self.logger.error('Spill replay failed', exc_info=e)
+                time.sleep(self.probe_interval)
+
+    def replay_segment(self, path: str):
+        """Replays one segment, deleting it when done. Returns early if spilling starts again."""
+        offset = self.offsets.get(path, 0)
+        self.logger.info('Replaying spill segment %s from %d', path, offset)
+        records = self.log.read(path, offset)
+        while True:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+            if not batch:
+                break
+            started = time.monotonic()
+            if not self.replay_batch(batch):
+                return
+            offset = self.offsets[path] = batch[-1][0]
+            self.replayed += len(batch)
+            # Rate limit, so replay never starves live messages
+            time.sleep(max(0.0, len(batch) / self.max_rate - (time.monotonic() - started)))
+        self.log.remove(path)
+        self.offsets.pop(path, None)
+        self.logger.info('Replayed spill segment %s up to %d', path, offset)
+
+    def replay_batch(self, batch: list) -> bool:
+        """Replays records and flushes their writes, returns False (to retry later) if that did not work out."""
+        if self.gate.spilling:
+            return False
+        for end, key, received_at, body in batch:
+            with self.condition:
+                self.outstanding += 1
+            if not self.replay(key, body, received_at, self.__done):
+                self.__done()
+                time.sleep(self.probe_interval)
+                return False
+        with self.condition:
+            while self.outstanding:
+                self.condition.wait()
+        # Also completes live deliveries written meanwhile, which AmqpProcessor then acks on its ioloop
+        self.gate.writer.flush()
+        return not self.gate.check()
+
+    def __done(self):
+        with self.condition:
+            self.outstanding -= 1
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            'replayed': self.replayed,
+            'spills': self.gate.spill_count,
+        }
@@ -1,70 +1,185 @@
 import json
 import logging
-from datetime import datetime, timedelta
+import re
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
 import pymongo
 
-from ecn import StationKind, PPTIK_GRAVITY, StationState
+from ecn import StationKind, PPTIK_GRAVITY, StationState, AccelFormat
+from ecn.accel_format import encode_seconds
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.detection import StaLtaDetector
+from ecn.liveness import LivenessTracker
+from ecn.metrics import NULL_TIMER, IngestMetrics
+from ecn.summary import AccelSummarizer
+
+
+class Calibration:
+    """Maps device X/Y/Z accelerations of a v1 station to Z/N/E: ``zne = xyz[:, axes] * signs + offsets``.
+
+    Stored in the station document as e.g. ``'cal': {'axes': 'zxy', 'signs': [-1, 1, 1], 'offsets': [9.77876, 0, 0]}``,
+    where ``axes`` names the device axis used for Z, N and E respectively."""
+
+    def __init__(self, axes: str, signs: list, offsets: list):
+        self.axes = np.array(['xyz'.index(axis) for axis in axes])
+        self.signs = np.array(signs, dtype=np.float64)
+        self.offsets = np.array(offsets, dtype=np.float64)
+
+    @classmethod
+    def from_doc(cls, doc: dict):
+        return cls(doc['axes'], doc['signs'], doc['offsets'])
+
+    def apply(self, xyz: np.ndarray) -> np.ndarray:
+        """Transforms (samples, 3) X/Y/Z into (3, samples) Z/N/E. NaN stays NaN."""
+        return (xyz[:, self.axes] * self.signs + self.offsets).T
+
+
+DEFAULT_CALIBRATION = Calibration('zxy', [-1, 1, 1], [PPTIK_GRAVITY, 0, 0])
+LEGACY_CALIBRATIONS = {
+    'ECN-4': Calibration('yxz', [1, 1, 1], [6.598601, 0, 0]),
+}
+'''Calibrations of stations which have no ``cal`` in their station document yet.'''
+NAN_PATTERN = re.compile(rb'([:,\[]\s*)nan\b')
+'''An ECNv1 ``nan`` value, which ``json.loads()`` reads as ``NaN``.'''
+
+
+def decode_accelerations(body: bytes):
+    """Decodes an ECNv1 JSON message into its clientID and a (samples, 3) float64 array of X/Y/Z.
+
+    ECNv1 sends ``nan`` for missing samples, which is not valid JSON. Instead of rewriting it and
+    building a dict per sample, the accelerations array is reduced to comma-separated numbers in
+    one ``bytes.translate()`` and parsed by NumPy, which reads ``nan`` natively. Messages which do
+    not fit (other keys, or samples with different key orders) are decoded by ``json.loads()``.
+    Raises ValueError if the message is broken."""
+    client_id_match = StationaryV1Handler.CLIENT_ID_PATTERN.search(body)
+    if not client_id_match:
+        raise ValueError('No clientID')
+    xyz = parse_accelerations(body)
+    if xyz is None:
+        xyz = load_accelerations(body)
+    return client_id_match.group(1).decode(), xyz
+
+
+def parse_accelerations(body: bytes):
+    """Fast path of ``decode_accelerations()``, returns None if the message does not fit it."""
+    try:
+        start = body.index(b'[', body.index(b'"accelerations"'))
+        end = body.index(b']', start)
+    except ValueError:
+        return None
+    samples = body[start + 1:end]
+    sample_count = samples.count(b'{')
+    if not sample_count:
+        return np.empty((0, 3))
+
+    # Every sample must have exactly the keys of the first, in the same order
+    keys = re.findall(rb'"([^"]*)"', samples)
+    first_keys = keys[:3]
+    if sorted(first_keys) != [b'x', b'y', b'z'] or keys != first_keys * sample_count:
+        return None
+    numbers = samples.translate(None, b'{}"xyz: \t\r\n')
+    if b'null' in numbers:
+        numbers = numbers.replace(b'null', b'nan')
+    values = np.fromstring(numbers, sep=',')
+    if len(values) != 3 * sample_count:
+        return None
+    xyz = values.reshape(sample_count, 3)
+    if first_keys != [b'x', b'y', b'z']:
+        xyz = xyz[:, np.argsort([b'xyz'.index(key) for key in first_keys])]
+    return xyz
+
+
+def load_accelerations(body: bytes) -> np.ndarray:
+    """Slow path of ``decode_accelerations()``: any valid JSON (besides ``nan``), missing axes are NaN."""
+    msg = json.loads(NAN_PATTERN.sub(rb'\1NaN', body))
+    return np.array([[sample.get(axis) for axis in 'xyz'] for sample in msg['accelerations']],
+                    dtype=np.float64).reshape(-1, 3)
 
 
 class StationaryV1Handler:
     logger = logging.getLogger(__name__)
     SAMPLE_RATE = 40
+    CLIENT_ID_PATTERN = re.compile(rb'"clientID"\s*:\s*"([^"]*)"')
 
-    def __init__(self, db: pymongo.database.Database):
+    def __init__(self, db: pymongo.database.Database, writer: AccelBulkWriter = None,
+                 cache: MetadataCache = None, accel_format: int = AccelFormat.LIST,
+                 detector: StaLtaDetector = None, summarizer: AccelSummarizer = None,
+                 liveness: LivenessTracker = None, metrics: IngestMetrics = None):
         self.db: pymongo.database.Database = db
+        self.accel_format = accel_format
+        # Without a shared writer, flush every update right away
+        self.writer: AccelBulkWriter = writer or AccelBulkWriter(db, max_ops=1)
+        self.cache: MetadataCache = cache or MetadataCache()
+        self.detector: StaLtaDetector = detector
+        self.summarizer: AccelSummarizer = summarizer
+        self.liveness: LivenessTracker = liveness
+        self.metrics: IngestMetrics = metrics
+
+    @classmethod
+    def partition_key(cls, body: bytes) -> bytes:
+        """Returns the clientID without decoding the whole JSON, used to keep each station's messages in order."""
+        match = cls.CLIENT_ID_PATTERN.search(body)
+        return match.group(1) if match else b''
 
-    def receive(self, body: bytearray):
-        body = body.replace(b'nan,', b'null,') # Workaround for ECNv1 bug
-        # logger.debug('Decoding %s', body)
+    def receive(self, body: bytearray, received_at: float = None):
+        """``received_at`` (seconds since UTC epoch) is when a replayed message was originally received."""
+        timer = self.metrics.timer('stationary_v1') if self.metrics else NULL_TIMER
         try:
-            msg = json.loads(body)
+            client_id, xyz = decode_accelerations(bytes(body))
         except Exception as e:
             self.logger.error('Ignoring broken JSON: %s', str(body), exc_info = e)
+            if self.metrics:
+                self.metrics.handler_errors.inc(('stationary_v1', 'broken'))
             return
-        client_id = msg['clientID']
-        station_coll: pymongo.collection.Collection = self.db.station
-        station = station_coll.find_one({'k': StationKind.V1, 'i': client_id}, projection={'_id': 1})
+        station = self.cache.find_station((StationKind.V1, client_id), lambda: self.load_station(client_id))
         if not station:
             self.logger.error('Unknown v1 station: %s', client_id)
+            if self.metrics:
+                self.metrics.handler_errors.inc(('stationary_v1', 'unknown_station'))
             return
         station_id = station['_id']
-        # self.logger.debug('Station: %s', station_id)
-        accel_coll: pymongo.collection.Collection = self.db.accel
-        ts = datetime.utcnow() - timedelta(seconds=1)
+        timer.lap('decode')
+        received = datetime.utcnow() if received_at is None else datetime.utcfromtimestamp(received_at)
+        ts = received - timedelta(seconds=1)
         tstr = ts.strftime('%Y%m%d%H')
         accel_id = '%s:%s' % (tstr, station_id)
         second_of_hour = (60 * ts.minute) + ts.second
-        self.logger.debug('Accel ID: %s at %d (%d:%d)', accel_id, second_of_hour, ts.minute, ts.second)
-
-        existing_accel_doc = accel_coll.find_one({'_id': accel_id}, projection={'_id': 1})
-        if not existing_accel_doc:
-            # "Preallocate" arrays except innermost
-            accels = [None for sec in range(60 * 60)]
-            self.logger.debug('Inserting stationary_v1 accel %s sample_rate=%d', accel_id, self.SAMPLE_RATE)
-            accel_coll.insert_one({'_id': accel_id, 'r': self.SAMPLE_RATE, 'z': accels, 'n': accels, 'e': accels})
-
-        if client_id == 'ECN-4':
-            z_values = [(orig['y'] + 6.598601 if orig['y'] else None) for orig in msg['accelerations']]
-            n_values = [(orig['x'] if orig['x'] else None) for orig in msg['accelerations']]
-            e_values = [(orig['z'] if orig['z'] else None) for orig in msg['accelerations']]
+
+        # Update accel Z/N/E, a reading of exactly 0.0 is kept, only NaN is missing
+        zne = station['calibration'].apply(xyz)
+        z_value, n_value, e_value = encode_seconds(zne, self.accel_format)
+        # mark as 'A'lert while triggered, otherwise 'H'igh rate
+        state = StationState.HIGH_RATE
+        if self.detector and self.detector.update(station_id, zne, self.SAMPLE_RATE,
+                                                  ts.replace(microsecond=0, tzinfo=timezone.utc).timestamp()):
+            state = StationState.ALERT
+        if self.summarizer:
+            self.summarizer.summarize(accel_id, second_of_hour, zne[:, None, :])
+        timer.lap('transform')
+
+        self.cache.ensure_accel(self.db.accel, accel_id, self.SAMPLE_RATE, self.accel_format)
+        self.writer.set_accel(accel_id, {
+            'z.%d' % (second_of_hour): z_value,
+            'n.%d' % (second_of_hour): n_value,
+            'e.%d' % (second_of_hour): e_value,
+        })
+        if self.liveness:
+            self.liveness.seen(station_id, state, received)
+        else:
+            self.writer.set_station(station_id, {'s': state, 't': received})
+        timer.lap('write')
+        if self.metrics:
+            self.metrics.station_messages.inc(('stationary_v1', station_id))
+
+    def load_station(self, client_id: str):
+        """Finds the v1 station of ``client_id`` and its calibration, None if unknown."""
+        station = self.db.station.find_one({'k': StationKind.V1, 'i': client_id}, projection={'_id': 1, 'cal': 1})
+        if not station:
+            return None
+        if station.get('cal'):
+            calibration = Calibration.from_doc(station['cal'])
         else:
-            z_values = [(-orig['z'] + PPTIK_GRAVITY if orig['z'] else None) for orig in msg['accelerations']]
-            n_values = [(orig['x'] if orig['x'] else None) for orig in msg['accelerations']]
-            e_values = [(orig['y'] if orig['y'] else None) for orig in msg['accelerations']]
-        # Update accel Z/N/E
-        # logger.debug('%s a.%d.%d Z = %s', accel_id, ts.minute, ts.second, z_values)
-        accel_coll.update_one({'_id': accel_id}, {'$set': {
-            'z.%d' % (second_of_hour): z_values,
-            'n.%d' % (second_of_hour): n_values,
-            'e.%d' % (second_of_hour): e_values,
-        }})
-        # logger.debug('%s a.%d.%d Z = %s', accel_id, ts.minute, ts.second, z_values)
-        # accel_z_coll.update_one({'_id': accel_id}, {'$set': {'a.%d.%d' % (ts.minute, ts.second): z_values}})
-        # logger.debug('%s a.%d.%d NS = %s', accel_id, ts.minute, ts.second, n_values)
-        # accel_n_coll.update_one({'_id': accel_id}, {'$set': {'a.%d.%d' % (ts.minute, ts.second): n_values}})
-        # logger.debug('%s a.%d.%d EW = %s', accel_id, ts.minute, ts.second, e_values)
-        # accel_e_coll.update_one({'_id': accel_id}, {'$set': {'a.%d.%d' % (ts.minute, ts.second): e_values}})
-
-        # mark as 'H'igh rate
-        station_coll.update_one({'_id': station_id}, {'$set': {'s': StationState.HIGH_RATE, 't': datetime.utcnow()}})
\ No newline at end of file
+            calibration = LEGACY_CALIBRATIONS.get(client_id, DEFAULT_CALIBRATION)
+        return {'_id': station['_id'], 'calibration': calibration}
@@ -0,0 +1,131 @@
+import logging
+
+import numpy as np
+import pymongo
+from pymongo import ReplaceOne
+
+from ecn.accel_format import read_hour
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_seconds(rows: np.ndarray):
+    """Returns per-second (PGA, sum of squares, sample count) of a (3, seconds, rate) Z/N/E array.
+
+    Each second is demeaned per channel (removing gravity and offsets) and the amplitude is the
+    magnitude of the Z/N/E vector, in the unit of the samples. Samples with any NaN channel are
+    skipped, PGA and sum of squares are 0 for seconds without samples."""
+    finite = np.isfinite(rows).all(axis=0)
+    counts = finite.sum(axis=1)
+    values = np.where(finite, rows, 0)
+    means = values.sum(axis=2, keepdims=True) / np.maximum(counts, 1)[:, None]
+    squares = np.square(np.where(finite, values - means, 0)).sum(axis=0)
+    return np.sqrt(squares.max(axis=1, initial=0)), squares.sum(axis=1), counts
+
+
+def new_summary() -> dict:
+    """Fields of a new accel summary document, see README."""
+    return {'p': [None] * 3600, 'a': [None] * 3600, 'c': [None] * 3600,
+            'pm': [0] * 60, 'sm': [0] * 60, 'cm': [0] * 60, 'ph': 0}
+
+
+class AccelSummarizer:
+    """Writes per-second and per-minute amplitude summaries of incoming accelerations to ``db.accel_summary``.
+
+    Summary documents are keyed like accel hour documents, ``YYYYMMDDHH:<station ID>``. Per second
+    (3600-element arrays) ``p`` is PGA, ``a`` RMS and ``c`` sample count. Per minute (60-element
+    arrays) ``pm`` is PGA, ``sm`` the sum of squares and ``cm`` the sample count, so RMS is
+    ``sqrt(sm / cm)``. ``ph`` is the hour's PGA. Per-minute and hourly fields are updated with
+    ``$max``/``$inc`` through the bulk writer; a redelivered message counts twice in ``sm``/``cm``
+    until the hour is rebuilt with ``rebuild_summaries()``.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, db: pymongo.database.Database, writer: AccelBulkWriter = None, cache: MetadataCache = None):
+        self.db: pymongo.database.Database = db
+        self.writer: AccelBulkWriter = writer or AccelBulkWriter(db, max_ops=1)
+        self.cache: MetadataCache = cache or MetadataCache()
+
+    def summarize(self, accel_id: str, first_second_of_hour: int, rows: np.ndarray):
+        """Summarizes (3, seconds, rate) Z/N/E samples of accel hour ``accel_id``, starting at a second of the hour."""
+        pgas, squares, counts = summarize_seconds(rows)
+        seconds = np.flatnonzero(counts)
+        if not len(seconds):
+            return
+        self.cache.ensure_summary(self.db.accel_summary, accel_id, new_summary)
+
+        rms = np.sqrt(squares / np.maximum(counts, 1))
+        set_fields = {}
+        for second, pga, second_rms, count in zip((seconds + first_second_of_hour).tolist(), pgas[seconds].tolist(),
+                                                 rms[seconds].tolist(), counts[seconds].tolist()):
+            set_fields['p.%d' % second] = pga
+            set_fields['a.%d' % second] = second_rms
+            set_fields['c.%d' % second] = count
+        # Seconds of one message may span two minutes
+        minutes = (seconds + first_second_of_hour) // 60
+        max_fields = {'ph': float(pgas.max())}
+        inc_fields = {}
+        for minute in np.unique(minutes).tolist():
+            in_minute = seconds[minutes == minute]
+            max_fields['pm.%d' % minute] = float(pgas[in_minute].max())
+            inc_fields['sm.%d' % minute] = float(squares[in_minute].sum())
+            inc_fields['cm.%d' % minute] = int(counts[in_minute].sum())
+        self.writer.update_summary(accel_id, set_fields, max_fields, inc_fields)
+
+
+def summarize_hour(accel_doc: dict) -> dict:
+    """Returns the complete accel summary document of an accel hour document."""
+    sample_rate = accel_doc['r']
+    pgas, squares, counts = summarize_seconds(read_hour(accel_doc).reshape(3, 3600, sample_rate))
+    rms = np.sqrt(squares / np.maximum(counts, 1))
+    counts_list = counts.tolist()
+    summary = {
+        'pm': pgas.reshape(60, 60).max(axis=1).tolist(),
+        'sm': squares.reshape(60, 60).sum(axis=1).tolist(),
+        'cm': counts.reshape(60, 60).sum(axis=1).tolist(),
+        'ph': float(pgas.max()),
+    }
+    # Seconds without samples stay None, as in new_summary()
+    for field, values in (('p', pgas.tolist()), ('a', rms.tolist()), ('c', counts_list)):
+        summary[field] = [value if count else None for value, count in zip(values, counts_list)]
+    return summary
+
+
+def rebuild_summaries(db: pymongo.database.Database, start_hour: str, end_hour: str, batch_size: int = 100) -> int:
+    """Recomputes the accel summaries of all accel hour documents from ``start_hour`` up to (excluding) ``end_hour``,
+    both ``YYYYMMDDHH``. Summaries are replaced in unordered bulk writes of ``batch_size``. Returns the hour count."""
+    count = replace_summaries(db, db.accel.find({'_id': {'$gte': start_hour, '$lt': end_hour}}, batch_size=batch_size),
+                              batch_size)
+    logger.info('Rebuilt %d accel summaries from %s to %s', count, start_hour, end_hour)
+    return count
+
+
+def rebuild_accel_summaries(db: pymongo.database.Database, accel_ids, batch_size: int = 100) -> int:
+    """Recomputes the accel summaries of the accel hour documents ``accel_ids``, e.g. those a backfill wrote,
+    fetching ``batch_size`` at a time. Returns the hour count."""
+    accel_ids = sorted(accel_ids)
+    accel_docs = (accel_doc for offset in range(0, len(accel_ids), batch_size)
+                  for accel_doc in db.accel.find({'_id': {'$in': accel_ids[offset:offset + batch_size]}}))
+    count = replace_summaries(db, accel_docs, batch_size)
+    logger.info('Rebuilt %d accel summaries of %d hours', count, len(accel_ids))
+    return count
+
+
+def replace_summaries(db: pymongo.database.Database, accel_docs, batch_size: int) -> int:
+    """Replaces the summaries of ``accel_docs`` in unordered bulk writes of ``batch_size``."""
+    requests = []
+    count = 0
+    for accel_doc in accel_docs:
+        summary = summarize_hour(accel_doc)
+        requests.append(ReplaceOne({'_id': accel_doc['_id']}, summary, upsert=True))
+        if len(requests) >= batch_size:
+            db.accel_summary.bulk_write(requests, ordered=False)
+            count += len(requests)
+            requests = []
+            logger.info('Rebuilt %d accel summaries up to %s', count, accel_doc['_id'])
+    if requests:
+        db.accel_summary.bulk_write(requests, ordered=False)
+        count += len(requests)
+    return count
@@ -0,0 +1,65 @@
+import logging
+from datetime import datetime
+
+import pymongo
+
+from ecn import qz_triggered1_pb2
+from ecn.gridloc import GridLocator, Estimate
+
+
+class TriggerHandler:
+    """Locates earthquakes from TriggerEvent (qz_triggered1.proto) messages as they arrive.
+
+    Triggers labeled QUAKE within ``EVENT_WINDOW`` seconds of an event's first trigger belong
+    to that event, using the first trigger of each station as its P-wave arrival. From the
+    ``MIN_STATIONS``-th station on, every new arrival updates the event's estimate in
+    ``db.quake_estimate``, keyed by the event ID (first trigger time, ``%Y%m%d%H%M%S``).
+    """
+    logger = logging.getLogger(__name__)
+    EVENT_WINDOW = 120
+    MIN_STATIONS = 3
+
+    def __init__(self, db: pymongo.database.Database):
+        self.db: pymongo.database.Database = db
+        self.event_id = None
+        self.event_start = None
+        self.event_stations = set()
+        self.locator: GridLocator = None
+
+    @staticmethod
+    def partition_key(body: bytes) -> bytes:
+        """All triggers feed one locator, so they share one partition."""
+        return b''
+
+    def receive(self, body: bytearray):
+        msg: qz_triggered1_pb2.TriggerEvent = qz_triggered1_pb2.TriggerEvent()
+        msg.ParseFromString(body)
+        if msg.quakeLabel != qz_triggered1_pb2.TriggerEvent.QUAKE:
+            return
+        trigger_time = msg.trigger_time / 1000
+        if self.locator is None or abs(trigger_time - self.event_start) > self.EVENT_WINDOW:
+            self.event_id = datetime.utcfromtimestamp(trigger_time).strftime('%Y%m%d%H%M%S')
+            self.event_start = trigger_time
+            self.event_stations = set()
+            self.locator = GridLocator(msg.latitude, msg.longitude)
+            self.logger.info('New event %s triggered by %s', self.event_id, msg.station_id)
+        if msg.station_id in self.event_stations:
+            return
+        self.event_stations.add(msg.station_id)
+        self.locator.add_arrival(msg.latitude, msg.longitude, trigger_time)
+        if len(self.event_stations) >= self.MIN_STATIONS:
+            self.publish(self.locator.locate())
+
+    def publish(self, estimate: Estimate):
+        self.logger.info('Event %s from %d stations: epicenter %.3f, %.3f origin time %s (score %.3f)',
+                         self.event_id, len(self.event_stations), estimate.lat, estimate.lon,
+                         datetime.utcfromtimestamp(estimate.origin_time), estimate.score)
+        estimate_coll: pymongo.collection.Collection = self.db.quake_estimate
+        estimate_coll.update_one({'_id': self.event_id}, {'$set': {
+            'lat': estimate.lat,
+            'lon': estimate.lon,
+            't': datetime.utcfromtimestamp(estimate.origin_time),
+            'score': estimate.score,
+            'n': len(self.event_stations),
+            'u': datetime.utcnow(),
+        }}, upsert=True)
@@ -0,0 +1,48 @@
+import logging
+import queue
+import threading
+import zlib
+
+
+class OrderedWorkerPool:
+    """Bounded pool of worker threads which keeps tasks with the same key in order.
+
+    Each key (e.g. a station ID) is hashed to one of ``workers`` lanes, and each lane is
+    a single thread draining its own queue, so tasks for one station never run
+    concurrently or out of order while different stations are processed in parallel.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, workers: int, name: str = 'ecn-worker'):
+        self.lanes = [queue.Queue() for i in range(workers)]
+        self.in_flight = 0
+        self.completed = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.__run, args=(lane,), name='%s-%d' % (name, i), daemon=True)
+                        for i, lane in enumerate(self.lanes)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key: bytes, fn):
+        """Queues ``fn()`` on the lane of ``key``. Never blocks."""
+        with self.lock:
+            self.in_flight += 1
+        self.lanes[zlib.crc32(key) % len(self.lanes)].put(fn)
+
+    def __run(self, lane: queue.Queue):
+        while True:
+            fn = lane.get()
+            try:
+                fn()
+            except Exception as e:
+                self.logger.error('Worker task failed', exc_info=e)
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'lane_depths': [lane.qsize() for lane in self.lanes],
+        }
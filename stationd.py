@@ -1,12 +1,27 @@
 # ECN Station Daemon
-# Processes telemetry data for all stations: ECN Stationary v1, ECN Stationary v2, ECN Mobile v2
+# Processes telemetry data for all stations: ECN Stationary v1, ECN Stationary v2, ECN Mobile v2, QuakeZone continuous
 import logging
+import multiprocessing
 import os
+import queue
+import threading
+import time
 from pymongo import MongoClient
 from dotenv import load_dotenv
+from ecn import AccelFormat
 from ecn.amqp import AmqpProcessor
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.continuous import ContinuousHandler
+from ecn.detection import StaLtaDetector, TriggerPublisher
+from ecn.liveness import LivenessTracker
+from ecn.metrics import IngestMetrics, MongoListener
 from ecn.mobile import MobileHandler
+from ecn.shard_router import ShardRouter
+from ecn.spill import SpillGate, SpillLog, SpillReplayer
 from ecn.stationary_v1 import StationaryV1Handler
+from ecn.summary import AccelSummarizer
+from ecn.trigger import TriggerHandler
 
 load_dotenv(verbose=True)
 
@@ -15,17 +30,174 @@ AMQP_HOST = os.environ['AMQP_HOST']
 AMQP_VHOST = os.environ['AMQP_VHOST']
 AMQP_USER = os.environ['AMQP_USER']
 AMQP_PASSWORD = os.environ['AMQP_PASSWORD']
+AMQP_PREFETCH = int(os.getenv('AMQP_PREFETCH', '0'))
+'''Maximum unacked deliveries per channel, 0 is unlimited.'''
+WORKERS = int(os.getenv('WORKERS', '0'))
+'''Number of handler threads, 0 runs handlers on the AMQP ioloop.'''
+BULK_MAX_OPS = int(os.getenv('BULK_MAX_OPS', '500'))
+'''Flush accel/station writes once this many documents are pending.'''
+BULK_MAX_DELAY = float(os.getenv('BULK_MAX_DELAY', '0.25'))
+'''Flush accel/station writes at least every this many seconds.'''
 
-logging.basicConfig(level=logging.DEBUG)
+ACCEL_FORMAT = int(os.getenv('ACCEL_FORMAT', str(AccelFormat.LIST)))
+'''Encoding of new accel hour documents, see ecn.AccelFormat.'''
+SHARDS = int(os.getenv('SHARDS', '0'))
+'''Number of worker processes, each owning a partition of stations. 0 runs a single process.'''
+DETECT_STA = float(os.getenv('DETECT_STA', '1'))
+'''STA/LTA trigger detection short-term window, in seconds.'''
+DETECT_LTA = float(os.getenv('DETECT_LTA', '10'))
+'''STA/LTA trigger detection long-term window, in seconds.'''
+DETECT_ON_RATIO = float(os.getenv('DETECT_ON_RATIO', '4'))
+'''STA/LTA ratio which triggers a station, 0 disables trigger detection.'''
+DETECT_QUEUE = os.getenv('DETECT_QUEUE') or os.getenv('QUEUE_PREFIX', 'ecn_') + 'detection'
+'''Queue the detected triggers are published to (declared by the daemon), for downstream classifiers and locators.'''
+CONTINUOUS = os.getenv('CONTINUOUS', '0') == '1'
+'''Consume the QuakeZone continuous queue (ContinuousStream), which must exist on the broker.'''
+LOCATE = os.getenv('LOCATE', '0') == '1'
+'''Locate earthquakes from the TriggerEvents of the trigger queue, which must exist, sharing it with other consumers.'''
+SUMMARY = os.getenv('SUMMARY', '1') == '1'
+'''Write per-second and per-minute PGA/RMS to db.accel_summary.'''
+LOST_AFTER = float(os.getenv('LOST_AFTER', '60'))
+'''Seconds of silence after which a station is marked LOST, 0 writes station state on every message instead.'''
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', '60'))
+'''Seconds between batched writes of the last seen time of stations.'''
+SPILL_DIR = os.getenv('SPILL_DIR', '')
+'''Directory of the local spill log used while MongoDB is slow or down, empty disables spilling.'''
+SPILL_MAX_LATENCY = float(os.getenv('SPILL_MAX_LATENCY', '2'))
+'''Seconds a bulk write may take before messages are spilled.'''
+SPILL_REPLAY_RATE = float(os.getenv('SPILL_REPLAY_RATE', '500'))
+'''Spilled messages replayed per second once MongoDB is back.'''
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+'''Port of the Prometheus metrics endpoint (shard i uses METRICS_PORT + i), 0 disables metrics.'''
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+'''Address the metrics endpoint listens on.'''
+METRICS_SAMPLE = int(os.getenv('METRICS_SAMPLE', '16'))
+'''Time one in this many handler calls and deliveries, per thread.'''
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+'''DEBUG also logs per hour document and per flush details.'''
+STATS_INTERVAL = 60
+'''Seconds between stats reports from shard workers to the supervisor.'''
+
+logging.basicConfig(level=LOG_LEVEL)
 
 logger = logging.getLogger(__name__)
-logger.info('Connecting to MongoDB...')
-mongo = MongoClient(MONGODB_URI)
-db = mongo.ecn
-
-processor = AmqpProcessor()
-processor.stationary_v1_handler = StationaryV1Handler(db)
-processor.mobile_handler = MobileHandler(db)
-#processor.connect(AMQP_HOST, AMQP_VHOST, AMQP_USER, AMQP_PASSWORD)
-#processor.run()
-processor.connect_and_run_forever(AMQP_HOST, AMQP_VHOST, AMQP_USER, AMQP_PASSWORD)
+
+
+def run_worker(shard: int = None, stats_queue: multiprocessing.Queue = None):
+    """Consumes the main queues, or when ``shard`` is given, that shard's queues."""
+    metrics = IngestMetrics(METRICS_SAMPLE) if METRICS_PORT else None
+    logger.info('Connecting to MongoDB...')
+    mongo = MongoClient(MONGODB_URI, event_listeners=[MongoListener(metrics)] if metrics else [])
+    db = mongo.ecn
+
+    writer = AccelBulkWriter(db, max_ops=BULK_MAX_OPS, max_delay=BULK_MAX_DELAY)
+    cache = MetadataCache()
+    processor = AmqpProcessor(prefetch_count=AMQP_PREFETCH, workers=WORKERS)
+    processor.bulk_writer = writer
+    processor.metrics = metrics
+    detector = None
+    if DETECT_ON_RATIO > 0:
+        detector = StaLtaDetector(DETECT_STA, DETECT_LTA, DETECT_ON_RATIO,
+                                  on_trigger=TriggerPublisher(db, cache, processor.publish, DETECT_QUEUE))
+        processor.publish_queues.append(DETECT_QUEUE)
+    summarizer = AccelSummarizer(db, writer, cache) if SUMMARY else None
+    liveness = None
+    if LOST_AFTER > 0:
+        liveness = LivenessTracker(writer, LOST_AFTER, HEARTBEAT_INTERVAL)
+        liveness.start()
+    processor.stationary_v1_handler = StationaryV1Handler(db, writer, cache, ACCEL_FORMAT, detector, summarizer,
+                                                          liveness, metrics)
+    processor.mobile_handler = MobileHandler(db, writer, cache, ACCEL_FORMAT, detector, summarizer, liveness,
+                                             metrics)
+    if CONTINUOUS:
+        processor.continuous_handler = ContinuousHandler(db, writer, cache, ACCEL_FORMAT, summarizer, liveness)
+    if LOCATE:
+        processor.trigger_handler = TriggerHandler(db)
+    if shard is not None:
+        processor.use_shard(shard)
+    replayer = None
+    if SPILL_DIR:
+        spill_dir = os.path.join(SPILL_DIR, 'shard%d' % shard) if shard is not None else SPILL_DIR
+        processor.spill_log = SpillLog(spill_dir)
+        processor.spill_gate = SpillGate(db, writer, SPILL_MAX_LATENCY)
+        replayer = SpillReplayer(processor.spill_log, processor.spill_gate, processor.replay, SPILL_REPLAY_RATE)
+        replayer.start()
+    if metrics:
+        metrics.gauge('ecn_bulk_pending_operations', 'Documents waiting for the next bulk write', writer.pending_ops)
+        metrics.gauge('ecn_bulk_last_flush_seconds', 'Duration of the last bulk write',
+                      lambda: writer.last_flush_latency)
+        if processor.worker_pool:
+            metrics.gauge('ecn_worker_in_flight', 'Deliveries queued or running on worker threads',
+                          lambda: processor.worker_pool.in_flight)
+        if processor.spill_gate:
+            metrics.gauge('ecn_spilling', '1 while messages go to the spill log',
+                          lambda: int(processor.spill_gate.spilling))
+        metrics.serve(METRICS_PORT + (shard or 0), METRICS_HOST)
+    if stats_queue is not None:
+        def report_stats():
+            while True:
+                time.sleep(STATS_INTERVAL)
+                stats = {'writer': writer.stats(), 'cache': cache.stats()}
+                if detector:
+                    stats['detector'] = detector.stats()
+                if liveness:
+                    stats['liveness'] = liveness.stats()
+                if replayer:
+                    stats['spill'] = dict(processor.spill_log.stats(), **replayer.stats())
+                stats_queue.put((shard, stats))
+        threading.Thread(target=report_stats, name='ecn-stats', daemon=True).start()
+    #processor.connect(AMQP_HOST, AMQP_VHOST, AMQP_USER, AMQP_PASSWORD)
+    #processor.run()
+    processor.connect_and_run_forever(AMQP_HOST, AMQP_VHOST, AMQP_USER, AMQP_PASSWORD)
+
+
+def run_router(shards: int):
+    """Moves messages from the main queues to the shard queues."""
+    router = ShardRouter(shards, continuous=CONTINUOUS, triggers=LOCATE)
+    router.connect_and_run_forever(AMQP_HOST, AMQP_VHOST, AMQP_USER, AMQP_PASSWORD)
+
+
+def supervise(shards: int):
+    """Runs the shard router and one worker process per shard, restarting any that exits."""
+    stats_queue = multiprocessing.Queue()
+    targets = {'router': (run_router, (shards,))}
+    for shard in range(shards):
+        targets['shard%d' % shard] = (run_worker, (shard, stats_queue))
+    processes = {}
+    shard_stats = {}
+    reported_at = time.monotonic()
+    try:
+        while True:
+            for name, (target, args) in targets.items():
+                process = processes.get(name)
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        logger.warning('***** %s exited with %s, restarting...', name, process.exitcode)
+                    process = multiprocessing.Process(target=target, args=args, name=name, daemon=True)
+                    process.start()
+                    processes[name] = process
+            try:
+                shard, stats = stats_queue.get(timeout=1)
+                shard_stats[shard] = stats
+            except queue.Empty:
+                pass
+            if shard_stats and time.monotonic() - reported_at >= STATS_INTERVAL:
+                reported_at = time.monotonic()
+                totals = {}
+                for stats in shard_stats.values():
+                    for section, values in stats.items():
+                        section_totals = totals.setdefault(section, {})
+                        for key, value in values.items():
+                            section_totals[key] = section_totals.get(key, 0) + value
+                logger.info('Stats of %d/%d shards: %s', len(shard_stats), shards, totals)
+    except KeyboardInterrupt:
+        logger.info('***** Interrupted by keyboard, shutting down...')
+        for process in processes.values():
+            process.terminate()
+
+
+if __name__ == '__main__':
+    if SHARDS > 0:
+        supervise(SHARDS)
+    else:
+        run_worker()
@@ -0,0 +1,47 @@
+import bson
+import numpy as np
+
+from ecn import AccelFormat
+from ecn.accel_format import decode_seconds, encode_second, encode_seconds, read_hour
+
+
+def test_float32_seconds_round_trip_through_bson():
+    rows = np.array([[0.5, np.nan, -1.25], [1.0, 2.0, 3.0]], dtype=np.float32)
+    seconds = encode_seconds(rows, AccelFormat.FLOAT32)
+    assert [len(second) for second in seconds] == [12, 12]
+
+    stored = bson.decode(bson.encode({'z': seconds}))['z']
+    np.testing.assert_array_equal(decode_seconds(stored, 3), rows)
+
+
+def test_list_seconds_use_none_for_nan():
+    rows = np.array([[0.5, np.nan], [1.0, 2.0]])
+    assert encode_seconds(rows, AccelFormat.LIST) == [[0.5, None], [1.0, 2.0]]
+    assert encode_second([0.5, None], AccelFormat.LIST) == [0.5, None]
+    np.testing.assert_array_equal(np.frombuffer(encode_second([0.5, None], AccelFormat.FLOAT32), '<f4'),
+                                  np.array([0.5, np.nan], '<f4'))
+
+
+def test_decode_pads_partial_and_missing_seconds_with_nan():
+    rows = decode_seconds([[1.0, None], None, encode_second([2.0, 3.0, 4.0], AccelFormat.FLOAT32)], 3)
+    np.testing.assert_array_equal(rows, np.array([[1, np.nan, np.nan], [np.nan] * 3, [2, 3, 4]], np.float32))
+
+
+def test_read_hour_of_complete_float32_hour_is_a_view():
+    samples = np.arange(3 * 3600 * 2, dtype=np.float32).reshape(3, 3600, 2)
+    doc = {'v': AccelFormat.FLOAT32, 'r': 2}
+    for channel, rows in zip('zne', samples):
+        doc[channel] = encode_seconds(rows, AccelFormat.FLOAT32)
+    hour = read_hour(doc)
+    assert hour.shape == (3, 7200)
+    assert not hour.flags.writeable
+    np.testing.assert_array_equal(hour, samples.reshape(3, 7200))
+
+
+def test_read_hour_of_sparse_list_hour():
+    z = [None] * 3600
+    z[1] = [0.5, 0.25]
+    hour = read_hour({'r': 2, 'z': z}, channels=('z', 'n'))
+    assert hour.shape == (2, 7200)
+    np.testing.assert_array_equal(hour[0, 2:4], [0.5, 0.25])
+    assert np.isnan(hour[0, :2]).all() and np.isnan(hour[1]).all()
@@ -0,0 +1,207 @@
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.fake_mongo import FakeDatabase
+from benchmarks.ingest import FakeChannel, FakeConnection, Method
+from ecn import StationState
+from ecn.amqp import AmqpProcessor, DeliveryTracker
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.liveness import LivenessTracker
+
+
+class ThreadRecordingChannel(FakeChannel):
+    """Records the thread of every ack and nack."""
+
+    def __init__(self):
+        super().__init__()
+        self.ack_threads = []
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        self.ack_threads.append(threading.current_thread().name)
+        super().basic_ack(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True):
+        self.ack_threads.append(threading.current_thread().name)
+        super().basic_nack(delivery_tag, requeue)
+
+
+def run_in_thread(name: str, target):
+    thread = threading.Thread(target=target, name=name)
+    thread.start()
+    thread.join()
+
+
+def make_processor(max_ops: int) -> AmqpProcessor:
+    processor = AmqpProcessor()
+    processor.bulk_writer = AccelBulkWriter(FakeDatabase(latency=0, per_doc=0), max_ops=max_ops)
+    processor.conn = FakeConnection()
+    processor.on_channel_open(ThreadRecordingChannel())
+    return processor
+
+
+def test_liveness_flush_acks_on_ioloop():
+    processor = make_processor(max_ops=2)
+    writer = processor.bulk_writer
+    channel = processor.channel
+    liveness = LivenessTracker(writer, lost_after=1, tick=1)
+    liveness.seen('S1', StationState.HIGH_RATE, datetime(2019, 8, 2, 13))
+    writer.flush()
+
+    writer.set_accel('2019080213:S1', {'z.0': [0.1]})
+    processor.ack_when_written(channel, 1)
+    # Marking the station lost fills the writer, which flushes from the liveness thread
+    run_in_thread('ecn-liveness', lambda: liveness.tick(liveness.position + 10.0))
+    assert writer.pending_ops() == 0
+    assert channel.ack_threads == []
+
+    processor.conn.ioloop.run_pending()
+    assert channel.acked.keys() == {1}
+    assert channel.ack_threads == [threading.current_thread().name]
+
+
+def test_ack_on_ioloop_flush_is_immediate():
+    processor = make_processor(max_ops=2)
+    channel = processor.channel
+    processor.bulk_writer.set_accel('2019080213:S1', {'z.0': [0.1]})
+    processor.ack_when_written(channel, 1)
+    processor.bulk_writer.set_accel('2019080213:S2', {'z.0': [0.2]})
+    assert channel.acked.keys() == {1}
+    assert channel.ack_threads == [threading.current_thread().name]
+
+
+def test_failed_flush_nacks_on_ioloop():
+    processor = make_processor(max_ops=2)
+    writer = processor.bulk_writer
+    channel = processor.channel
+
+    def fail(requests, ordered=True):
+        raise ConnectionError('down')
+
+    writer.db.accel.bulk_write = fail
+    writer.set_accel('2019080213:S1', {'z.0': [0.1]})
+    processor.ack_when_written(channel, 1)
+    run_in_thread('ecn-bulk-flusher', writer.flush)
+    assert channel.ack_threads == []
+
+    processor.conn.ioloop.run_pending()
+    assert channel.nacked == 1
+    assert channel.ack_threads == [threading.current_thread().name]
+
+
+def test_delivery_tracker_coalesces_acks_in_delivery_order():
+    tracker = DeliveryTracker()
+    for delivery_tag in (1, 2, 3, 4):
+        tracker.delivered(delivery_tag)
+    assert tracker.finish(3)
+    assert not tracker.finish(2, requeue=False)
+    # 1 is still running, so nothing can be acked yet
+    assert tracker.drain() == (None, [(2, False)])
+
+    tracker.finish(1)
+    assert tracker.drain() == (3, [])
+    tracker.finish(4)
+    assert tracker.drain() == (4, [])
+
+
+class ListHandler:
+    """Fails on bodies starting with ``!``."""
+
+    def __init__(self):
+        self.bodies = []
+
+    @staticmethod
+    def partition_key(body: bytes) -> bytes:
+        return body[:2]
+
+    def receive(self, body: bytes):
+        if body.startswith(b'!'):
+            raise ValueError('broken')
+        self.bodies.append(body)
+
+
+def test_workers_keep_station_order_and_ack_from_ioloop():
+    processor = AmqpProcessor(prefetch_count=100, workers=3)
+    processor.mobile_handler = ListHandler()
+    processor.bulk_writer = AccelBulkWriter(FakeDatabase(latency=0, per_doc=0))
+    processor.conn = FakeConnection()
+    processor.on_channel_open(ThreadRecordingChannel())
+    channel = processor.channel
+    bodies = [b'%02d-%03d' % (index % 5, index) for index in range(100)] + [b'!broken']
+    for delivery_tag, body in enumerate(bodies, 1):
+        channel.unacked.add(delivery_tag)
+        processor.consume_mobile_stream(channel, Method(delivery_tag), None, body)
+    while processor.worker_pool.in_flight:
+        time.sleep(0.001)
+    processor.conn.ioloop.run_pending()
+
+    for station in range(5):
+        prefix = b'%02d-' % station
+        station_bodies = [body for body in processor.mobile_handler.bodies if body.startswith(prefix)]
+        assert station_bodies == [body for body in bodies if body.startswith(prefix)]
+    assert channel.acked.keys() == set(range(1, 101))
+    assert channel.nacked == 1
+    assert set(channel.ack_threads) == {threading.current_thread().name}
+
+
+class ConsumeRecordingChannel(FakeChannel):
+    def __init__(self):
+        super().__init__()
+        self.consumed = {}
+        '''queue -> exclusive'''
+        self.declared = []
+        self.on_close = None
+
+    def add_on_close_callback(self, callback):
+        self.on_close = callback
+
+    def basic_consume(self, queue: str, on_message_callback, exclusive: bool = False) -> str:
+        self.consumed[queue] = exclusive
+        return super().basic_consume(queue, on_message_callback, exclusive)
+
+    def queue_declare(self, queue: str, durable: bool = False):
+        self.declared.append(queue)
+
+
+class ClosingConnection(FakeConnection):
+    def __init__(self):
+        super().__init__()
+        self.is_open = True
+        self.stopped = False
+        self.ioloop.stop = self.stop
+
+    def close(self):
+        self.is_open = False
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_consumes_only_queues_with_a_handler():
+    processor = AmqpProcessor()
+    processor.stationary_v1_handler = ListHandler()
+    processor.mobile_handler = ListHandler()
+    processor.conn = ClosingConnection()
+    processor.on_channel_open(ConsumeRecordingChannel())
+    assert processor.channel.consumed == {processor.QUEUE_STATIONARY_V1: True, processor.QUEUE_MOBILE_STREAM: True}
+    assert processor.channel.declared == []
+
+
+def test_reconnects_when_the_channel_closes():
+    processor = AmqpProcessor()
+    processor.mobile_handler = ListHandler()
+    processor.conn = ClosingConnection()
+    processor.on_channel_open(ConsumeRecordingChannel())
+    # e.g. the broker refusing to consume a queue which does not exist
+    processor.channel.on_close(processor.channel, 'NOT_FOUND - no queue')
+    assert not processor.conn.is_open
+    processor.on_connection_closed(processor.conn, 'closed by client')
+    assert processor.conn.stopped
+
+
+def test_trigger_queue_is_shared_with_other_consumers():
+    processor = AmqpProcessor()
+    processor.trigger_handler = ListHandler()
+    processor.conn = ClosingConnection()
+    processor.on_channel_open(ConsumeRecordingChannel())
+    assert processor.channel.consumed == {processor.QUEUE_TRIGGER: False}
@@ -0,0 +1,45 @@
+import numpy as np
+from bson import json_util
+from bson.binary import Binary
+
+from ecn import AccelFormat
+from ecn.backfill import Transformer
+
+
+def transform_hour(doc: dict, accel_format: int) -> dict:
+    new_accels, accel_sets = Transformer({}, accel_format).transform(
+        [('hour', (None, json_util.dumps(doc).encode()), None)])
+    return accel_sets[doc['_id']]
+
+
+def test_list_hour_round_trips_exactly():
+    z = [None] * 3600
+    z[0] = [0.1, -0.2, 9.80665, 1e-7]
+    z[1] = [0.3, None, 0.5, 0.7]
+    # A partial second, e.g. the end of a mobile stream
+    z[2] = [0.1, 0.2]
+    doc = {'_id': '2019080213:S1', 'v': AccelFormat.LIST, 'r': 4, 'z': z, 'n': [[0.25] * 4], 'e': []}
+
+    fields = transform_hour(doc, AccelFormat.LIST)
+
+    assert fields == {'z.0': [0.1, -0.2, 9.80665, 1e-7], 'z.1': [0.3, None, 0.5, 0.7], 'z.2': [0.1, 0.2],
+                      'n.0': [0.25] * 4}
+    assert [len(fields['z.%d' % second]) for second in range(3)] == [4, 4, 2]
+
+
+def test_float32_hour_converts_to_list_as_stored():
+    samples = np.array([0.1, np.nan, -2.5], dtype='<f4')
+    doc = {'_id': '2019080213:S1', 'v': AccelFormat.FLOAT32, 'r': 3, 'z': [Binary(samples.tobytes())]}
+
+    fields = transform_hour(doc, AccelFormat.LIST)
+
+    assert fields == {'z.0': [float(samples[0]), None, -2.5]}
+
+
+def test_list_hour_converts_to_float32():
+    doc = {'_id': '2019080213:S1', 'v': AccelFormat.LIST, 'r': 3, 'z': [[0.1, None, -2.5], [0.5]]}
+
+    fields = transform_hour(doc, AccelFormat.FLOAT32)
+
+    np.testing.assert_array_equal(np.frombuffer(fields['z.0'], dtype='<f4'), np.array([0.1, np.nan, -2.5], 'f4'))
+    np.testing.assert_array_equal(np.frombuffer(fields['z.1'], dtype='<f4'), np.array([0.5, np.nan, np.nan], 'f4'))
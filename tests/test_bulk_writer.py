@@ -0,0 +1,86 @@
+import time
+
+import mongomock
+
+from ecn.bulk_writer import AccelBulkWriter
+
+
+def make_writer(**kwargs) -> AccelBulkWriter:
+    db = mongomock.MongoClient().ecn
+    db.accel.insert_one({'_id': 'A', 'z': [None] * 3})
+    db.accel.insert_one({'_id': 'B', 'z': [None] * 3})
+    db.station.insert_one({'_id': 1})
+    return AccelBulkWriter(db, **kwargs)
+
+
+def test_flushes_once_max_ops_documents_are_pending():
+    writer = make_writer(max_ops=2)
+    writer.set_accel('A', {'z.0': [0.1]})
+    writer.set_accel('A', {'z.1': [0.2]})
+    assert writer.pending_ops() == 1
+    assert writer.db.accel.find_one({'_id': 'A'})['z'] == [None, None, None]
+
+    writer.set_station(1, {'s': 'H'})
+    assert writer.pending_ops() == 0
+    assert writer.flush_count == 1
+    assert writer.db.accel.find_one({'_id': 'A'})['z'] == [[0.1], [0.2], None]
+    assert writer.db.station.find_one({'_id': 1})['s'] == 'H'
+
+
+def test_flush_if_due_waits_for_max_delay():
+    writer = make_writer(max_ops=100, max_delay=0.05)
+    writer.set_accel('A', {'z.0': [0.1]})
+    writer.flush_if_due()
+    assert writer.pending_ops() == 1
+
+    time.sleep(0.06)
+    writer.flush_if_due()
+    assert writer.pending_ops() == 0
+    assert writer.db.accel.find_one({'_id': 'A'})['z'][0] == [0.1]
+
+
+def test_later_set_of_the_same_path_wins():
+    writer = make_writer()
+    writer.set_accel('B', {'z.2': [1.0]})
+    writer.set_accel('B', {'z.2': [2.0]})
+    writer.flush()
+    assert writer.db.accel.find_one({'_id': 'B'})['z'][2] == [2.0]
+
+
+def test_summary_updates_merge_max_and_inc():
+    writer = make_writer()
+    writer.db.accel_summary.insert_one({'_id': 'S', 'p': 1.0, 'n': 1})
+    writer.update_summary('S', max_fields={'p': 3.0}, inc_fields={'n': 2})
+    writer.update_summary('S', set_fields={'r': 40}, max_fields={'p': 2.0}, inc_fields={'n': 1})
+    writer.flush()
+    doc = writer.db.accel_summary.find_one({'_id': 'S'})
+    assert (doc['p'], doc['n'], doc['r']) == (3.0, 4, 40)
+
+
+def test_callbacks_run_after_the_flush_of_earlier_writes():
+    writer = make_writer()
+    calls = []
+    writer.add_callback(lambda: calls.append('idle'))
+    assert calls == ['idle']
+
+    writer.set_accel('A', {'z.0': [0.1]})
+    writer.add_callback(lambda: calls.append('written'), lambda: calls.append('failed'))
+    assert calls == ['idle']
+    writer.flush()
+    assert calls == ['idle', 'written']
+
+
+def test_failed_flush_runs_failure_callbacks():
+    writer = make_writer()
+    calls = []
+
+    def fail(requests, ordered=True):
+        raise ConnectionError('down')
+
+    writer.db.accel.bulk_write = fail
+    writer.set_accel('A', {'z.0': [0.1]})
+    writer.add_callback(lambda: calls.append('written'), lambda: calls.append('failed'))
+    writer.flush()
+    assert calls == ['failed']
+    assert writer.error_count == 1
+    assert writer.last_flush_failed
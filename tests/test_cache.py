@@ -0,0 +1,67 @@
+import time
+
+import mongomock
+
+from ecn import AccelFormat
+from ecn.cache import MetadataCache
+
+
+class CountingLoader:
+    def __init__(self, station):
+        self.station = station
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.station
+
+
+def test_station_is_loaded_again_after_ttl():
+    cache = MetadataCache(station_ttl=0.05)
+    loader = CountingLoader({'_id': 1})
+    assert cache.find_station('S1', loader) == {'_id': 1}
+    assert cache.find_station('S1', loader) == {'_id': 1}
+    assert loader.calls == 1
+
+    time.sleep(0.06)
+    cache.find_station('S1', loader)
+    assert loader.calls == 2
+    assert (cache.station_hits, cache.station_misses) == (1, 2)
+
+
+def test_unknown_station_expires_after_negative_ttl():
+    cache = MetadataCache(station_ttl=60, negative_ttl=0.05)
+    loader = CountingLoader(None)
+    assert cache.find_station('S1', loader) is None
+    assert cache.find_station('S1', loader) is None
+    assert loader.calls == 1
+    assert cache.negative_hits == 1
+
+    loader.station = {'_id': 1}
+    time.sleep(0.06)
+    assert cache.find_station('S1', loader) == {'_id': 1}
+    assert loader.calls == 2
+
+
+def test_ensure_accel_preallocates_once_and_keeps_existing_data():
+    db = mongomock.MongoClient().ecn
+    cache = MetadataCache()
+    cache.ensure_accel(db.accel, '2019080213:1', 40, AccelFormat.FLOAT32)
+    doc = db.accel.find_one({'_id': '2019080213:1'})
+    assert (doc['v'], doc['r'], len(doc['z']), len(doc['n']), len(doc['e'])) == (2, 40, 3600, 3600, 3600)
+
+    db.accel.update_one({'_id': '2019080213:1'}, {'$set': {'z.0': b'data'}})
+    # A new process (empty cache) only upserts with $setOnInsert
+    MetadataCache().ensure_accel(db.accel, '2019080213:1', 40, AccelFormat.FLOAT32)
+    assert db.accel.find_one({'_id': '2019080213:1'})['z'][0] == b'data'
+
+    cache.ensure_accel(db.accel, '2019080213:1', 40, AccelFormat.FLOAT32)
+    assert (cache.accel_hits, cache.accel_misses) == (1, 1)
+
+
+def test_known_hours_are_evicted_least_recently_used_first():
+    db = mongomock.MongoClient().ecn
+    cache = MetadataCache(max_hours=2)
+    for accel_id in ('h1', 'h2', 'h1', 'h3'):
+        cache.ensure_accel(db.accel, accel_id, 40)
+    assert list(cache.accel_ids) == ['h1', 'h3']
@@ -0,0 +1,51 @@
+import mongomock
+import numpy as np
+from bson import ObjectId
+
+from ecn import qz_continuous3_pb2
+from ecn.continuous import ContinuousHandler
+
+STATION_ID = '5d4432f9e0f4a3b1c8d1e2f3'
+
+
+def make_stream(**fields) -> bytes:
+    msg = qz_continuous3_pb2.ContinuousStream(station_id=STATION_ID, start_time=1564750810000,
+                                              motion_sampling_rate=2, **fields)
+    # Device X points north, Y west and Z up: the same rotation (to ENU) for both samples
+    for index, value in zip((0, 1, 2, 4, 5, 6, 8, 9, 10), (0, -1, 0, 1, 0, 0, 0, 0, 1)):
+        getattr(msg, 'rotation_matrix_%d' % index).extend([value, value])
+    return msg.SerializeToString()
+
+
+def receive(body: bytes) -> dict:
+    db = mongomock.MongoClient().ecn
+    db.station.insert_one({'_id': ObjectId(STATION_ID)})
+    ContinuousHandler(db).receive(body)
+    return db
+
+
+def test_rotates_device_axes_to_zne():
+    db = receive(make_stream(raw_accel_x=[1, 0], raw_accel_y=[0, 1], raw_accel_z=[9.8, 9.8],
+                             linear_accel_x=[1, 0], linear_accel_y=[0, 1], linear_accel_z=[0, 0],
+                             rotation_rate_x=[0, 0], rotation_rate_y=[0, 0], rotation_rate_z=[0.5, 0.5]))
+    doc = db.accel.find_one({'_id': '2019080213:%s' % STATION_ID})
+    assert doc['r'] == 2
+    np.testing.assert_allclose([doc['z'][10], doc['n'][10], doc['e'][10]], [[0, 0], [1, 0], [0, -1]], atol=1e-6)
+    np.testing.assert_allclose(doc['az'][10], [9.8, 9.8], rtol=1e-6)
+    np.testing.assert_allclose(doc['gz'][10], [0.5, 0.5])
+    assert db.station.find_one({'_id': ObjectId(STATION_ID)})['s'] == 'H'
+
+
+def test_derives_linear_acceleration_from_gravity():
+    db = receive(make_stream(raw_accel_x=[1, 1], raw_accel_y=[0, 0], raw_accel_z=[9.8, 10.8],
+                             gravity_x=[0, 0], gravity_y=[0, 0], gravity_z=[9.8, 9.8]))
+    doc = db.accel.find_one({'_id': '2019080213:%s' % STATION_ID})
+    np.testing.assert_allclose([doc['z'][10], doc['n'][10], doc['e'][10]], [[0, 1], [1, 1], [0, 0]], atol=1e-5)
+    assert doc['gz'][10] == [None, None]
+
+
+def test_ignores_stream_without_rotation():
+    msg = qz_continuous3_pb2.ContinuousStream(station_id=STATION_ID, start_time=1564750810000,
+                                              motion_sampling_rate=2, raw_accel_x=[1], raw_accel_y=[0],
+                                              raw_accel_z=[9.8])
+    assert receive(msg.SerializeToString()).accel.count_documents({}) == 0
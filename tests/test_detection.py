@@ -0,0 +1,80 @@
+import mongomock
+import numpy as np
+
+from benchmarks.ingest import FakeConnection, Method
+from ecn import ecn_mobile_pb2, qz_triggered1_pb2
+from ecn.amqp import AmqpProcessor
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.cache import MetadataCache
+from ecn.detection import StaLtaDetector, TriggerPublisher
+from ecn.mobile import MobileHandler
+from tests.test_amqp import ConsumeRecordingChannel
+
+START_TIME = 1564750800
+SAMPLE_RATE = 20
+
+
+def quiet_then_shaking(seconds: int, onset: int) -> np.ndarray:
+    """(3, samples) Z/N/E of low noise, then strong shaking from ``onset`` seconds on."""
+    rng = np.random.default_rng(1)
+    zne = rng.normal(0, 0.01, (3, seconds * SAMPLE_RATE))
+    zne[:, onset * SAMPLE_RATE:] *= 100
+    return zne
+
+
+def test_triggers_once_on_a_step_in_amplitude():
+    triggers = []
+    detector = StaLtaDetector(on_trigger=lambda *trigger: triggers.append(trigger))
+    zne = quiet_then_shaking(30, onset=20)
+    # A second per message, as stations send them
+    triggered = [detector.update('S1', zne[:, second * SAMPLE_RATE:(second + 1) * SAMPLE_RATE], SAMPLE_RATE,
+                                 START_TIME + second) for second in range(30)]
+    # Triggered from the onset, until the LTA window catches up with the shaking
+    assert triggered.index(True) == 20
+    assert len(triggers) == 1
+    station_id, trigger_time, peak = triggers[0]
+    assert station_id == 'S1'
+    assert START_TIME + 20 <= trigger_time < START_TIME + 20.5
+    assert peak > 1
+
+
+def test_does_not_trigger_while_warming_up():
+    triggers = []
+    detector = StaLtaDetector(on_trigger=lambda *trigger: triggers.append(trigger))
+    # Shaking from the start: no full LTA window of quiet to compare with
+    assert not detector.update('S1', quiet_then_shaking(5, onset=0), SAMPLE_RATE, START_TIME)
+    assert not triggers
+
+
+def test_detected_trigger_reaches_the_detect_queue_with_the_station_location():
+    db = mongomock.MongoClient().ecn
+    db.station.insert_one({'_id': 300123, 'loc': {'type': 'Point', 'coordinates': [107.6, -6.9]}})
+    cache = MetadataCache()
+    processor = AmqpProcessor()
+    processor.conn = FakeConnection()
+    processor.bulk_writer = AccelBulkWriter(db)
+    detector = StaLtaDetector(on_trigger=TriggerPublisher(db, cache, processor.publish, 'ecn_detection'))
+    processor.publish_queues.append('ecn_detection')
+    processor.mobile_handler = MobileHandler(db, processor.bulk_writer, cache, detector=detector)
+    channel = ConsumeRecordingChannel()
+    processor.on_channel_open(channel)
+    assert 'ecn_detection' in channel.declared
+    assert 'ecn_detection' not in channel.consumed
+
+    zne = quiet_then_shaking(30, onset=20)
+    for second in range(30):
+        samples = zne[:, second * SAMPLE_RATE:(second + 1) * SAMPLE_RATE]
+        msg = ecn_mobile_pb2.MobileStream(station_id=300123, start_time=(START_TIME + second) * 1000,
+                                          sample_rate=SAMPLE_RATE, accel_z=samples[0], accel_n=samples[1],
+                                          accel_e=samples[2])
+        channel.unacked.add(second + 1)
+        processor.consume_mobile_stream(channel, Method(second + 1), None, msg.SerializeToString())
+    processor.conn.ioloop.run_pending()
+
+    assert [routing_key for routing_key, body in channel.published] == ['ecn_detection']
+    trigger = qz_triggered1_pb2.TriggerEvent()
+    trigger.ParseFromString(channel.published[0][1])
+    assert trigger.station_id == '300123'
+    assert trigger.motionLabel == qz_triggered1_pb2.TriggerEvent.MOTION
+    assert abs(trigger.latitude + 6.9) < 1e-4 and abs(trigger.longitude - 107.6) < 1e-4
+    assert START_TIME * 1000 + 20000 <= trigger.trigger_time < START_TIME * 1000 + 20500
@@ -0,0 +1,45 @@
+import numpy as np
+
+from ecn.export import MiniSeedWriter
+
+START = 1564750800 * 10000
+
+
+def write_mseed(tmp_path, samples: np.ndarray, sample_rate: int) -> bytes:
+    path = str(tmp_path / 'test.mseed')
+    writer = MiniSeedWriter(path, 'XX', 'TEST', '', 'BNZ', sample_rate)
+    writer.write(START, samples)
+    writer.close()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def record_time(record: bytes) -> int:
+    """Start of a record within its hour, in 0.0001 s."""
+    return (record[25] * 60 + record[26]) * 10000 + int.from_bytes(record[28:30], 'big')
+
+
+def words(record: bytes, first: int, count: int) -> list:
+    return [int.from_bytes(record[index:index + 4], 'big') for index in range(first, first + 4 * count, 4)]
+
+
+def test_steim2_record_matches_hand_encoding(tmp_path):
+    # Counts 100, 101, 99, 104: differences 0 (first of the segment), 1, -2, 5 fit one word of 4 8-bit differences
+    record = write_mseed(tmp_path, np.array([100, 101, 99, 104], dtype=np.float32) * 1e-6, 40)
+    assert len(record) == 4096
+    assert record[:20] == b'000001D TEST   BNZXX'
+    assert record[20:30] == bytes.fromhex('07e3 00d6 0d 00 00 00 0000')  # 2019, day 214, 13:00:00.0000
+    assert int.from_bytes(record[30:32], 'big') == 4
+    assert record[48:56] == bytes.fromhex('03e8 0000 0b 01 0c 00')  # blockette 1000: Steim2, big endian, 4096
+    assert words(record, 64, 5) == [1 << 24, 100, 104, 0x0001fe05, 0]
+
+
+def test_record_after_a_gap_starts_at_its_exact_sample_time(tmp_path):
+    # At 3 Hz, sample 4 is at 1.3333 s: rounded once, not as the segment start plus a record offset
+    samples = np.full(3600 * 3, 1e-6, dtype=np.float32)
+    samples[:4] = np.nan
+    record = write_mseed(tmp_path, samples, 3)
+    assert record_time(record) == 13333
+    # The next record starts at sample 4 + the sample count of the first
+    count = int.from_bytes(record[30:32], 'big')
+    assert record_time(record[4096:]) == round((4 + count) * 10000 / 3)
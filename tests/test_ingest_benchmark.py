@@ -0,0 +1,78 @@
+import json
+from argparse import Namespace
+
+import pytest
+
+from benchmarks.fleet import Fleet
+from benchmarks.ingest import compare, main, run
+from ecn import ecn_mobile_pb2
+
+
+def bench_args(**options) -> Namespace:
+    """The defaults of ``python -m benchmarks.ingest``, on a small fleet without simulated latency."""
+    args = Namespace(v1=4, mobile=4, seconds=90, seed=42, workers=0, prefetch=500, max_ops=500, max_delay=0.25,
+                     accel_format=1, detect=True, summary=True, liveness=True, metrics=False, latency=0.0,
+                     per_doc=0.0, memory=False, save=None, compare=None)
+    vars(args).update(options)
+    return args
+
+
+def test_fleet_is_reproducible():
+    first, again = (list(Fleet(3, 3, seed=7).messages(20)) for _ in range(2))
+    assert first == again
+    assert list(Fleet(3, 3, seed=8).messages(20)) != first
+
+
+def test_fleet_streams_cross_the_hour_and_burst_during_the_quake():
+    fleet = Fleet(2, 20)
+    messages = list(fleet.messages(90))
+    assert {key for received_at, key, body in messages} == {'stationary_v1', 'mobile_stream'}
+    hours = set()
+    per_second = {}
+    for received_at, key, body in messages:
+        if key == 'mobile_stream':
+            msg = ecn_mobile_pb2.MobileStream()
+            msg.ParseFromString(body)
+            hours.add(msg.start_time // 3600000)
+            per_second[int(received_at)] = per_second.get(int(received_at), 0) + 1
+    assert len(hours) == 2
+    # Phones which feel the quake upload every second
+    quiet = sum(per_second.get(fleet.start_second + second, 0) for second in range(10, 40))
+    shaking = sum(per_second.get(fleet.start_second + second, 0) for second in range(60, 90))
+    assert shaking > 1.5 * quiet
+
+
+def test_run_acks_every_message_and_publishes_triggers():
+    args = bench_args(workers=2)
+    messages = list(Fleet(args.v1, args.mobile, args.seed).messages(args.seconds))
+    results = run(args, messages)
+    assert results['messages'] == len(messages)
+    assert results['nacked'] == 0
+    assert results['detections'] > 0
+    assert results['per_queue']['stationary_v1']['messages'] == args.v1 * args.seconds
+    assert results['mongo_ops_per_msg'] < 1
+
+
+def test_compare_flags_changes_beyond_thresholds(capsys):
+    baseline = {'commit': 'abc1234', 'time': '2019-08-02T13:00:00',
+                'results': {'msgs_per_s': 1000.0, 'handler_p99_ms': 2.0, 'mongo_ops_per_msg': 0.1}}
+    assert not compare({'msgs_per_s': 950.0, 'handler_p99_ms': 1.0, 'mongo_ops_per_msg': 0.1}, baseline)
+    # Throughput regresses when it falls, latency when it rises
+    assert compare({'msgs_per_s': 850.0, 'handler_p99_ms': 2.0, 'mongo_ops_per_msg': 0.1}, baseline)
+    assert compare({'msgs_per_s': 1200.0, 'handler_p99_ms': 2.5, 'mongo_ops_per_msg': 0.1}, baseline)
+    assert 'REGRESSION' in capsys.readouterr().out
+
+
+def test_main_exits_on_regression_against_saved_results(tmp_path):
+    saved = str(tmp_path / 'before.json')
+    options = ['--v1', '2', '--mobile', '2', '--seconds', '5', '--latency', '0', '--no-memory']
+    main(options + ['--save', saved])
+    with open(saved) as f:
+        run_info = json.load(f)
+    assert run_info['config']['v1'] == 2 and run_info['results']['nacked'] == 0
+
+    run_info['results']['mongo_ops_per_msg'] /= 2
+    with open(saved, 'w') as f:
+        json.dump(run_info, f)
+    with pytest.raises(SystemExit):
+        main(options + ['--compare', saved])
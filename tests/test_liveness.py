@@ -0,0 +1,62 @@
+import time
+from datetime import datetime
+
+from benchmarks.fake_mongo import FakeDatabase
+from ecn import StationState
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.liveness import LivenessTracker
+
+SEEN_AT = datetime(2019, 8, 2, 13)
+
+
+def station_sets(writer: AccelBulkWriter) -> dict:
+    return writer.take_pending()[1]
+
+
+def test_writes_state_changes_and_marks_silent_stations_lost():
+    writer = AccelBulkWriter(FakeDatabase(latency=0, per_doc=0), max_ops=1000)
+    liveness = LivenessTracker(writer, lost_after=10, heartbeat_interval=1000, tick=1)
+    start = time.monotonic()
+    liveness.seen('S1', StationState.HIGH_RATE, SEEN_AT)
+    liveness.seen('S2', StationState.HIGH_RATE, SEEN_AT)
+    liveness.seen('S1', StationState.HIGH_RATE, SEEN_AT)
+    assert station_sets(writer) == {'S1': {'s': StationState.HIGH_RATE, 't': SEEN_AT},
+                                    'S2': {'s': StationState.HIGH_RATE, 't': SEEN_AT}}
+
+    liveness.tick(start + 5)
+    assert station_sets(writer) == {}
+    liveness.tick(start + 12)
+    assert station_sets(writer) == {'S1': {'s': StationState.LOST}, 'S2': {'s': StationState.LOST}}
+    # Lost once, not again on the next turn of the wheel
+    liveness.tick(start + 30)
+    assert station_sets(writer) == {}
+    assert liveness.stats()['lost'] == 2
+
+    liveness.seen('S1', StationState.ALERT, SEEN_AT)
+    assert station_sets(writer) == {'S1': {'s': StationState.ALERT, 't': SEEN_AT}}
+
+
+def test_station_seen_again_is_rescheduled_not_lost():
+    writer = AccelBulkWriter(FakeDatabase(latency=0, per_doc=0), max_ops=1000)
+    liveness = LivenessTracker(writer, lost_after=10, heartbeat_interval=1000, tick=1)
+    start = time.monotonic()
+    liveness.seen('S1', StationState.HIGH_RATE, SEEN_AT)
+    station_sets(writer)
+    liveness.stations['S1'].last_seen = start + 8
+    liveness.tick(start + 12)
+    assert station_sets(writer) == {}
+    liveness.tick(start + 19)
+    assert station_sets(writer) == {'S1': {'s': StationState.LOST}}
+
+
+def test_heartbeats_batch_last_seen_times():
+    writer = AccelBulkWriter(FakeDatabase(latency=0, per_doc=0), max_ops=1000)
+    liveness = LivenessTracker(writer, lost_after=60, heartbeat_interval=5, tick=1)
+    start = time.monotonic()
+    later = datetime(2019, 8, 2, 13, 0, 3)
+    liveness.seen('S1', StationState.HIGH_RATE, SEEN_AT)
+    liveness.seen('S1', StationState.HIGH_RATE, later)
+    liveness.seen('S2', StationState.HIGH_RATE, SEEN_AT)
+    station_sets(writer)
+    liveness.tick(start + 6)
+    assert station_sets(writer) == {'S1': {'t': later}}
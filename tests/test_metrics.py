@@ -0,0 +1,91 @@
+import threading
+import urllib.request
+from collections import namedtuple
+
+import pika
+
+from ecn.metrics import Counter, Gauge, Histogram, IngestMetrics, MongoListener, published_at
+
+Started = namedtuple('Started', ['command_name', 'command', 'connection_id', 'request_id'])
+Finished = namedtuple('Finished', ['command_name', 'connection_id', 'request_id', 'duration_micros'])
+
+
+def test_counter_sums_threads_and_escapes_labels():
+    counter = Counter('ecn_test_total', 'Test', ('queue',))
+    counter.inc(('v1',))
+    thread = threading.Thread(target=lambda: counter.inc(('v1',), 2))
+    thread.start()
+    thread.join()
+    counter.inc(('say "hi"\n',), 0.5)
+    assert counter.render() == ['ecn_test_total{queue="say \\"hi\\"\\n"} 0.5', 'ecn_test_total{queue="v1"} 3']
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('ecn_test_seconds', 'Test', ('handler',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, ('mobile',))
+    assert histogram.render() == [
+        'ecn_test_seconds_bucket{handler="mobile",le="0.1"} 2',
+        'ecn_test_seconds_bucket{handler="mobile",le="1.0"} 3',
+        'ecn_test_seconds_bucket{handler="mobile",le="+Inf"} 4',
+        'ecn_test_seconds_sum{handler="mobile"} 3.65',
+        'ecn_test_seconds_count{handler="mobile"} 4',
+    ]
+
+
+def test_histogram_samples_one_in_n_calls():
+    histogram = Histogram('ecn_test_seconds', 'Test', sample_every=4)
+    assert [histogram.sample() for _ in range(8)] == [True, False, False, False] * 2
+
+
+def test_gauge_reads_value_or_labeled_values():
+    assert Gauge('ecn_test', 'Test', lambda: 7).render() == ['ecn_test 7']
+    assert Gauge('ecn_test', 'Test', lambda: {('b',): 2.5, ('a',): 1}, ('shard',)).render() == [
+        'ecn_test{shard="a"} 1', 'ecn_test{shard="b"} 2.5']
+
+
+def test_render_skips_failing_metrics():
+    metrics = IngestMetrics()
+    metrics.gauge('ecn_broken', 'Fails', lambda: 1 / 0)
+    metrics.gauge('ecn_pending', 'Pending writes', lambda: 3)
+    metrics.deliveries.inc(('ecn_mobile_stream',))
+    text = metrics.render()
+    assert '# HELP ecn_deliveries_total Messages delivered\n# TYPE ecn_deliveries_total counter\n' \
+           'ecn_deliveries_total{queue="ecn_mobile_stream"} 1\n' in text
+    assert 'ecn_broken' not in text
+    assert text.endswith('# TYPE ecn_pending gauge\necn_pending 3\n')
+
+
+def test_published_at_prefers_millisecond_header():
+    assert published_at(None) is None
+    assert published_at(pika.BasicProperties()) is None
+    assert published_at(pika.BasicProperties(timestamp=1564750800)) == 1564750800
+    assert published_at(pika.BasicProperties(timestamp=1564750800,
+                                              headers={'timestamp_in_ms': 1564750800250})) == 1564750800.25
+
+
+def test_mongo_listener_counts_commands_and_documents():
+    metrics = IngestMetrics()
+    listener = MongoListener(metrics)
+    listener.started(Started('update', {'update': 'accel', 'updates': [{}, {}, {}]}, 1, 10))
+    listener.started(Started('find', {'find': 'station'}, 1, 11))
+    listener.succeeded(Finished('update', 1, 10, 2500))
+    listener.failed(Finished('find', 1, 11, 100))
+    assert metrics.mongo_operations.values() == {('update', 'accel', 'ok'): 1, ('find', 'station', 'failed'): 1}
+    assert metrics.mongo_documents.values() == {('update', 'accel'): 3}
+    assert 'ecn_mongo_operation_seconds_sum{command="update"} 0.0025' in metrics.mongo_seconds.render()
+    assert not listener.started_commands
+
+
+def test_serves_metrics_over_http():
+    metrics = IngestMetrics()
+    metrics.deliveries.inc(('ecn_stationary_v1',))
+    server = metrics.serve(0)
+    try:
+        url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'ecn_deliveries_total{queue="ecn_stationary_v1"} 1' in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import mongomock
+import numpy as np
+
+from ecn import AccelFormat
+from ecn.accel_format import encode_seconds
+from ecn.query import WaveformReader
+
+
+def hour_doc(hour: str, first_value: float, accel_format: int) -> dict:
+    """Hour at 2 samples/s whose samples count up from ``first_value``, with only ``z`` and ``n`` stored."""
+    doc = {'_id': '%s:100001' % hour, 'v': accel_format, 'r': 2}
+    for index, channel in enumerate('zn'):
+        rows = first_value + index * 10000 + np.arange(3600 * 2, dtype=np.float32).reshape(3600, 2)
+        doc[channel] = encode_seconds(rows, accel_format)
+    return doc
+
+
+def make_db():
+    db = mongomock.MongoClient().ecn
+    db.accel.insert_many([hour_doc('2019080213', 0, AccelFormat.LIST),
+                          hour_doc('2019080214', 100000, AccelFormat.FLOAT32)])
+    return db
+
+
+def test_reads_across_an_hour_boundary():
+    # Recent hours are always fetched, old ones through the block cache: both paths must agree
+    for immutable_after in (1e12, 0):
+        reader = WaveformReader(make_db(), immutable_after=immutable_after)
+        waveform = reader.read_waveform(100001, datetime(2019, 8, 2, 13, 59, 58), datetime(2019, 8, 2, 14, 0, 2))
+        assert waveform.sample_rate == 2
+        assert waveform.data.dtype == np.float32 and waveform.data.shape == (3, 8)
+        np.testing.assert_array_equal(waveform.data[0], [7196, 7197, 7198, 7199, 100000, 100001, 100002, 100003])
+        np.testing.assert_array_equal(waveform.data[1, :2], [17196, 17197])
+        assert np.isnan(waveform.data[2]).all()
+        assert waveform.times[0] == np.datetime64('2019-08-02T13:59:58')
+        assert waveform.times[5] == np.datetime64('2019-08-02T14:00:00.500')
+
+
+def test_missing_hours_are_nan():
+    reader = WaveformReader(make_db())
+    waveform = reader.read_waveform(100001, datetime(2019, 8, 2, 14, 59, 59), datetime(2019, 8, 2, 15, 0, 1),
+                                    channels=('z',))
+    np.testing.assert_array_equal(waveform.data[0, :2], [107198, 107199])
+    assert np.isnan(waveform.data[0, 2:]).all()
+    assert reader.read_waveform(100002, 1564750800, 1564750810).data.shape == (3, 0)
+
+
+def test_old_hours_are_read_again_from_the_cache():
+    reader = WaveformReader(make_db())
+    first = reader.read_waveform(100001, datetime(2019, 8, 2, 13, 10, 30), datetime(2019, 8, 2, 13, 11, 30))
+    misses = reader.misses
+    # An overlapping window within the same minutes
+    again = reader.read_waveform(100001, datetime(2019, 8, 2, 13, 10, 40), datetime(2019, 8, 2, 13, 11, 20))
+    assert reader.misses == misses
+    assert reader.hits > 0
+    np.testing.assert_array_equal(again.data[:2], first.data[:2, 20:100])
@@ -0,0 +1,92 @@
+from collections import Counter, namedtuple
+
+from benchmarks.ingest import FakeChannel
+from ecn import ecn_mobile_pb2
+from ecn.mobile import MobileHandler
+from ecn.shard_router import ShardRouter
+from ecn.sharding import shard_of, shard_queue
+from ecn.stationary_v1 import StationaryV1Handler
+from tests.test_amqp import ConsumeRecordingChannel
+
+Method = namedtuple('Method', ['NAME', 'delivery_tag', 'multiple'])
+Frame = namedtuple('Frame', ['method'])
+
+
+def test_shard_of_is_stable_across_processes():
+    # CRC32, not hash(): these must never change, or stations move between shards on restart
+    assert [shard_of(key, 4) for key in (b'ECN-4', b'BENCH-0001', b'')] == [3, 0, 0]
+    assert shard_of(b'ECN-4', 7) == 0
+
+
+def test_stations_spread_over_shards():
+    counts = Counter(shard_of(('ECN-%d' % index).encode(), 4) for index in range(1000))
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert min(counts.values()) > 200
+
+
+def test_partition_keys_depend_only_on_the_station():
+    v1_keys = {StationaryV1Handler.partition_key(body) for body in (
+        b'{"clientID":"ECN-4","accelerations":[{"x":1,"y":2,"z":3}]}',
+        b'{"accelerations":[], "clientID": "ECN-4"}')}
+    assert v1_keys == {b'ECN-4'}
+
+    mobile_keys = set()
+    for start_time, samples in ((1564750800000, [0.1]), (1564750900000, [0.2, 0.3])):
+        msg = ecn_mobile_pb2.MobileStream(station_id=300123, start_time=start_time, sample_rate=1,
+                                          accel_z=samples, accel_n=samples, accel_e=samples)
+        mobile_keys.add(MobileHandler.partition_key(msg.SerializeToString()))
+    assert len(mobile_keys) == 1
+    assert mobile_keys != {b''}
+
+
+class ConfirmingChannel(FakeChannel):
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes, properties=None):
+        super().basic_publish(exchange, routing_key, body)
+
+
+def test_router_acks_deliveries_once_republishes_are_confirmed():
+    router = ShardRouter(shards=4)
+    channel = router.channel = ConfirmingChannel()
+    for delivery_tag, client_id in enumerate(('ECN-4', 'BENCH-0001', 'ECN-4'), 1):
+        channel.unacked.add(delivery_tag)
+        body = ('{"clientID":"%s","accelerations":[]}' % client_id).encode()
+        router.route(channel, delivery_tag, None, body, router.QUEUE_STATIONARY_V1,
+                     StationaryV1Handler.partition_key(body))
+    assert [routing_key for routing_key, body in channel.published] == [
+        shard_queue(router.QUEUE_STATIONARY_V1, 3), shard_queue(router.QUEUE_STATIONARY_V1, 0),
+        shard_queue(router.QUEUE_STATIONARY_V1, 3)]
+    assert not channel.acked
+
+    router.on_confirm(Frame(Method('Basic.Ack', 2, True)))
+    assert channel.acked.keys() == {1, 2}
+    router.on_confirm(Frame(Method('Basic.Nack', 3, False)))
+    assert channel.nacked == 1
+    assert not router.published
+
+
+class RouterChannel(ConsumeRecordingChannel):
+    def confirm_delivery(self, callback):
+        pass
+
+
+def test_router_consumes_continuous_queue_only_when_enabled():
+    router = ShardRouter(shards=2)
+    router.on_channel_open(RouterChannel())
+    assert router.QUEUE_CONTINUOUS not in router.channel.consumed
+    assert shard_queue(router.QUEUE_CONTINUOUS, 0) not in router.channel.declared
+
+    router = ShardRouter(shards=2, continuous=True)
+    router.on_channel_open(RouterChannel())
+    assert router.QUEUE_CONTINUOUS in router.channel.consumed
+    assert shard_queue(router.QUEUE_CONTINUOUS, 1) in router.channel.declared
+
+
+def test_router_routes_triggers_only_when_enabled():
+    router = ShardRouter(shards=2)
+    router.on_channel_open(RouterChannel())
+    assert router.QUEUE_TRIGGER not in router.channel.consumed
+
+    router = ShardRouter(shards=2, triggers=True)
+    router.on_channel_open(RouterChannel())
+    assert router.channel.consumed[router.QUEUE_TRIGGER] is False
+    assert router.channel.consumed[router.QUEUE_STATIONARY_V1] is True
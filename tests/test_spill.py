@@ -0,0 +1,78 @@
+import threading
+
+from benchmarks.fake_mongo import FakeDatabase
+from benchmarks.ingest import FakeConnection
+from ecn.amqp import AmqpProcessor
+from ecn.bulk_writer import AccelBulkWriter
+from ecn.spill import SpillGate, SpillLog, SpillReplayer
+from tests.test_amqp import ThreadRecordingChannel
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.bodies = []
+
+    @staticmethod
+    def partition_key(body: bytes) -> bytes:
+        return body[:2]
+
+    def receive(self, body: bytes):
+        self.bodies.append(body)
+
+
+def test_replay_flush_acks_live_deliveries_on_ioloop(tmp_path):
+    db = FakeDatabase(latency=0, per_doc=0)
+    writer = AccelBulkWriter(db, max_ops=100)
+    processor = AmqpProcessor()
+    processor.bulk_writer = writer
+    processor.trigger_handler = RecordingHandler()
+    processor.conn = FakeConnection()
+    processor.on_channel_open(ThreadRecordingChannel())
+    channel = processor.channel
+    log = SpillLog(str(tmp_path))
+    replayer = SpillReplayer(log, SpillGate(db, writer), processor.replay)
+
+    # A live delivery waiting for the next flush
+    writer.set_accel('2019080213:S1', {'z.0': [0.1]})
+    processor.ack_when_written(channel, 1)
+
+    replayed = []
+    batch = [(1, 'trigger', 1564750800.0, b'spilled')]
+    thread = threading.Thread(target=lambda: replayed.append(replayer.replay_batch(batch)),
+                              name='ecn-spill-replayer')
+    thread.start()
+    # Runs the replayed handler, then the ack of the flush the replayer made
+    while thread.is_alive():
+        processor.conn.ioloop.run_pending()
+        thread.join(0.001)
+    processor.conn.ioloop.run_pending()
+
+    assert replayed == [True]
+    assert processor.trigger_handler.bodies == [b'spilled']
+    assert channel.acked.keys() == {1}
+    assert channel.ack_threads == [threading.current_thread().name]
+
+
+def test_replay_skips_records_without_a_handler(tmp_path):
+    db = FakeDatabase(latency=0, per_doc=0)
+    writer = AccelBulkWriter(db, max_ops=100)
+    # Workers partition by the handler's key, before any handler runs
+    processor = AmqpProcessor(workers=2)
+    processor.bulk_writer = writer
+    processor.mobile_handler = RecordingHandler()
+    processor.conn = FakeConnection()
+    processor.on_channel_open(ThreadRecordingChannel())
+    replayer = SpillReplayer(SpillLog(str(tmp_path)), SpillGate(db, writer), processor.replay)
+
+    # Spilled while CONTINUOUS=1, replayed without a continuous handler
+    replayed = []
+    batch = [(1, 'continuous', 1564750800.0, b'orphan'), (2, 'mobile_stream', 1564750800.0, b'spilled')]
+    thread = threading.Thread(target=lambda: replayed.append(replayer.replay_batch(batch)),
+                              name='ecn-spill-replayer')
+    thread.start()
+    while thread.is_alive():
+        processor.conn.ioloop.run_pending()
+        thread.join(0.001)
+
+    assert replayed == [True]
+    assert processor.mobile_handler.bodies == [b'spilled']
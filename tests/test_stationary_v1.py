@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+import mongomock
+import numpy as np
+import pytest
+
+from ecn import PPTIK_GRAVITY, StationKind
+from ecn.stationary_v1 import StationaryV1Handler, decode_accelerations
+
+
+def decode(accelerations: str) -> np.ndarray:
+    client_id, xyz = decode_accelerations(('{"clientID":"ECN-1","accelerations":[%s]}' % accelerations).encode())
+    assert client_id == 'ECN-1'
+    return xyz
+
+
+def test_decodes_samples_in_their_key_order():
+    np.testing.assert_array_equal(decode('{"z":3,"x":1,"y":2},{"z":6,"x":4,"y":5}'), [[1, 2, 3], [4, 5, 6]])
+
+
+def test_decodes_samples_with_mixed_key_order():
+    np.testing.assert_array_equal(decode('{"z":0,"x":1,"y":2},{"x":5,"y":6,"z":7}'), [[1, 2, 0], [5, 6, 7]])
+
+
+def test_decodes_samples_with_extra_keys():
+    np.testing.assert_array_equal(decode('{"x":1,"y":2,"z":3,"t":100},{"x":4,"y":5,"z":6,"t":125}'),
+                                  [[1, 2, 3], [4, 5, 6]])
+
+
+def test_nan_null_and_missing_axes_are_nan():
+    xyz = decode('{"x":nan,"y":2,"z":null},{"x":4, "y": nan,"z":6}')
+    np.testing.assert_array_equal(xyz, [[np.nan, 2, np.nan], [4, np.nan, 6]])
+    np.testing.assert_array_equal(decode('{"x":nan,"y":2,"z":3,"t":1},{"x":4,"y":5}'),
+                                  [[np.nan, 2, 3], [4, 5, np.nan]])
+
+
+def test_decodes_empty_accelerations():
+    assert decode('').shape == (0, 3)
+
+
+def test_broken_message_raises():
+    with pytest.raises(ValueError):
+        decode('{"x":1,"y":2,"z":}')
+    with pytest.raises(ValueError):
+        decode_accelerations(b'{"accelerations":[]}')
+
+
+def test_receive_writes_calibrated_second():
+    db = mongomock.MongoClient().ecn
+    db.station.insert_one({'_id': 100001, 'k': StationKind.V1, 'i': 'ECN-1'})
+    handler = StationaryV1Handler(db)
+    received_at = datetime(2019, 8, 2, 13, 0, 11, tzinfo=timezone.utc).timestamp()
+    handler.receive(b'{"clientID":"ECN-1","accelerations":[{"x":0.5,"y":0.25,"z":9.5},{"x":nan,"y":0,"z":0}]}',
+                    received_at)
+
+    doc = db.accel.find_one({'_id': '2019080213:100001'})
+    assert doc['z'][10] == [PPTIK_GRAVITY - 9.5, PPTIK_GRAVITY]
+    assert doc['n'][10] == [0.5, None]
+    assert doc['e'][10] == [0.25, 0.0]
+    assert db.station.find_one({'_id': 100001})['s'] == 'H'
@@ -0,0 +1,47 @@
+import mongomock
+
+from ecn import qz_triggered1_pb2
+from ecn.gridloc import P_WAVE_VELOCITY, GridLocator, haversine
+from ecn.trigger import TriggerHandler
+
+EPICENTER = (-6.9, 107.6)
+ORIGIN_TIME = 1564750800.0
+STATIONS = [(-6.5, 107.0), (-7.4, 108.1), (-6.6, 108.3), (-7.2, 106.9), (-6.2, 107.7)]
+
+
+def arrival(lat: float, lon: float) -> float:
+    return ORIGIN_TIME + float(haversine(EPICENTER[0], EPICENTER[1], lat, lon)) / P_WAVE_VELOCITY
+
+
+def test_grid_locator_finds_epicenter_and_origin_time():
+    locator = GridLocator(*STATIONS[0])
+    for lat, lon in STATIONS:
+        locator.add_arrival(lat, lon, arrival(lat, lon))
+    estimate = locator.locate()
+    assert abs(estimate.lat - EPICENTER[0]) < 0.05 and abs(estimate.lon - EPICENTER[1]) < 0.05
+    assert abs(estimate.origin_time - ORIGIN_TIME) < 1
+
+
+def trigger(station_id: str, lat: float, lon: float, quake: bool = True) -> bytes:
+    msg = qz_triggered1_pb2.TriggerEvent(station_id=station_id, trigger_time=int(arrival(lat, lon) * 1000),
+                                         latitude=lat, longitude=lon)
+    if quake:
+        msg.quakeLabel = qz_triggered1_pb2.TriggerEvent.QUAKE
+    return msg.SerializeToString()
+
+
+def test_estimates_event_from_the_third_station_on():
+    db = mongomock.MongoClient().ecn
+    handler = TriggerHandler(db)
+    handler.receive(trigger('S0', *STATIONS[0]))
+    handler.receive(trigger('S0', *STATIONS[0]))
+    handler.receive(trigger('S9', *STATIONS[4], quake=False))
+    handler.receive(trigger('S1', *STATIONS[1]))
+    assert db.quake_estimate.count_documents({}) == 0
+
+    for index in (2, 3, 4):
+        handler.receive(trigger('S%d' % index, *STATIONS[index]))
+    estimate = db.quake_estimate.find_one()
+    assert estimate['_id'] == handler.event_id
+    assert estimate['n'] == 5
+    assert abs(estimate['lat'] - EPICENTER[0]) < 0.1 and abs(estimate['lon'] - EPICENTER[1]) < 0.1